@@ -7,12 +7,10 @@
 """ Configuration Manager """
 
 # import logging
-import aiopg.sa
-import sqlalchemy as sa
-from sqlalchemy.dialects.postgresql import JSONB
-from sqlalchemy.sql import text
 import copy
+import json
 
+from foglamp import db_pool
 from foglamp import logger
 
 __author__ = "Ashwin Gopalakrishnan"
@@ -20,18 +18,7 @@ __copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
 __license__ = "Apache 2.0"
 __version__ = "${VERSION}"
 
-_configuration_tbl = sa.Table(
-    'configuration',
-    sa.MetaData(),
-    sa.Column('key', sa.types.CHAR(10)),
-    sa.Column('description', sa.types.VARCHAR(255)),
-    sa.Column('value', JSONB),
-    sa.Column('ts', sa.types.TIMESTAMP)
-)
-"""Defines the table that data will be used for CRUD operations"""
-
 _valid_type_strings = ['boolean', 'integer', 'string', 'IPv4', 'IPv6', 'X509 certificate', 'password', 'JSON']
-_connection_string = "dbname='foglamp'"
 # _logger = logging.getLogger(__name__)
 _logger = logger.setup(__name__)
 
@@ -116,79 +103,56 @@ async def _validate_category_val(category_val, set_value_val_from_default_val=Tr
 
 
 async def _create_new_category(category_name, category_val, category_description):
-    async with aiopg.sa.create_engine(_connection_string) as engine:
-        async with engine.acquire() as conn:
-            await conn.execute(_configuration_tbl.insert().values(key=category_name, value=category_val,
-                                                                  description=category_description))
+    async with db_pool.acquire() as conn:
+        await conn.execute('INSERT INTO foglamp.configuration (key, value, description) '
+                           'VALUES ($1, $2, $3)',
+                           category_name, json.dumps(category_val), category_description)
 
 
 async def _read_all_category_names():
-    async with aiopg.sa.create_engine(_connection_string) as engine:
-        async with engine.acquire() as conn:
-            category_info = []
-            async for row in conn.execute(_configuration_tbl.select()):
-                category_info.append((row.key, row.description))
-            return category_info
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch('SELECT key, description FROM foglamp.configuration')
+        return [(row['key'], row['description']) for row in rows]
+
+
+def _json_loads(value):
+    """asyncpg returns json and jsonb values as strings"""
+    return None if value is None else json.loads(value)
 
 
 async def _read_category_val(category_name):
-    async with aiopg.sa.create_engine(_connection_string) as engine:
-        async with engine.acquire() as conn:
-            async for row in conn.execute(
-                    _configuration_tbl.select().where(_configuration_tbl.c.key == category_name)):
-                return row.value
+    async with db_pool.acquire() as conn:
+        return _json_loads(await conn.fetchval(
+            'SELECT value FROM foglamp.configuration WHERE key = $1', category_name))
 
 
 async def _read_item_val(category_name, item_name):
-    query_template = """
-        SELECT 
-            configuration.value::json->'{}' as value
-        FROM 
-            foglamp.configuration
-        WHERE 
-            configuration.key='{}'
-    """
-    query_full = query_template.format(item_name, category_name)
-    async with aiopg.sa.create_engine(_connection_string) as engine:
-        async with engine.acquire() as conn:
-            async for row in conn.execute(text(query_full).columns(_configuration_tbl.c.value)):
-                return row.value
+    async with db_pool.acquire() as conn:
+        return _json_loads(await conn.fetchval(
+            'SELECT value -> $1::text FROM foglamp.configuration WHERE key = $2',
+            item_name, category_name))
 
 
 async def _read_value_val(category_name, item_name):
-    query_template = """
-        SELECT 
-            configuration.value::json->'{}'->'value' as value
-        FROM 
-            foglamp.configuration
-        WHERE 
-            configuration.key='{}'
-    """
-    query_full = query_template.format(item_name, category_name)
-    async with aiopg.sa.create_engine(_connection_string) as engine:
-        async with engine.acquire() as conn:
-            async for row in conn.execute(text(query_full).columns(_configuration_tbl.c.value)):
-                return row.value
+    async with db_pool.acquire() as conn:
+        return _json_loads(await conn.fetchval(
+            "SELECT value -> $1::text -> 'value' FROM foglamp.configuration WHERE key = $2",
+            item_name, category_name))
 
 
 async def _update_value_val(category_name, item_name, new_value_val):
-    query_template = """
-            UPDATE foglamp.configuration 
-            SET value = jsonb_set(value, '{{{},value}}', '"{}"') 
-            WHERE key='{}'
-        """
-    query_full = query_template.format(item_name, new_value_val, category_name)
-    async with aiopg.sa.create_engine(_connection_string) as engine:
-        async with engine.acquire() as conn:
-            await conn.execute(query_full)
+    async with db_pool.acquire() as conn:
+        await conn.execute('UPDATE foglamp.configuration '
+                           'SET value = jsonb_set(value, $1::text[], $2::jsonb) '
+                           'WHERE key = $3',
+                           [item_name, 'value'], json.dumps(str(new_value_val)), category_name)
 
 
 async def _update_category(category_name, category_val, category_description):
-    async with aiopg.sa.create_engine(_connection_string) as engine:
-        async with engine.acquire() as conn:
-            await conn.execute(
-                _configuration_tbl.update().where(_configuration_tbl.c.key == category_name).values(value=category_val,
-                                                                                                    description=category_description))
+    async with db_pool.acquire() as conn:
+        await conn.execute('UPDATE foglamp.configuration SET value = $1, description = $2 '
+                           'WHERE key = $3',
+                           json.dumps(category_val), category_description, category_name)
 
 
 async def get_all_category_names():
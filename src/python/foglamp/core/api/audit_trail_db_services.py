@@ -4,18 +4,17 @@
 # See: http://foglamp.readthedocs.io/
 # FOGLAMP_END
 
-import asyncpg
 import json
 from enum import IntEnum
 
+from foglamp import db_pool
+
 
 __author__ = "Ashish Jabble"
 __copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
 __license__ = "Apache 2.0"
 __version__ = "${VERSION}"
 
-__DB_NAME = 'foglamp'
-
 
 class Severity(IntEnum):
     """Enumeration for log.severity"""
@@ -38,8 +37,6 @@ async def read_audit_entries(limit=None, offset=None, source=None, severity=None
     Returns:
             list of audit trail entries sorted with most recent first
     """
-    conn = await asyncpg.connect(database=__DB_NAME)
-
     _limit_clause = " LIMIT {0}".format(limit) if limit else " "
     _offset_clause = " "
     if limit:
@@ -57,7 +54,8 @@ async def read_audit_entries(limit=None, offset=None, source=None, severity=None
                 SELECT code AS source, (ts)::varchar AS timestamp, level AS severity, log AS details 
                 FROM log{where_clause}ORDER BY timestamp DESC{limit_clause}{offset_clause}
             """.format(limit_clause=_limit_clause, where_clause=_where_clause, offset_clause=_offset_clause)
-    rows = await conn.fetch(query)
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch(query)
 
     results = []
     for row in rows:
@@ -65,9 +63,6 @@ async def read_audit_entries(limit=None, offset=None, source=None, severity=None
                 'details': json.loads(row['details'])}
         results.append(data)
 
-    # Close the connection.
-    await conn.close()
-
     return results
 
 
@@ -77,17 +72,13 @@ async def read_log_codes():
     Returns:
             list of audit log codes
     """
-    conn = await asyncpg.connect(database=__DB_NAME)
-
     # Select code & description from the log_codes table
-    rows = await conn.fetch(
-        'SELECT code, description FROM log_codes')
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch(
+            'SELECT code, description FROM log_codes')
     columns = ('code', 'description')
     results = []
     for row in rows:
         results.append(dict(zip(columns, row)))
 
-    # Close the connection.
-    await conn.close()
-
     return results
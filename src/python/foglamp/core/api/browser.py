@@ -10,9 +10,14 @@ Experimental browser for extracting reading data from the FogLAMP data buffer
 Supports a number of REST API:
 
   http://<address>/foglamp/asset
-     - Return a summary count of all asset readings
+     - Return a summary count of all asset readings, the timestamps of the first and last
+       readings and the sensors seen, from foglamp.asset_catalog
   http://<address>/foglamp/asset/{asset_code}
     - Return a set of asset readings for the given asset 
+  http://<address>/foglamp/asset/{asset_code}/export
+    - Stream the readings for the given asset, oldest first, as newline delimited JSON
+      (format=ndjson, the default) or as CSV (format=csv). Takes the optional limit,
+      seconds, minutes and hours query parameters. Without limit, every reading is returned.
   http://<address>/foglamp/asset/{asset_code}/{reading}
     - Return a set of sensor readings for the specified asset and sensor
   http://<address>/foglamp/asset/{asset_code}/{reading}/summary
@@ -20,11 +25,15 @@ Supports a number of REST API:
   http://<address>/foglamp/asset/{asset_code}/{reading}/series
     - Return a time series (min, max and average) for the specified asset and
       sensor averages over seconds, minutes or hours. The selection of seconds, minutes
-      or hours is done via the group query parameter
+      or hours is done via the group query parameter, or any width via the bucket query
+      parameter, e.g. bucket=30s. Several sensors, separated by commas, can be read at once
+      and empty buckets can be filled with fill=null or fill=previous
 
   All but the /foglamp/asset API call take a set of optional query parameters
     limit=x     Return the first x rows only
     skip=x      skip first n entries and used with limit to implemented paged interfaces
+    after=x     Return the entries that follow the page that returned next=x. Only
+                supported by /foglamp/asset/{asset_code} and /foglamp/asset/{asset_code}/{reading}.
     seconds=x   Limit the data return to be less than x seconds old
     minutes=x   Limit the data returned to be less than x minutes old
     hours=x     Limit the data returned to be less than x hours old
@@ -32,22 +41,75 @@ Supports a number of REST API:
   Note seconds, minutes and hours can not be combined in a URL. If they are then only seconds
   will have an effect.
 
-  TODO: Improve error handling, use a connection pool
+  When after is supplied, even with an empty value for the first page, the result is an
+  object with the entries in readings and the value of after for the following page in
+  next. next is null on the last page. Unlike skip, after does not read the rows of the
+  previous pages again, so every page costs the same.
+
+  The summary and series APIs read numeric sensor values from foglamp.reading_aggregates,
+  which is maintained by foglamp.reading_aggregates, and only read the readings that have
+  not been aggregated yet from the readings table. Buckets are only read whole: the
+  readings of the bucket that is partly within the time limit, and of the bucket that
+  holds the oldest reading of the asset in foglamp.asset_catalog, whose other readings
+  may have been purged, are read from the readings table. Older buckets only hold
+  readings that have been purged and are left out.
+
+  TODO: Improve error handling
 """
 
-import asyncpg
+import datetime
 import json
+import re
+from collections import OrderedDict
 from aiohttp import web
 
+from foglamp import db_pool
+from foglamp import reading_aggregates
+
 __author__ = "Mark Riddoch"
 __copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
 __license__ = "Apache 2.0"
 __version__ = "${VERSION}"
 
-__DB_NAME = 'foglamp'
 __DEFAULT_LIMIT = 20
 __DEFAULT_OFFSET = 0
 __TIMESTAMP_FMT = 'YYYY-MM-DD HH24:MI:SS.MS'
+_AFTER_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+"""Format of the UTC user_ts in values of after"""
+
+_GROUPS = {
+    'seconds': 1,
+    'minutes': 60,
+    'hours': 3600,
+}
+"""Series group: bucket width in seconds"""
+
+_BUCKET_PATTERN = re.compile(r'^(\d+)([smhd]?)$')
+"""Series bucket width: a number of seconds, minutes, hours or days"""
+
+_BUCKET_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+_SERIES_FILLS = ('none', 'null', 'previous')
+"""Series fill: omit empty buckets, return them with null values or with the values of the previous bucket"""
+
+_OPEN_READINGS_CLAUSE = """
+    asset_code = $1
+    AND (user_ts < ${1} OR id > ${0})
+    AND reading ? $2
+"""
+"""Selects readings for an asset that are not in the reading_aggregates buckets that are read and have a
+value for a sensor. ${0} is reading_aggregates_state.last_id and ${1} is the start of the first bucket read."""
+
+_EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', None,
+               """json_build_object('timestamp', to_char(user_ts, '{0}'), 'reading', reading)::text"""),
+    'csv': ('text/csv', 'timestamp,reading',
+            """to_char(user_ts, '{0}') || ',"' || replace(reading::text, '"', '""') || '"'"""),
+}
+"""Export format: (content type, header line, SQL expression that returns a line for a reading)"""
+
+_EXPORT_CHUNK_ROWS = 1000
+"""Number of readings fetched by each query and written to the response at once"""
 
 
 def setup(app):
@@ -56,6 +118,8 @@ def setup(app):
     """
     app.router.add_route('GET', '/foglamp/asset', asset_counts)
     app.router.add_route('GET', '/foglamp/asset/{asset_code}', asset)
+    # Before {reading}, which would match export too
+    app.router.add_route('GET', '/foglamp/asset/{asset_code}/export', asset_export)
     app.router.add_route('GET', '/foglamp/asset/{asset_code}/{reading}', asset_reading)
     app.router.add_route('GET', '/foglamp/asset/{asset_code}/{reading}/summary', asset_summary)
     app.router.add_route('GET', '/foglamp/asset/{asset_code}/{reading}/series', asset_averages)
@@ -63,25 +127,38 @@ def setup(app):
 async def asset_counts(request):
     """
     Browse all the assets for which we have recorded readings and
-    return a readings count.
+    return a readings count, the timestamps of the first and last readings
+    and the sensors that have been seen in the readings.
 
-    Return the result of the Postgres query 
-    SELECT asset_code, count(*) FROM readings GROUP BY asset_code;
+    The values are read from foglamp.asset_catalog, combined with the readings
+    that have not been added to it yet. Sensors of those readings are not included.
     """
 
-    conn = await asyncpg.connect(database=__DB_NAME)
-
-    # Select the assets from the readings table
-    rows = await conn.fetch(
-        'SELECT asset_code, count(*) FROM readings GROUP BY asset_code')
-    columns = ('asset_code', 'count')
+    query = """
+            WITH open_readings AS (
+                SELECT asset_code, count(*) AS reading_count, min(user_ts) AS first_ts, max(user_ts) AS last_ts
+                FROM foglamp.readings
+                WHERE id > $1
+                GROUP BY asset_code
+            )
+            SELECT asset_code,
+                   COALESCE(catalog.reading_count, 0) + COALESCE(open_readings.reading_count, 0) AS count,
+                   to_char(LEAST(catalog.first_ts, open_readings.first_ts), '{0}'),
+                   to_char(GREATEST(catalog.last_ts, open_readings.last_ts), '{0}'),
+                   COALESCE(catalog.reading_keys, '{{}}')
+            FROM foglamp.asset_catalog AS catalog FULL JOIN open_readings USING (asset_code)
+            WHERE COALESCE(catalog.reading_count, 0) + COALESCE(open_readings.reading_count, 0) > 0
+            ORDER BY asset_code
+            """.format(__TIMESTAMP_FMT)
+
+    async with db_pool.acquire() as conn:
+        async with conn.transaction(isolation='repeatable_read', readonly=True):
+            rows = await conn.fetch(query, await _aggregated_last_id(conn))
+    columns = ('asset_code', 'count', 'first_timestamp', 'last_timestamp', 'sensors')
     results = []
     for row in rows:
         results.append(dict(zip(columns, row)))
 
-    # Close the connection.
-    await conn.close()
-
     return web.json_response(results)
 
 async def asset(request):
@@ -89,50 +166,30 @@ async def asset(request):
     Browse a particular asset for which we have recorded readings and
     return a readings with timestamps for the asset. The number of readings
     return is defaulted to a small number (20), this may be changed by supplying
-    the query parameter ?limit=xx&skip=xx
+    the query parameter ?limit=xx&skip=xx or ?limit=xx&after=xx
 
-    Return the result of the Postgres query 
-    SELECT to_char(user_ts, '__TIMESTAMP_FMT') as "timestamp", (reading)::jsonFROM readings WHERE asset_code = 'asset_code' ORDER BY user_ts DESC LIMIT 20 OFFSET 0
+    Return the result of the Postgres query
+    SELECT to_char(user_ts, '__TIMESTAMP_FMT') as "timestamp", (reading)::json FROM readings WHERE asset_code = 'asset_code' ORDER BY user_ts DESC, id DESC LIMIT 20 OFFSET 0
     """
 
-    conn = await asyncpg.connect(database=__DB_NAME)
     asset_code = request.match_info.get('asset_code', '')
 
-    query = """
-            SELECT to_char(user_ts, '{0}') as "timestamp", (reading)::json
-            FROM readings WHERE asset_code = '{1}'
-            """.format(__TIMESTAMP_FMT, asset_code)
-
-    query += _where_clause(request)
-
-    # Add the order by and limit clause
-    limit = __DEFAULT_LIMIT
-    offset = __DEFAULT_OFFSET
-    if 'limit' in request.query:
-        limit = request.query['limit']
-        offset = request.query['skip'] if 'skip' in request.query else __DEFAULT_OFFSET
-
-    orderby = ' ORDER BY user_ts DESC LIMIT {0} OFFSET {1}'.format(limit, offset)
-    query += orderby
-
-    # Select the assets from the readings table
-    rows = await conn.fetch(query)
+    rows, next_after = await _fetch_page(
+        request, """to_char(user_ts, '{0}') as "timestamp", (reading)::json""".format(__TIMESTAMP_FMT),
+        asset_code)
     results = []
     for row in rows:
         jrow = {'timestamp': row['timestamp'], 'reading': json.loads(row['reading'])}
         results.append(jrow)
 
-    # Close the connection.
-    await conn.close()
-
-    return web.json_response(results)
+    return _page_response(request, results, next_after)
 
 async def asset_reading(request):
     """
     Browse a particular sensor value of a particular asset for which we have recorded readings and
     return the timestamp and reading value for that sensor. The number of rows returned
     is limited to a small number, this number may be altered by use of
-    the query parameter limit=xxx&skip=xxx.
+    the query parameter limit=xxx&skip=xxx or limit=xxx&after=xxx.
 
     The readings returned can also be time limited by use of the query
     parameter seconds=sss. This defines a number of seconds that the reading
@@ -149,42 +206,22 @@ async def asset_reading(request):
     Only one of hour, minutes or seconds should be supplied
 
     Return the result of the Postgres query 
-    SELECT to_char(user_ts, '__TIMESTAMP_FMT') as "Time", reading->>'reading' FROM readings WHERE asset_code = 'asset_code' ORDER BY user_ts DESC LIMIT 20 OFFSET 0
+    SELECT to_char(user_ts, '__TIMESTAMP_FMT') as "Time", reading->>'reading' FROM readings WHERE asset_code = 'asset_code' ORDER BY user_ts DESC, id DESC LIMIT 20 OFFSET 0
     """
 
-    conn = await asyncpg.connect(database=__DB_NAME)
     asset_code = request.match_info.get('asset_code', '')
     reading = request.match_info.get('reading', '')
 
-    query = """
-            SELECT to_char(user_ts, '{0}') as "Time", reading->>'{2}' 
-            FROM readings WHERE asset_code = '{1}'
-            """.format(__TIMESTAMP_FMT, asset_code, reading)
-
-    # Process additional where clause conditions
-    query += _where_clause(request)
-
-    # Add the order by and limit clause
-    limit = __DEFAULT_LIMIT
-    offset = __DEFAULT_OFFSET
-    if 'limit' in request.query:
-        limit = request.query['limit']
-        offset = request.query['skip'] if 'skip' in request.query else __DEFAULT_OFFSET
-
-    orderby = ' ORDER BY user_ts DESC LIMIT {0} OFFSET {1}'.format(limit, offset)
-    query += orderby
-
-    # Select the assets from the readings table
-    rows = await conn.fetch(query)
+    # $2 is the first parameter after asset_code
+    rows, next_after = await _fetch_page(
+        request, """to_char(user_ts, '{0}') as "Time", reading->>$2 AS value""".format(__TIMESTAMP_FMT),
+        asset_code, reading)
     columns = ('timestamp', reading)
     results = []
     for row in rows:
-        results.append(dict(zip(columns, row)))
-
-    # Close the connection.
-    await conn.close()
+        results.append(dict(zip(columns, (row['Time'], row['value']))))
 
-    return web.json_response(results)
+    return _page_response(request, results, next_after)
 
 async def asset_summary(request):
     """
@@ -206,34 +243,56 @@ async def asset_summary(request):
 
     Only one of hour, minutes or seconds should be supplied
 
-    Return the result of the Postgres query 
-    SELECT min(reading->>'reading'), max(reading->>'reading'), avg((reading->>'reading')::float) FROM readings WHERE asset_code = 'asset_code'
+    The values are read from the finest reading_aggregates buckets that are kept for
+    the requested time limit, combined with the readings that have not been aggregated yet
+    and the readings of the bucket that is partly within the time limit.
     """
 
-    conn = await asyncpg.connect(database=__DB_NAME)
     asset_code = request.match_info.get('asset_code', '')
     reading = request.match_info.get('reading', '')
 
-    query = """
-            SELECT min(reading->>'{1}'), max(reading->>'{1}'), avg((reading->>'{1}')::float)
-            FROM readings WHERE asset_code = '{0}'
-            """.format(asset_code, reading)
+    window_seconds = _window_seconds(request)
+    bucket_seconds = reading_aggregates.bucket_seconds_for_window(window_seconds)
 
-    query += _where_clause(request)
-    # Select the assets from the readings table
-    row = await conn.fetchrow(query)
+    query = """
+            WITH parts AS (
+                SELECT sum(count) AS count, sum(sum) AS sum, min(min) AS min, max(max) AS max
+                FROM foglamp.reading_aggregates
+                WHERE asset_code = $1 AND reading_key = $2 AND bucket_seconds = $3 {0}
+                UNION ALL
+                SELECT count(value), sum(value), min(value), max(value) FROM (
+                    SELECT {3} AS value
+                    FROM foglamp.readings
+                    WHERE {1} {2}
+                ) AS open_readings
+            )
+            SELECT min(min), max(max), sum(sum) / NULLIF(sum(count), 0) FROM parts
+            """
+
+    args = [asset_code, reading, bucket_seconds]
+    if window_seconds is not None:
+        args.append(window_seconds)
+
+    query = query.format(_buckets_start_clause(len(args) + 2),
+                         _OPEN_READINGS_CLAUSE.format(len(args) + 1, len(args) + 2),
+                         _user_ts_window_clause(window_seconds),
+                         reading_aggregates.NUMERIC_VALUE.format('reading->$2'))
+
+    async with db_pool.acquire() as conn:
+        async with conn.transaction(isolation='repeatable_read', readonly=True):
+            args.append(await _aggregated_last_id(conn))
+            first_ts = await _catalog_first_ts(conn, asset_code)
+            args.append(await _buckets_start(conn, bucket_seconds, window_seconds, first_ts))
+            row = await conn.fetchrow(query, *args)
     columns = ('min', 'max', 'average')
     results = dict(zip(columns, row))
 
-    # Close the connection.
-    await conn.close()
-
     return web.json_response({reading: results})
 
 async def asset_averages(request):
     """
     Browse all the assets for which we have recorded readings and
-    return a series of averages per second, minute or hour.
+    return a series of min, max and average values per bucket of time.
 
     The readings averaged can also be time limited by use of the query
     parameter seconds=sss. This defines a number of seconds that the reading
@@ -250,62 +309,408 @@ async def asset_averages(request):
     Only one of hour, minutes or seconds should be supplied
 
     The amount of time covered by each returned value is set using the
-    query parameter group. This may be set to seconds, minutes or hours
-
-    Return the result of the Postgres query 
-    SELECT user_ts avg((reading->>'reading')::float) FROM readings WHERE asset_code = 'asset_code' GROUP BY user_ts
+    query parameter group. This may be set to seconds, minutes or hours.
+    Alternatively, the query parameter bucket sets it to any whole number of
+    seconds, minutes, hours or days, for example bucket=30s or bucket=2h.
+
+    reading may be a comma separated list of sensors, which are read together. Each
+    returned entry then holds the time and the min, max and average per sensor in readings.
+
+    By default, buckets that have no readings are left out. The query parameter fill=null
+    returns them with null values and fill=previous with the values of the previous bucket.
+    The limit query parameter sets the number of buckets returned.
+
+    Each value is combined from the reading_aggregates buckets of the longest length
+    that the bucket width is a multiple of and that are kept for the time limit, or for
+    all the asset's readings without one, from the readings that have not been
+    aggregated yet and from the readings of the bucket that is partly within the time
+    limit. Per-second buckets are kept for a day and per-minute buckets for
+    31 days. When the bucket width is not a multiple of the length of the buckets that
+    are kept, the values are read from the readings table instead.
     """
 
-    conn = await asyncpg.connect(database=__DB_NAME)
     asset_code = request.match_info.get('asset_code', '')
-    reading = request.match_info.get('reading', '')
+    readings = list(OrderedDict.fromkeys(
+        reading for reading in request.match_info.get('reading', '').split(',') if reading))
+    if not readings:
+        raise web.HTTPBadRequest(reason='reading is required')
 
-    ts_restraint = 'YYYY-MM-DD HH24:MI:SS'
-    if 'group' in request.query:
-        if request.query['group'] == 'seconds':
-            ts_restraint = 'YYYY-MM-DD HH24:MI:SS'
-        elif request.query['group'] == 'minutes':
-            ts_restraint = 'YYYY-MM-DD HH24:MI'
-        elif request.query['group'] == 'hours':
-            ts_restraint = 'YYYY-MM-DD HH24'
+    width_seconds = _bucket_width_seconds(request)
 
-    query = """
-            SELECT to_char(user_ts, '{2}'), min(reading->>'{1}'), max(reading->>'{1}'), avg((reading->>'{1}')::float)
-            FROM readings WHERE asset_code = '{0}'
-            """.format(asset_code, reading, ts_restraint)
+    fill = request.query.get('fill', 'none')
+    if fill not in _SERIES_FILLS:
+        raise web.HTTPBadRequest(reason='fill must be one of {}'.format(', '.join(_SERIES_FILLS)))
 
-    query += _where_clause(request)
+    window_seconds = _window_seconds(request)
 
-    # Add the group by
-    query += """ GROUP BY to_char(user_ts, '{0}') ORDER BY 1""".format(ts_restraint)
+    try:
+        limit = int(request.query.get('limit', __DEFAULT_LIMIT))
+    except ValueError:
+        raise web.HTTPBadRequest(reason='limit must be an integer')
 
-    # Add the order by and limit clause
-    limit = __DEFAULT_LIMIT
-    if 'limit' in request.query:
-        limit = request.query['limit']
-    query += ' LIMIT {0}'.format(limit)
+    # $3, the length of the reading_aggregates buckets, depends on asset_catalog.first_ts
+    args = [asset_code, readings, None]
+    if window_seconds is not None:
+        args.append(window_seconds)
+    args.extend((width_seconds, limit))
+    width, limit_param = len(args) - 1, len(args)
+    last_id = len(args) + 1
 
-    # Select the assets from the readings table
-    rows = await conn.fetch(query)
-    columns = ('time', 'min', 'max', 'average')
+    # Buckets of width_seconds are numbered from the epoch
+    query = """
+            WITH buckets AS (
+                SELECT reading_key, bucket_ts, count, sum, min, max
+                FROM foglamp.reading_aggregates
+                WHERE asset_code = $1 AND reading_key = ANY($2::text[]) AND bucket_seconds = $3 {0}
+                UNION ALL
+                SELECT reading_key, user_ts, 1, value, value, value FROM (
+                    SELECT value.key AS reading_key, user_ts, {3} AS value
+                    FROM foglamp.readings, jsonb_each(reading) AS value
+                    WHERE asset_code = $1 AND (user_ts < ${5} OR id > ${4})
+                    AND value.key = ANY($2::text[]) {1}
+                ) AS open_readings
+                WHERE value IS NOT NULL
+            ), series AS (
+                SELECT reading_key, {2} AS bucket_ts,
+                       min(min) AS min, max(max) AS max, sum(sum) / sum(count) AS average
+                FROM buckets
+                GROUP BY 1, 2
+            )
+            """.format(_buckets_start_clause(last_id + 1), _user_ts_window_clause(window_seconds),
+                       _bucket_start('bucket_ts', width), reading_aggregates.NUMERIC_VALUE.format('value.value'),
+                       last_id, last_id + 1)
+
+    ts_format = _bucket_ts_format(width_seconds)
+
+    if fill == 'none':
+        query += """
+            , times AS (
+                SELECT DISTINCT bucket_ts FROM series ORDER BY bucket_ts LIMIT ${0}
+            )
+            SELECT to_char(times.bucket_ts, '{1}'), series.reading_key, series.min, series.max, series.average
+            FROM times JOIN series ON series.bucket_ts = times.bucket_ts
+            ORDER BY times.bucket_ts, series.reading_key
+            """.format(limit_param, ts_format)
+    else:
+        if window_seconds is None:
+            time_range = 'SELECT min(bucket_ts) AS first_ts, max(bucket_ts) AS last_ts FROM series'
+        else:
+            time_range = 'SELECT {0} AS first_ts, {1} AS last_ts'.format(
+                _bucket_start("now() - $4::double precision * interval '1 second'", width),
+                _bucket_start('now()', width))
+
+        # filled_from numbers the buckets after each bucket that has values, so that
+        # first_value over filled_from returns the values of the previous bucket
+        query += """
+            , times AS (
+                SELECT generate_series(first_ts, last_ts, ${0}::double precision * interval '1 second') AS bucket_ts
+                FROM ({1}) AS time_range
+                LIMIT ${2}
+            ), filled AS (
+                SELECT times.bucket_ts, keys.reading_key, series.min, series.max, series.average,
+                       count(series.bucket_ts) OVER (PARTITION BY keys.reading_key ORDER BY times.bucket_ts)
+                           AS filled_from
+                FROM times
+                CROSS JOIN unnest($2::text[]) AS keys(reading_key)
+                LEFT JOIN series ON series.bucket_ts = times.bucket_ts AND series.reading_key = keys.reading_key
+            )
+            SELECT to_char(bucket_ts, '{3}'), reading_key, {4}
+            FROM filled
+            WINDOW previous_values AS (PARTITION BY reading_key, filled_from ORDER BY bucket_ts)
+            ORDER BY bucket_ts, reading_key
+            """.format(width, time_range, limit_param, ts_format,
+                       'min, max, average' if fill == 'null' else
+                       'first_value(min) OVER previous_values, first_value(max) OVER previous_values, '
+                       'first_value(average) OVER previous_values')
+
+    async with db_pool.acquire() as conn:
+        async with conn.transaction(isolation='repeatable_read', readonly=True):
+            last_id = await _aggregated_last_id(conn)
+            first_ts = await _catalog_first_ts(conn, asset_code)
+
+            bucket_seconds = _series_bucket_seconds(width_seconds, window_seconds, first_ts)
+            if bucket_seconds is None:
+                # No buckets match $3. Every reading is read from the readings table.
+                last_id = 0
+
+            args[2] = bucket_seconds
+            args.extend((last_id, await _buckets_start(conn, bucket_seconds, window_seconds, first_ts)))
+            rows = await conn.fetch(query, *args)
+    columns = ('min', 'max', 'average')
     results = []
     for row in rows:
-        results.append(dict(zip(columns, row)))
+        values = dict(zip(columns, row[2:]))
+        if len(readings) == 1:
+            values['time'] = row[0]
+            results.append(values)
+        else:
+            if not results or results[-1]['time'] != row[0]:
+                results.append({'time': row[0], 'readings': {}})
+            results[-1]['readings'][row[1]] = values
+
+    return web.json_response(results)
+
+async def asset_export(request):
+    """
+    Stream the readings of an asset, oldest first, without holding them in memory.
+    Each line is produced by Postgres. Pages of _EXPORT_CHUNK_ROWS readings are read,
+    each starting after the last reading of the previous page, and written to the
+    response. The pool connection is released while a page is written, so slow
+    clients do not hold connections.
+
+    The query parameter format selects ndjson (the default) or csv. The readings can
+    be time limited by use of the query parameter seconds, minutes or hours and
+    their number by the query parameter limit.
+    """
+
+    asset_code = request.match_info.get('asset_code', '')
 
-    # Close the connection.
-    await conn.close()
+    export_format = request.query.get('format', 'ndjson')
+    if export_format not in _EXPORT_FORMATS:
+        raise web.HTTPBadRequest(reason='format must be one of {}'.format(', '.join(sorted(_EXPORT_FORMATS))))
+    content_type, header, line = _EXPORT_FORMATS[export_format]
+
+    args = [asset_code]
+    query = 'SELECT user_ts, id, {0} AS line FROM readings WHERE asset_code = $1'.format(
+        line.format(__TIMESTAMP_FMT))
+
+    window_seconds = _window_seconds(request)
+    if window_seconds is not None:
+        args.append(window_seconds)
+        query += _user_ts_window_clause(window_seconds, len(args))
+
+    limit = None
+    if 'limit' in request.query:
+        try:
+            limit = int(request.query['limit'])
+        except ValueError:
+            raise web.HTTPBadRequest(reason='limit must be an integer')
+
+    response = web.StreamResponse(headers={'Content-Type': '{0}; charset=utf-8'.format(content_type)})
+    await response.prepare(request)
+
+    lines = [] if header is None else [header]
+    after = None
+
+    while limit is None or limit > 0:
+        page_args = list(args)
+        page_query = query
+
+        if after is not None:
+            page_args.extend(after)
+            page_query += ' AND (user_ts, id) > (${0}::timestamptz, ${1}::bigint)'.format(
+                len(page_args) - 1, len(page_args))
+
+        page_rows = _EXPORT_CHUNK_ROWS if limit is None else min(limit, _EXPORT_CHUNK_ROWS)
+        page_args.append(page_rows)
+        page_query += ' ORDER BY user_ts, id LIMIT ${0}'.format(len(page_args))
+
+        async with db_pool.acquire() as conn:
+            rows = await conn.fetch(page_query, *page_args)
+
+        lines.extend(row['line'] for row in rows)
+        if lines:
+            await _write_lines(response, lines)
+            lines = []
+
+        if len(rows) < page_rows:
+            break
+
+        if limit is not None:
+            limit -= len(rows)
+        after = (rows[-1]['user_ts'], rows[-1]['id'])
+
+    # The header, when no page was read
+    if lines:
+        await _write_lines(response, lines)
+
+    await response.write_eof()
+    return response
+
+
+async def _aggregated_last_id(conn):
+    """Returns the largest readings.id that has been added to reading_aggregates and asset_catalog
+
+    Reading it before the query that combines the aggregates with the newer readings keeps
+    the value a constant, rather than a subquery that Postgres runs as an InitPlan. Both must
+    run in the same repeatable read transaction.
+    """
+    return await conn.fetchval('SELECT last_id FROM foglamp.reading_aggregates_state WHERE id = 1') or 0
+
+
+async def _catalog_first_ts(conn, asset_code):
+    """Returns the user_ts of the oldest aggregated reading of an asset that has not been purged, or None"""
+    return await conn.fetchval('SELECT first_ts FROM foglamp.asset_catalog WHERE asset_code = $1', asset_code)
+
+
+async def _buckets_start(conn, bucket_seconds, window_seconds, first_ts):
+    """Returns the start of the first reading_aggregates bucket of bucket_seconds that is read, or None
+    when no bucket is read
+
+    The bucket that is partly within the time limit, and the bucket that holds first_ts, whose
+    other readings may have been purged, are not read. Their readings are read from the readings
+    table. now() is the start of the transaction, the same as in the query that uses the value.
+
+    Args:
+        bucket_seconds: The length of the buckets or None
+        window_seconds: The time limit in seconds or None
+        first_ts: asset_catalog.first_ts. None: Every aggregated reading has been purged.
+    """
+    if bucket_seconds is None or first_ts is None:
+        return None
+
+    return await conn.fetchval(
+        'SELECT ' + _bucket_start(
+            "GREATEST($1::timestamptz, now() - $2::double precision * interval '1 second')", 3, 'ceil'),
+        first_ts, window_seconds, bucket_seconds)
+
+
+async def _write_lines(response, lines):
+    """Writes lines to response and waits until the client has caught up"""
+    await response.write(('\n'.join(lines) + '\n').encode('utf-8'))
+
+
+async def _fetch_page(request, columns, asset_code, *args):
+    """Selects a page of an asset's readings, newest first
+
+    Args:
+        columns: Select list. Each row also has user_ts and id.
+        args: Parameters referred to by columns, from $2
+
+    Returns:
+        (rows, value of after for the next page or None)
+    """
+    args = [asset_code] + list(args)
+
+    query = 'SELECT user_ts, id, {0} FROM readings WHERE asset_code = $1'.format(columns)
+
+    window_seconds = _window_seconds(request)
+    if window_seconds is not None:
+        args.append(window_seconds)
+        query += _user_ts_window_clause(window_seconds, len(args))
+
+    try:
+        limit = int(request.query.get('limit', __DEFAULT_LIMIT))
+        offset = int(request.query.get('skip', __DEFAULT_OFFSET)) if 'limit' in request.query \
+            else __DEFAULT_OFFSET
+    except ValueError:
+        raise web.HTTPBadRequest(reason='limit and skip must be integers')
+
+    after = _parse_after(request.query['after']) if request.query.get('after') else None
+    if after is not None:
+        args.extend(after)
+        query += ' AND (user_ts, id) < (${0}::timestamptz, ${1}::bigint)'.format(
+            len(args) - 1, len(args))
+
+    # readings_ix3 returns the rows in this order, starting after the previous page
+    args.append(limit)
+    query += ' ORDER BY user_ts DESC, id DESC LIMIT ${0}'.format(len(args))
+
+    if after is None and offset:
+        args.append(offset)
+        query += ' OFFSET ${0}'.format(len(args))
+
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch(query, *args)
+
+    next_after = None
+    if rows and len(rows) == limit:
+        last = rows[-1]
+        next_after = '{0},{1}'.format(
+            last['user_ts'].astimezone(datetime.timezone.utc).strftime(_AFTER_TIMESTAMP_FORMAT),
+            last['id'])
+
+    return rows, next_after
+
+
+def _parse_after(after):
+    """Returns (user_ts, id) from a value of the after query parameter"""
+    user_ts, _, reading_id = after.rpartition(',')
+    try:
+        return (datetime.datetime.strptime(user_ts, _AFTER_TIMESTAMP_FORMAT).replace(
+                    tzinfo=datetime.timezone.utc),
+                int(reading_id))
+    except ValueError:
+        raise web.HTTPBadRequest(reason='after must be a value of next from a previous page')
+
+
+def _page_response(request, results, next_after):
+    """Returns results, along with the value of after for the next page when the after
+    query parameter was supplied"""
+    if 'after' in request.query:
+        return web.json_response({'readings': results, 'next': next_after})
 
     return web.json_response(results)
 
 
-def _where_clause(request):
-    where_clause = ''
+def _window_seconds(request):
+    """Returns the time limit set by the seconds, minutes or hours query parameter in
+    seconds, or None"""
+    for name, multiplier in (('seconds', 1), ('minutes', 60), ('hours', 3600)):
+        if name in request.query:
+            try:
+                return float(request.query[name]) * multiplier
+            except ValueError:
+                raise web.HTTPBadRequest(reason='{} must be a number'.format(name))
+
+    return None
+
+
+def _series_bucket_seconds(width_seconds, window_seconds, first_ts):
+    """Returns the length of the reading_aggregates buckets that are combined into series buckets of
+    width_seconds, or None when the buckets that could be combined are not kept for the time range
+
+    Args:
+        window_seconds: The time limit in seconds or None
+        first_ts: asset_catalog.first_ts. Without a time limit, the range starts there.
+    """
+    if window_seconds is None and first_ts is not None:
+        window_seconds = (datetime.datetime.now(datetime.timezone.utc) - first_ts).total_seconds()
+
+    bucket_seconds = max(reading_aggregates.bucket_seconds_for_width(width_seconds),
+                         reading_aggregates.bucket_seconds_for_window(window_seconds))
+
+    return bucket_seconds if width_seconds % bucket_seconds == 0 else None
+
+
+def _buckets_start_clause(param):
+    """Selects reading_aggregates buckets that start at or after $param. See :func:`_buckets_start`."""
+    return ' AND bucket_ts >= ${0}::timestamptz'.format(param)
+
+
+def _bucket_width_seconds(request):
+    """Returns the series bucket width set by the bucket or group query parameter in seconds"""
+    if 'bucket' in request.query:
+        match = _BUCKET_PATTERN.match(request.query['bucket'])
+        if match is None or not int(match.group(1)):
+            raise web.HTTPBadRequest(reason='bucket must be a whole number of seconds, minutes, hours or days, '
+                                            'for example 30s')
+        return int(match.group(1)) * _BUCKET_UNITS[match.group(2)]
+
+    return _GROUPS.get(request.query.get('group'), _GROUPS['seconds'])
+
+
+def _bucket_ts_format(width_seconds):
+    """Returns the to_char format for the start of buckets of width_seconds"""
+    if width_seconds % 3600 == 0:
+        return 'YYYY-MM-DD HH24'
+    if width_seconds % 60 == 0:
+        return 'YYYY-MM-DD HH24:MI'
+    return 'YYYY-MM-DD HH24:MI:SS'
+
+
+def _bucket_start(timestamp, param, rounding='floor'):
+    """Returns an expression for the start of the bucket of $param seconds that contains timestamp
+
+    Args:
+        rounding: 'ceil' returns the start of the first bucket that starts at or after timestamp
+    """
+    return ('to_timestamp({2}(extract(epoch FROM {0}) / ${1}::double precision) * ${1}::double precision)'
+            .format(timestamp, param, rounding))
 
-    if 'seconds' in request.query:
-        where_clause += """ AND user_ts > NOW() - INTERVAL '{0} seconds'""".format(request.query['seconds'])
-    elif 'minutes' in request.query:
-        where_clause += """ AND user_ts > NOW() - INTERVAL '{0} minutes'""".format(request.query['minutes'])
-    elif 'hours' in request.query:
-        where_clause += """ AND user_ts > NOW() - INTERVAL '{0} hours'""".format(request.query['hours'])
 
-    return where_clause
+def _user_ts_window_clause(window_seconds, param=4):
+    """Selects readings from the last $param seconds"""
+    if window_seconds is None:
+        return ''
+    return " AND user_ts > now() - ${0}::double precision * interval '1 second'".format(param)
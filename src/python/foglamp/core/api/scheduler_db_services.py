@@ -7,15 +7,13 @@
 """Storage Services as needed by Processes
 """
 
-import asyncpg
+from foglamp import db_pool
 
 __author__ = "Amarendra Kumar Sinha"
 __copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
 __license__ = "Apache 2.0"
 __version__ = "${VERSION}"
 
-__DB_NAME = 'foglamp'
-
 
 async def read_scheduled_processes(scheduled_process_name=None):
     """
@@ -28,7 +26,6 @@ async def read_scheduled_processes(scheduled_process_name=None):
         list of processes that can be scheduled
     """
 
-    conn = await asyncpg.connect(database=__DB_NAME)
     query = """
         SELECT name, script FROM scheduled_processes
     """
@@ -36,9 +33,9 @@ async def read_scheduled_processes(scheduled_process_name=None):
     _where_clause = " WHERE name = $1" if scheduled_process_name else ""
     query += _where_clause
 
-    stmt = await conn.prepare(query)
-
-    rows = await stmt.fetch(scheduled_process_name) if scheduled_process_name else await stmt.fetch()
+    async with db_pool.acquire() as conn:
+        stmt = await conn.prepare(query)
+        rows = await stmt.fetch(scheduled_process_name) if scheduled_process_name else await stmt.fetch()
 
     columns = ('name', 'script')
 
@@ -46,8 +43,6 @@ async def read_scheduled_processes(scheduled_process_name=None):
     for row in rows:
         results.append(dict(zip(columns, row)))
 
-    await conn.close()
-
     return results
 
 
@@ -62,7 +57,6 @@ async def read_schedule(schedule_id=None):
         Detail for a single schedule or a list of schedules
     """
 
-    conn = await asyncpg.connect(database=__DB_NAME)
     query = """
         SELECT id::"varchar",
                 process_name,
@@ -80,9 +74,9 @@ async def read_schedule(schedule_id=None):
 
     query += _where_clause
 
-    stmt = await conn.prepare(query)
-
-    rows = await stmt.fetch(schedule_id) if schedule_id else await stmt.fetch()
+    async with db_pool.acquire() as conn:
+        stmt = await conn.prepare(query)
+        rows = await stmt.fetch(schedule_id) if schedule_id else await stmt.fetch()
 
     results = []
     for row in rows:
@@ -96,8 +90,6 @@ async def read_schedule(schedule_id=None):
                                           exclusive=row['exclusive']
                                           )))
 
-    await conn.close()
-
     return results
 
 
@@ -114,7 +106,6 @@ async def read_task(task_id=None, state=None, name=None):
         Detail of a single task or a list of detail of tasks filtered optionally on name and/or state
     """
 
-    conn = await asyncpg.connect(database=__DB_NAME)
     query = """
         SELECT
             id::"varchar",
@@ -133,14 +124,13 @@ async def read_task(task_id=None, state=None, name=None):
 
     query += _where_clause
 
-    if task_id:
-        stmt = await conn.prepare(query)
-        rows = await stmt.fetch(task_id)
-    else:
+    if not task_id:
         _where_clause = _get_where_clause(name, state)
         query += _where_clause
+
+    async with db_pool.acquire() as conn:
         stmt = await conn.prepare(query)
-        rows = await _get_rows(stmt, name, state)
+        rows = await stmt.fetch(task_id) if task_id else await _get_rows(stmt, name, state)
 
     columns = ('id',
         'process_name',
@@ -156,8 +146,6 @@ async def read_task(task_id=None, state=None, name=None):
     for row in rows:
         results.append(dict(zip(columns, row)))
 
-    await conn.close()
-
     return results
 
 
@@ -173,7 +161,6 @@ async def read_tasks_latest(state=None, name=None):
         Detail list of latest detail of each task filtered optionally on name and/or state
     """
 
-    conn = await asyncpg.connect(database=__DB_NAME)
     query = """
         SELECT DISTINCT ON (process_name)
             id::"varchar",
@@ -193,9 +180,9 @@ async def read_tasks_latest(state=None, name=None):
     _order_clause = ' ORDER BY process_name ASC, start_time DESC'
     query += _order_clause
 
-    stmt = await conn.prepare(query)
-
-    rows = await _get_rows(stmt, name, state)
+    async with db_pool.acquire() as conn:
+        stmt = await conn.prepare(query)
+        rows = await _get_rows(stmt, name, state)
 
     columns = ('id',
         'process_name',
@@ -211,8 +198,6 @@ async def read_tasks_latest(state=None, name=None):
     for row in rows:
         results.append(dict(zip(columns, row)))
 
-    await conn.close()
-
     return results
 
 
@@ -4,8 +4,12 @@
 # See: http://foglamp.readthedocs.io/
 # FOGLAMP_END
 
+import datetime
+
+import dateutil.parser
 from aiohttp import web
 
+from foglamp import configuration_manager, update_statistics_history
 from foglamp.core.api import statistics_db_services
 
 __author__ = "Amarendra K. Sinha, Ashish Jabble"
@@ -27,6 +31,28 @@ _help = """
 #################################
 
 
+def _parse_query_timestamp(request, name, default=None)->datetime.datetime:
+    """Parses a timestamp query parameter. Timestamps without a time zone are in UTC.
+
+    Raises:
+        ValueError: The parameter is not a timestamp
+    """
+    value = request.query.get(name)
+
+    if value is None:
+        return default
+
+    try:
+        timestamp = dateutil.parser.parse(value)
+    except (ValueError, OverflowError):
+        raise ValueError('{} is not a valid timestamp'.format(name))
+
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
+
+    return timestamp
+
+
 async def get_statistics(request):
     """
     Args:
@@ -55,20 +81,46 @@ async def get_statistics_history(request):
     Returns:
             a list of general set of statistics
 
+    When from or to is given, rows are read from the statistics history table,
+    or one of its per-minute, per-hour and per-day rollups, depending on the
+    length of the range. interval is the number of seconds covered by each
+    row. keys limits the statistics returned to a comma-separated list of keys.
+
     :Example:
             curl -X GET http://localhost:8082/foglamp/statistics/history?limit=1
+            curl -X GET "http://localhost:8082/foglamp/statistics/history?from=2017-09-01T00:00:00Z&to=2017-09-08T00:00:00Z"
+            curl -X GET "http://localhost:8082/foglamp/statistics/history?limit=10&keys=READINGS,PURGED"
     """
 
     try:
-        limit = request.query.get('limit') if 'limit' in request.query else 0
+        keys = [key.strip().upper() for key in request.query.get('keys', '').split(',') if key.strip()]
+
+        if 'from' in request.query or 'to' in request.query:
+            end = _parse_query_timestamp(request, 'to', datetime.datetime.now(datetime.timezone.utc))
+            start = _parse_query_timestamp(request, 'from', end - datetime.timedelta(hours=1))
+
+            if start >= end:
+                raise ValueError('from must be earlier than to')
+
+            config = await configuration_manager.get_category_all_items(
+                update_statistics_history.CONFIG_CATEGORY_NAME)
+            tier = statistics_db_services.choose_history_tier(
+                start, end, update_statistics_history.get_retention_days(config))
+
+            statistics = await statistics_db_services.read_statistics_history_range(tier, start, end, keys)
+            interval = tier.period_seconds
+            if interval is None:
+                interval = await statistics_db_services.read_stats_collector_interval()
+        else:
+            limit = request.query.get('limit') if 'limit' in request.query else 0
 
-        statistics = await statistics_db_services.read_statistics_history(int(limit))
+            statistics = await statistics_db_services.read_statistics_history(int(limit), keys)
+            interval = await statistics_db_services.read_stats_collector_interval()
 
         if not statistics:
             raise ValueError('No statistics available')
 
-        # TODO: find out where from this "interval" will be picked and what will be its role in query?
-        return web.json_response({"interval": 5, 'statistics': statistics})
+        return web.json_response({"interval": interval, 'statistics': statistics})
     except ValueError as ex:
         raise web.HTTPNotFound(reason=str(ex))
     except Exception as ex:
@@ -7,28 +7,33 @@
 """Storage Services as needed by Processes
 """
 
-import asyncpg
+import datetime
+import json
 from collections import OrderedDict
 
+from foglamp import db_pool
+from foglamp.update_statistics_history import HISTORY_TIERS, HistoryTier, PROCESS_NAME
+
 __author__ = "Amarendra Kumar Sinha"
 __copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
 __license__ = "Apache 2.0"
 __version__ = "${VERSION}"
 
-__DB_NAME = 'foglamp'
+
+_HISTORY_PREFETCH_ROWS = 500
+"""Number of pivoted statistics history rows fetched from the cursor at a time"""
 
 
 async def read_statistics():
     """Fetch statistics snap shot from statistics table"""
 
-    conn = await asyncpg.connect(database=__DB_NAME)
     query = """
         SELECT RTRIM(key), description, value FROM statistics ORDER BY key
     """
 
-    stmt = await conn.prepare(query)
-
-    rows = await stmt.fetch()
+    async with db_pool.acquire() as conn:
+        stmt = await conn.prepare(query)
+        rows = await stmt.fetch()
 
     columns = ('key',
                'description',
@@ -40,52 +45,137 @@ async def read_statistics():
         temp = OrderedDict(zip(columns, row))
         results.update({temp['key']: temp['value']})
 
-    await conn.close()
-
     return results
 
-async def read_statistics_history(limit=None):
-    """Fetch list of statistics, count limited by 'limit' optional, from statistics_history table"""
 
-    conn = await asyncpg.connect(database=__DB_NAME)
-    _limit_clause = " LIMIT $1" if limit else " "
+_TIER_MAX_RANGES = (
+    datetime.timedelta(hours=2),
+    datetime.timedelta(days=2),
+    datetime.timedelta(days=90),
+)
+"""The longest range read from each of HISTORY_TIERS except the last one.
+Longer ranges are read from a coarser tier so that the number of rows stays small."""
 
-    query = """
-                SELECT date_trunc('second', history_ts::timestamptz)::varchar as history_ts,
-                        key,
-                        value FROM statistics_history
-                WHERE date_trunc('second', history_ts::timestamptz)::varchar IN
-                    (SELECT distinct date_trunc('second', history_ts::timestamptz)::varchar as history_ts
-                        FROM statistics_history ORDER BY history_ts DESC {limit_clause})
-                ORDER BY history_ts, key;
-            """.format(limit_clause=_limit_clause)
 
-    stmt = await conn.prepare(query)
-    rows = await stmt.fetch(limit) if limit else await stmt.fetch()
+def choose_history_tier(start: datetime.datetime, end: datetime.datetime, retention_days: dict,
+                        now: datetime.datetime = None)->HistoryTier:
+    """Chooses the table to read statistics history from
 
-    columns = ('history_ts', 'key', 'value')
+    Args:
+        start: Beginning of the range
+        end: End of the range
+        retention_days: Number of days rows are kept (0 for forever) by table name.
+            See foglamp.update_statistics_history.get_retention_days.
+        now: The current time. Defaults to datetime.datetime.now(datetime.timezone.utc).
 
-    results = []
-    first_time = True
-    temp_history_ts = None
-    temp_dict = {}
+    Returns:
+        The finest tier that suits the length of the range and still has rows for start
+    """
+    if now is None:
+        now = datetime.datetime.now(datetime.timezone.utc)
 
-    for row in rows:
-        if temp_history_ts != row['history_ts']:
-            if not first_time:
-                temp_dict.update({'history_ts': temp_history_ts})
-                results.append(temp_dict)
-            temp_dict = {}
-            temp_history_ts = row['history_ts']
+    tiers = list(HISTORY_TIERS)
+
+    for tier, max_range in zip(HISTORY_TIERS, _TIER_MAX_RANGES):
+        if end - start > max_range:
+            tiers.remove(tier)
+
+    for tier in tiers:
+        days = retention_days.get(tier.table, 0)
+        if not days or now - datetime.timedelta(days=days) <= start:
+            return tier
+
+    return tiers[-1]
 
-        temp = OrderedDict(zip(columns, row))
-        temp_dict.update({temp['key']: temp['value']})
-        first_time = False
 
-    # Append last leftover dict
-    temp_dict.update({'history_ts': temp_history_ts})
-    results.append(temp_dict)
+async def read_stats_collector_interval():
+    """Returns the number of seconds between runs of the stats collector, which is the
+    number of seconds covered by a statistics_history row, or None if it is not scheduled
+    to repeat"""
+    async with db_pool.acquire() as conn:
+        return await conn.fetchval('SELECT extract(epoch FROM schedule_interval)::float8 '
+                                   'FROM foglamp.schedules '
+                                   'WHERE process_name = $1 AND schedule_interval IS NOT NULL '
+                                   'ORDER BY schedule_interval LIMIT 1', PROCESS_NAME)
+
+
+async def _fetch_history(query, *args):
+    """Runs a query that returns history_ts and a JSON object of values by key
+    per row, and returns a list of dicts containing history_ts and a value per key
+
+    Rows are pivoted by the database. They are read through a cursor so that
+    the result is not materialized twice.
+    """
+    results = []
 
-    await conn.close()
+    async with db_pool.acquire() as conn:
+        async with conn.transaction():
+            async for row in conn.cursor(query, *args, prefetch=_HISTORY_PREFETCH_ROWS):
+                values = json.loads(row['statistics'])
+                values['history_ts'] = row['history_ts']
+                results.append(values)
 
     return results
+
+
+def _key_clause(keys, arg_number):
+    """Returns a condition that limits rows to keys, or '' if keys is empty"""
+    if not keys:
+        return ''
+    return ' AND key = ANY(${}::character(10)[])'.format(arg_number)
+
+
+async def read_statistics_history_range(tier: HistoryTier, start: datetime.datetime,
+                                        end: datetime.datetime, keys=None):
+    """Fetch list of statistics from start (inclusive) to end (exclusive) from the tier's table
+
+    Args:
+        keys: Statistics keys to return. None or empty returns every key.
+    """
+    query = """
+                SELECT date_trunc('second', history_ts)::varchar AS history_ts,
+                       json_object_agg(RTRIM(key), value) AS statistics
+                FROM foglamp.{table}
+                WHERE history_ts >= $1 AND history_ts < $2{key_clause}
+                GROUP BY history_ts
+                ORDER BY history_ts
+            """.format(table=tier.table, key_clause=_key_clause(keys, 3))
+
+    args = (start, end, list(keys)) if keys else (start, end)
+
+    return await _fetch_history(query, *args)
+
+
+async def read_statistics_history(limit=None, keys=None):
+    """Fetch list of statistics, count limited by 'limit' optional, from statistics_history table
+
+    Args:
+        limit: Return the most recent limit collections. 0 or None returns every collection.
+        keys: Statistics keys to return. None or empty returns every key.
+    """
+    # The stats collector writes every key with the same history_ts, so the
+    # earliest of the last limit distinct history_ts values is found by
+    # reading limit * keys entries from the (history_ts, key) index
+    if limit:
+        since_clause = """history_ts >= (SELECT min(history_ts) FROM
+                        (SELECT DISTINCT history_ts FROM foglamp.statistics_history
+                         WHERE TRUE{key_clause} ORDER BY history_ts DESC LIMIT $1) AS recent)
+                    """.format(key_clause=_key_clause(keys, 2))
+        args = [limit]
+    else:
+        since_clause = 'TRUE'
+        args = []
+
+    if keys:
+        args.append(list(keys))
+
+    query = """
+                SELECT date_trunc('second', history_ts)::varchar AS history_ts,
+                       json_object_agg(RTRIM(key), value) AS statistics
+                FROM foglamp.statistics_history
+                WHERE {since_clause}{key_clause}
+                GROUP BY history_ts
+                ORDER BY history_ts
+            """.format(since_clause=since_clause, key_clause=_key_clause(keys, len(args)))
+
+    return await _fetch_history(query, *args)
@@ -11,17 +11,19 @@ import collections
 import datetime
 # import logging  # For development only
 import math
+import os
+import signal
 import time
 import uuid
 from enum import IntEnum
 from typing import Iterable, List, Tuple, Union
 
-import aiopg.sa
 import sqlalchemy
 from sqlalchemy.dialects import postgresql as pg_types
 
 from foglamp import logger
 from foglamp import configuration_manager
+from foglamp import db_pool
 
 
 __author__ = "Terris Linenbach"
@@ -29,9 +31,6 @@ __copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
 __license__ = "Apache 2.0"
 __version__ = "${VERSION}"
 
-# Module attributes
-_CONNECTION_STRING = "dbname='foglamp'"
-
 
 class NotReadyError(RuntimeError):
     pass
@@ -327,6 +326,9 @@ class Scheduler(object):
     is an operating system process. ScheduleProcesses
     specify process/command name and parameters.
 
+    A ScheduledProcess can instead be run as a coroutine on the
+    scheduler's event loop. See :meth:`register_coroutine`.
+
     Most methods are coroutines and use the default
     event loop to create tasks.
 
@@ -355,6 +357,38 @@ class Scheduler(object):
             self.start_time = None  # type: int
             """Epoch time when the task was started"""
 
+    class _CoroutineProcess(object):
+        """Runs a coroutine in place of a subprocess
+
+        Provides the subset of asyncio.subprocess.Process that the
+        scheduler uses. pid is the scheduler's process id.
+        """
+        __slots__ = ['pid', '_task']
+
+        def __init__(self, coroutine):
+            self.pid = os.getpid()
+            self._task = asyncio.ensure_future(coroutine)
+
+        async def wait(self)->int:
+            """Waits for the coroutine to finish
+
+            Returns:
+                0 if the coroutine returned, -SIGTERM if it was canceled via
+                :meth:`terminate`, 1 if it raised an exception
+            """
+            try:
+                await asyncio.wait([self._task])
+                self._task.result()
+                return 0
+            except asyncio.CancelledError:
+                return -signal.SIGTERM
+            except Exception:
+                Scheduler._logger.exception('Task coroutine failed')
+                return 1
+
+        def terminate(self):
+            self._task.cancel()
+
     # TODO: Methods that accept a schedule and look in _schedule_executions
     # should accept schedule_execution instead. Add reference to schedule
     # in _ScheduleExecution.
@@ -458,6 +492,8 @@ class Scheduler(object):
         """When True, the scheduler will not start any new tasks"""
         self._process_scripts = dict()
         """Dictionary of scheduled_processes.name to script"""
+        self._process_coroutines = dict()
+        """Dictionary of scheduled_processes.name to coroutine function. See :meth:`register_coroutine`."""
         self._schedules = dict()
         """Dictionary of schedules.id to _ScheduleRow"""
         self._schedule_executions = dict()
@@ -504,6 +540,20 @@ class Scheduler(object):
         self._max_running_tasks = value
         self._resume_check_schedules()
 
+    def register_coroutine(self, process_name: str, coroutine_function)->None:
+        """Runs tasks for a scheduled process as coroutines
+
+        Tasks for process_name call coroutine_function, with no arguments,
+        and run the coroutine on the event loop instead of starting the
+        process's script. Tasks are otherwise scheduled, tracked and
+        canceled the same way.
+
+        Args:
+            process_name: A scheduled_processes.name
+            coroutine_function: An async function
+        """
+        self._process_coroutines[process_name] = coroutine_function
+
     async def stop(self):
         """Attempts to stop the scheduler
 
@@ -592,8 +642,13 @@ class Scheduler(object):
         task_process = self._TaskProcess()
         task_process.start_time = time.time()
 
+        coroutine_function = self._process_coroutines.get(schedule.process_name)
+
         try:
-            process = await asyncio.create_subprocess_exec(*args)
+            if coroutine_function is None:
+                process = await asyncio.create_subprocess_exec(*args)
+            else:
+                process = self._CoroutineProcess(coroutine_function())
         except EnvironmentError:
             self._logger.exception(
                 "Unable to start schedule '%s' process '%s'\n%s".format(
@@ -627,9 +682,8 @@ class Scheduler(object):
             self._logger.debug('Database command: %s', insert)
 
             try:
-                async with aiopg.sa.create_engine(_CONNECTION_STRING) as engine:
-                    async with engine.acquire() as conn:
-                        await conn.execute(insert)
+                async with db_pool.acquire_sa() as conn:
+                    await conn.execute(insert)
             except Exception:
                 self._logger.exception('Insert failed: %s', insert)
                 raise
@@ -695,13 +749,12 @@ class Scheduler(object):
 
             # Update the task's status
             try:
-                async with aiopg.sa.create_engine(_CONNECTION_STRING) as engine:
-                    async with engine.acquire() as conn:
-                        result = await conn.execute(update)
+                async with db_pool.acquire_sa() as conn:
+                    result = await conn.execute(update)
 
-                        if result.rowcount == 0:
-                            self._logger.warning('Task %s not found. Unable to update its status.',
-                                                 task_process.task_id)
+                    if result.rowcount == 0:
+                        self._logger.warning('Task %s not found. Unable to update its status.',
+                                             task_process.task_id)
             except Exception:
                 self._logger.exception('Update failed: %s', update)
                 raise
@@ -965,10 +1018,9 @@ class Scheduler(object):
         self._logger.debug('Database command: %s', query)
 
         try:
-            async with aiopg.sa.create_engine(_CONNECTION_STRING) as engine:
-                async with engine.acquire() as conn:
-                    async for row in conn.execute(query):
-                        self._process_scripts[row.name] = row.script
+            async with db_pool.acquire_sa() as conn:
+                async for row in conn.execute(query):
+                    self._process_scripts[row.name] = row.script
         except Exception:
             self._logger.exception('Select failed: %s', query)
             raise
@@ -983,9 +1035,8 @@ class Scheduler(object):
         self._logger.debug('Database command: %s', update)
 
         try:
-            async with aiopg.sa.create_engine(_CONNECTION_STRING) as engine:
-                async with engine.acquire() as conn:
-                    await conn.execute(update)
+            async with db_pool.acquire_sa() as conn:
+                await conn.execute(update)
         except Exception:
             self._logger.exception('Update failed: %s', update)
             raise
@@ -1006,30 +1057,29 @@ class Scheduler(object):
         self._logger.debug('Database command: %s', query)
 
         try:
-            async with aiopg.sa.create_engine(_CONNECTION_STRING) as engine:
-                async with engine.acquire() as conn:
-                    async for row in conn.execute(query):
-                        interval = row.schedule_interval
-
-                        repeat_seconds = None
-                        if interval is not None:
-                            repeat_seconds = interval.total_seconds()
-
-                        schedule_id = uuid.UUID(row.id)
-
-                        schedule = self._ScheduleRow(
-                                            id=schedule_id,
-                                            name=row.schedule_name,
-                                            type=row.schedule_type,
-                                            day=row.schedule_day,
-                                            time=row.schedule_time,
-                                            repeat=interval,
-                                            repeat_seconds=repeat_seconds,
-                                            exclusive=row.exclusive,
-                                            process_name=row.process_name)
-
-                        self._schedules[schedule_id] = schedule
-                        self._schedule_first_task(schedule, self._start_time)
+            async with db_pool.acquire_sa() as conn:
+                async for row in conn.execute(query):
+                    interval = row.schedule_interval
+
+                    repeat_seconds = None
+                    if interval is not None:
+                        repeat_seconds = interval.total_seconds()
+
+                    schedule_id = uuid.UUID(row.id)
+
+                    schedule = self._ScheduleRow(
+                                        id=schedule_id,
+                                        name=row.schedule_name,
+                                        type=row.schedule_type,
+                                        day=row.schedule_day,
+                                        time=row.schedule_time,
+                                        repeat=interval,
+                                        repeat_seconds=repeat_seconds,
+                                        exclusive=row.exclusive,
+                                        process_name=row.process_name)
+
+                    self._schedules[schedule_id] = schedule
+                    self._schedule_first_task(schedule, self._start_time)
         except Exception:
             self._logger.exception('Select failed: %s', query)
             raise
@@ -1092,23 +1142,22 @@ class Scheduler(object):
     @staticmethod
     async def populate_test_data():
         """Delete all schedule-related tables and insert processes for testing"""
-        async with aiopg.sa.create_engine(_CONNECTION_STRING) as engine:
-            async with engine.acquire() as conn:
-                await conn.execute('delete from foglamp.tasks')
-                await conn.execute('delete from foglamp.schedules')
-                await conn.execute('delete from foglamp.scheduled_processes')
-                await conn.execute(
-                    '''insert into foglamp.scheduled_processes(name, script)
-                    values('sleep1', '["sleep", "1"]')''')
-                await conn.execute(
-                    '''insert into foglamp.scheduled_processes(name, script)
-                    values('sleep10', '["sleep", "10"]')''')
-                await conn.execute(
-                    '''insert into foglamp.scheduled_processes(name, script)
-                    values('sleep30', '["sleep", "30"]')''')
-                await conn.execute(
-                    '''insert into foglamp.scheduled_processes(name, script)
-                    values('sleep5', '["sleep", "5"]')''')
+        async with db_pool.acquire_sa() as conn:
+            await conn.execute('delete from foglamp.tasks')
+            await conn.execute('delete from foglamp.schedules')
+            await conn.execute('delete from foglamp.scheduled_processes')
+            await conn.execute(
+                '''insert into foglamp.scheduled_processes(name, script)
+                values('sleep1', '["sleep", "1"]')''')
+            await conn.execute(
+                '''insert into foglamp.scheduled_processes(name, script)
+                values('sleep10', '["sleep", "10"]')''')
+            await conn.execute(
+                '''insert into foglamp.scheduled_processes(name, script)
+                values('sleep30', '["sleep", "30"]')''')
+            await conn.execute(
+                '''insert into foglamp.scheduled_processes(name, script)
+                values('sleep5', '["sleep", "5"]')''')
 
     async def save_schedule(self, schedule: Schedule):
         """Creates or update a schedule
@@ -1174,12 +1223,11 @@ class Scheduler(object):
             self._logger.debug('Database command: %s', update)
 
             try:
-                async with aiopg.sa.create_engine(_CONNECTION_STRING) as engine:
-                    async with engine.acquire() as conn:
-                        result = await conn.execute(update)
+                async with db_pool.acquire_sa() as conn:
+                    result = await conn.execute(update)
 
-                        if result.rowcount == 0:
-                            is_new_schedule = True
+                    if result.rowcount == 0:
+                        is_new_schedule = True
             except Exception:
                 self._logger.debug('Update failed: %s', update)
                 raise
@@ -1198,9 +1246,8 @@ class Scheduler(object):
             self._logger.debug('Database command: %s', insert)
 
             try:
-                async with aiopg.sa.create_engine(_CONNECTION_STRING) as engine:
-                    async with engine.acquire() as conn:
-                        await conn.execute(insert)
+                async with db_pool.acquire_sa() as conn:
+                    await conn.execute(insert)
             except Exception:
                 self._logger.exception('Insert failed: %s', insert)
                 raise
@@ -1260,10 +1307,9 @@ class Scheduler(object):
         self._logger.debug('Database command: %s', delete)
 
         try:
-            async with aiopg.sa.create_engine(_CONNECTION_STRING) as engine:
-                async with engine.acquire() as conn:
-                    await conn.execute(self._schedules_tbl.delete().where(
-                        self._schedules_tbl.c.id == str(schedule_id)))
+            async with db_pool.acquire_sa() as conn:
+                await conn.execute(self._schedules_tbl.delete().where(
+                    self._schedules_tbl.c.id == str(schedule_id)))
         except Exception:
             self._logger.exception('Delete failed: %s', delete)
             raise
@@ -1385,19 +1431,18 @@ class Scheduler(object):
         self._logger.debug('Database command: %s', query)
 
         try:
-            async with aiopg.sa.create_engine(_CONNECTION_STRING) as engine:
-                async with engine.acquire() as conn:
-                    async for row in conn.execute(query):
-                        task = Task()
-                        task.task_id = uuid.UUID(row.id)
-                        task.state = Task.State(row.state)
-                        task.start_time = row.start_time
-                        task.process_name = row.process_name
-                        task.end_time = row.end_time
-                        task.exit_code = row.exit_code
-                        task.reason = row.reason
-
-                        return task
+            async with db_pool.acquire_sa() as conn:
+                async for row in conn.execute(query):
+                    task = Task()
+                    task.task_id = uuid.UUID(row.id)
+                    task.state = Task.State(row.state)
+                    task.start_time = row.start_time
+                    task.process_name = row.process_name
+                    task.end_time = row.end_time
+                    task.exit_code = row.exit_code
+                    task.reason = row.reason
+
+                    return task
         except Exception:
             self._logger.exception('Select failed: %s', query)
             raise
@@ -1452,19 +1497,18 @@ class Scheduler(object):
         self._logger.debug('Database command: %s', query)
 
         try:
-            async with aiopg.sa.create_engine(_CONNECTION_STRING) as engine:
-                async with engine.acquire() as conn:
-                    async for row in conn.execute(query):
-                        task = Task()
-                        task.task_id = uuid.UUID(row.id)
-                        task.state = Task.State(row.state)
-                        task.start_time = row.start_time
-                        task.process_name = row.process_name
-                        task.end_time = row.end_time
-                        task.exit_code = row.exit_code
-                        task.reason = row.reason
-
-                        tasks.append(task)
+            async with db_pool.acquire_sa() as conn:
+                async for row in conn.execute(query):
+                    task = Task()
+                    task.task_id = uuid.UUID(row.id)
+                    task.state = Task.State(row.state)
+                    task.start_time = row.start_time
+                    task.process_name = row.process_name
+                    task.end_time = row.end_time
+                    task.exit_code = row.exit_code
+                    task.reason = row.reason
+
+                    tasks.append(task)
         except Exception:
             self._logger.exception('Select failed: %s', query)
             raise
@@ -1541,12 +1585,11 @@ class Scheduler(object):
         self._logger.debug('Database command: %s', delete)
 
         try:
-            async with aiopg.sa.create_engine(_CONNECTION_STRING) as engine:
-                async with engine.acquire() as conn:
-                    while not self._paused:
-                        result = await conn.execute(delete)
-                        if result.rowcount < self._DELETE_TASKS_LIMIT:
-                            break
+            async with db_pool.acquire_sa() as conn:
+                while not self._paused:
+                    result = await conn.execute(delete)
+                    if result.rowcount < self._DELETE_TASKS_LIMIT:
+                        break
         except Exception:
             self._logger.exception('Delete failed: %s', delete)
             raise
@@ -10,9 +10,13 @@ import signal
 import asyncio
 from aiohttp import web
 
+from foglamp import db_pool
+from foglamp import reading_aggregates
+from foglamp import statistics
 from foglamp.core import routes
 from foglamp.core import middleware
 from foglamp.core.scheduler import Scheduler
+from foglamp.data_purge import purge
 
 __author__ = "Praveen Garg, Terris Linenbach"
 __copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
@@ -41,12 +45,17 @@ class Server:
     async def _start_scheduler(cls):
         """Starts the scheduler"""
         cls.scheduler = Scheduler()
+        # Share the connection pools and statistics instead of starting a process for every run
+        cls.scheduler.register_coroutine('purge', purge.purge_task)
+        cls.scheduler.register_coroutine('readings aggregator', reading_aggregates.roll_up)
         await cls.scheduler.start()
 
     @classmethod
     def start(cls):
         """Starts the server"""
         loop = asyncio.get_event_loop()
+        loop.run_until_complete(db_pool.configure())
+        loop.run_until_complete(statistics.start())
         loop.run_until_complete(asyncio.ensure_future(cls._start_scheduler()))
 
         # Register signal handlers
@@ -74,6 +83,9 @@ class Server:
             await cls.scheduler.stop()
             cls.scheduler = None
 
+        await statistics.stop()
+        await db_pool.close()
+
         for task in asyncio.Task.all_tasks():
             task.cancel()
 
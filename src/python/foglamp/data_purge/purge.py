@@ -20,7 +20,10 @@ Description: Based on FOGL-200 (https://docs.google.com/document/d/1GdMTerNq_-XQ
      1. Connects to the database 
      2. Retrieve information from the Configuration, and last ID sent to the historian
      3. Calculates how many rows are in the database to this point (using "NOW()") 
+        -> Large tables use the planner's estimate (pg_class.reltuples) instead of count(*)
      4. Either DELETE rows based off age, or lastID (as well as "NOW()")
+        -> Unless chunkRows is 0, rows are deleted in id ranges of chunkRows ids, one transaction per range,
+           pausing between ranges so that ingest is not stalled
      5. Calculate necessary information regarding the purge process 
         -> total_rows_removed
         -> total_unsent_rows
@@ -28,27 +31,52 @@ Description: Based on FOGL-200 (https://docs.google.com/document/d/1GdMTerNq_-XQ
         -> total_failed_to_remove
      6. INSERT information into log table 
      
+     When the readings table is partitioned by user_ts (see src/sql/foglamp_readings_partitioned.sql), step 4 is
+     replaced by:
+        -> Create partitions for the current and next partitionInterval periods
+        -> DETACH and DROP partitions whose upper bound is older than age. When retainUnsent is True, only
+           partitions whose max id has been sent are dropped.
+        -> DELETE rows older than age from the default partition
+     Rows are therefore retained for up to one partitionInterval longer than age.
+
+     Every statement that removes readings also subtracts the removed readings from foglamp.asset_catalog and
+     foglamp.asset_catalog_hours (see foglamp.reading_aggregates), and afterwards first_ts is recalculated for the
+     assets whose oldest reading was older than age. Dropping a partition subtracts the counts of its hours, so the
+     partition's rows are not read.
+
+     maxRows and maxTableSizeMB cap the size of the readings table. When the table is over either limit, the age
+     cutoff is moved forward to the user_ts of the newest reading that must be removed to get under the limit. When
+     the ingest rate would reach a limit before the next scheduled purge, purge_task purges again sooner.
+
+     The core server runs the purge as a coroutine (purge_task) on its event loop when the scheduler starts the
+     'purge' process, sharing foglamp.db_pool's connections and the foglamp.statistics accumulator. Running this
+     module as a script (python3 -m foglamp.data_purge) performs a single purge in a new process.
+
      There currently isn't a formal confirmation that the purge process has succeeded, HOWEVER if 
      total_failed_to_remove > 0 then it is safe to assume that that there was an error with INSERTS, and if 
      total_failed_to_remove > total_rows_removed then PURGE completely failed. 
 """
 import asyncio
 import datetime
+import math
+import re
+import dateutil.parser
 import sqlalchemy
 import sqlalchemy.dialects.postgresql
 import time
 from foglamp import configuration_manager
+from foglamp import db_pool
+from foglamp import logger
 from foglamp import statistics
 
-"""Script information and connection to the Database"""
+"""Script information"""
 __author__ = "Ori Shadmon"
 __copyright__ = "Copyright (c) 2017 OSI Soft, LLC"
 __license__ = "Apache 2.0"
 __version__ = "${VERSION}"
 
-# Create Connection
-__CONNECTION_STRING = "postgres:///foglamp"
-__ENGINE = sqlalchemy.create_engine(__CONNECTION_STRING, pool_size=5, max_overflow=0)
+_LOGGER = logger.setup(__name__)
+
 _DEFAULT_PURGE_CONFIG = {
     "age": {
         "description": "Age of data to be retained, all data that is older than this value will be removed," +
@@ -60,11 +88,120 @@ _DEFAULT_PURGE_CONFIG = {
         "description": "Retain data that has not been sent to any historian yet.",
         "type": "boolean",
         "default": "False"
+    },
+    "chunkRows": {
+        "description": "Delete readings in id ranges of this size, one transaction per range. " +
+                       "0 deletes all readings in one transaction.",
+        "type": "integer",
+        "default": "10000"
+    },
+    "chunkPauseMilliseconds": {
+        "description": "Pause between id ranges when chunkRows is not 0",
+        "type": "integer",
+        "default": "10"
+    },
+    "maxRows": {
+        "description": "Maximum number of readings to retain. The oldest readings are removed, " +
+                       "even when they are younger than age. 0 for no limit.",
+        "type": "integer",
+        "default": "0"
+    },
+    "maxTableSizeMB": {
+        "description": "Maximum estimated size of the readings, in megabytes. The oldest readings are removed, " +
+                       "even when they are younger than age. 0 for no limit.",
+        "type": "integer",
+        "default": "0"
+    },
+    "minPurgeIntervalSeconds": {
+        "description": "When the ingest rate would exceed maxRows or maxTableSizeMB before the next scheduled " +
+                       "purge, purge again after this number of seconds at the soonest",
+        "type": "integer",
+        "default": "30"
+    },
+    "partitionInterval": {
+        "description": "Period covered by each partition created when the readings table is partitioned " +
+                       "by user_ts: day or hour",
+        "type": "string",
+        "default": "day"
     }
 }
 _CONFIG_CATEGORY_NAME = 'PURGE_READ'
 _CONFIG_CATEGORY_DESCRIPTION = 'Purge the readings table'
 
+_EXACT_COUNT_MAX_ROWS = 100000
+"""Tables estimated to hold more rows than this are not counted with count(*)"""
+
+_ROW_OVERHEAD_BYTES = 28
+"""Tuple header and line pointer size added to the average row width"""
+
+_last_max_id = None  # type: int
+_last_max_id_time = None  # type: float
+"""max(readings.id) and when it was read (time.monotonic), to measure the ingest rate"""
+
+_PARTITION_INTERVALS = {
+    'day': (datetime.timedelta(days=1), '%Y%m%d'),
+    'hour': (datetime.timedelta(hours=1), '%Y%m%d%H'),
+}
+"""partitionInterval: (period, partition name suffix format)"""
+
+_PARTITIONS_AHEAD = 2
+"""Number of partitions created after the current one"""
+
+_PARTITION_BOUND_PATTERN = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+_CATALOG_LOCK = "SELECT last_id FROM foglamp.reading_aggregates_state WHERE id = 1 FOR SHARE"
+"""Keeps the readings aggregator from adding readings to foglamp.asset_catalog until the transaction ends.
+Readings whose ids are not greater than last_id have been added."""
+
+_CATALOG_SUBTRACT = """
+    UPDATE foglamp.asset_catalog AS catalog SET reading_count = catalog.reading_count - removed.reading_count
+    FROM (SELECT asset_code, sum(reading_count) AS reading_count FROM {0} GROUP BY asset_code) AS removed
+    WHERE catalog.asset_code = removed.asset_code
+"""
+"""Subtracts the reading_count of each asset_code in the relation {0} from foglamp.asset_catalog"""
+
+_DELETE_READINGS = """
+    WITH state AS ({0}), deleted AS (
+        DELETE FROM {1} WHERE {2} RETURNING asset_code, id, user_ts
+    ), removed AS (
+        SELECT to_timestamp(floor(extract(epoch FROM deleted.user_ts) / 3600) * 3600) AS hour_ts,
+               deleted.asset_code, count(*) AS reading_count
+        FROM deleted, state
+        WHERE deleted.id <= state.last_id
+        AND NOT EXISTS (SELECT 1 FROM foglamp.reading_aggregates_gaps AS gaps
+                        WHERE deleted.id BETWEEN gaps.first_id AND gaps.last_id)
+        GROUP BY 1, 2
+    ), subtracted_hours AS (
+        UPDATE foglamp.asset_catalog_hours AS hours SET reading_count = hours.reading_count - removed.reading_count
+        FROM removed
+        WHERE hours.hour_ts = removed.hour_ts AND hours.asset_code = removed.asset_code
+    ), subtracted AS ({3})
+    SELECT count(*) FROM deleted
+"""
+"""DELETE statement that updates foglamp.asset_catalog and foglamp.asset_catalog_hours and returns the number of
+rows removed. Only the readings that were added to them are subtracted: readings in foglamp.reading_aggregates_gaps
+committed after the readings aggregator moved past their ids and have not been added."""
+
+_DROP_HOURS = """
+    WITH removed AS (
+        DELETE FROM foglamp.asset_catalog_hours WHERE hour_ts >= :lower AND hour_ts < :upper
+        RETURNING asset_code, reading_count
+    ) {0}
+"""
+"""Removes the hours of a partition from foglamp.asset_catalog_hours and subtracts their readings from
+foglamp.asset_catalog, without reading the partition"""
+
+_EMPTY_HOURS = "DELETE FROM foglamp.asset_catalog_hours WHERE reading_count <= 0"
+"""Removes the hours of foglamp.asset_catalog_hours whose readings have all been removed"""
+
+_CATALOG_FIRST_TS = """
+    UPDATE foglamp.asset_catalog AS catalog
+    SET first_ts = (SELECT min(readings.user_ts) FROM {0} AS readings, foglamp.reading_aggregates_state AS state
+                    WHERE readings.asset_code = catalog.asset_code AND state.id = 1 AND readings.id <= state.last_id)
+    WHERE catalog.first_ts <= :age_timestamp
+"""
+"""Recalculates first_ts for the assets whose oldest reading may have been removed"""
+
 
 """Utilized tables"""
 # Table purge against
@@ -100,20 +237,51 @@ _STREAMS_TABLE = sqlalchemy.Table('streams', sqlalchemy.MetaData(),
 """Methods that support the purge process."""
 
 
-def execute_command(stmt):
-    """"Imitate connection to postgres that returns result.
-    Args:
-        stmt (str): generated SQL query   
-    Returns:
-        Returns result set 
+async def fetch_scalar(stmt):
+    """"Returns the first column of the first row of a query's result, or None"""
+    async with db_pool.acquire_sa() as conn:
+        return await conn.scalar(stmt)
+
+
+async def fetch_all(stmt)->list:
+    """"Returns the rows of a query's result"""
+    async with db_pool.acquire_sa() as conn:
+        result = await conn.execute(stmt)
+        return await result.fetchall()
+
+
+async def execute_rowcount(stmt)->int:
+    """"Execute a statement
+    :return:
+        Number of rows affected
     """
-    with __ENGINE.connect() as conn: 
-        return conn.execute(stmt)
+    async with db_pool.acquire_sa() as conn:
+        result = await conn.execute(stmt)
+        return result.rowcount
+
+
+async def execute_in_transaction(*stmts):
+    """"Execute statements in a single transaction"""
+    async with db_pool.acquire_sa() as conn:
+        async with conn.begin():
+            for stmt in stmts:
+                await conn.execute(stmt)
+
 
-def insert_into_log(level=0, log=None):
+async def insert_into_log(level=0, log=None):
     """"INSERT into log table values"""
     stmt = _LOG_TABLE.insert().values(code='PURGE', level=level, log=log)
-    execute_command(stmt)
+    await execute_rowcount(stmt)
+
+
+async def read_configuration():
+    """"set the default configuration for purge
+    :return:
+        Configuration information that was set for purge process
+    """
+    await configuration_manager.create_category(_CONFIG_CATEGORY_NAME, _DEFAULT_PURGE_CONFIG,
+                                                _CONFIG_CATEGORY_DESCRIPTION)
+    return await configuration_manager.get_category_all_items(_CONFIG_CATEGORY_NAME)
 
 
 def set_configuration():
@@ -121,15 +289,353 @@ def set_configuration():
     :return:
         Configuration information that was set for purge process
     """
-    event_loop = asyncio.get_event_loop()
-    event_loop.run_until_complete(configuration_manager.create_category(_CONFIG_CATEGORY_NAME, _DEFAULT_PURGE_CONFIG,
-                                                                        _CONFIG_CATEGORY_DESCRIPTION))
-    return event_loop.run_until_complete(configuration_manager.get_category_all_items(_CONFIG_CATEGORY_NAME))
+    return asyncio.get_event_loop().run_until_complete(read_configuration())
+
+
+async def count_rows(table_name)->int:
+    """"Returns the number of rows in a table
+
+    count(*) reads the whole table, so when pg_class.reltuples estimates that the
+    table is larger than _EXACT_COUNT_MAX_ROWS, the estimate is returned instead.
+    """
+    estimate_query = sqlalchemy.select([sqlalchemy.text('reltuples::bigint')]).select_from(
+        sqlalchemy.text('pg_class')).where(sqlalchemy.text("oid = to_regclass('{}')".format(table_name.name)))
+    estimate = await fetch_scalar(estimate_query)
+
+    if estimate is not None and estimate > _EXACT_COUNT_MAX_ROWS:
+        return int(estimate)
+
+    return await fetch_scalar(sqlalchemy.select([sqlalchemy.func.count()]).select_from(table_name))
+
+
+async def delete_rows(table_name, condition, **params)->int:
+    """"DELETE the rows of a table that match condition and subtract them from the asset catalog
+    Args:
+        condition (str): SQL condition. params are bound to its :name parameters.
+    :return:
+        Number of rows removed
+    """
+    stmt = sqlalchemy.text(_DELETE_READINGS.format(
+        _CATALOG_LOCK, table_name.name, condition, _CATALOG_SUBTRACT.format('removed'))).bindparams(**params)
+    return await fetch_scalar(stmt)
+
+
+async def update_catalog_first_ts(table_name, age_timestamp):
+    """"Recalculate first_ts in the asset catalog after rows older than age_timestamp were removed, and remove the
+    hours that no longer hold readings"""
+    await execute_rowcount(sqlalchemy.text(_CATALOG_FIRST_TS.format(table_name.name)).bindparams(
+        age_timestamp=age_timestamp))
+    await execute_rowcount(sqlalchemy.text(_EMPTY_HOURS))
+
+
+async def delete_chunks(table_name, age_timestamp, min_id, max_id, chunk_rows, pause_seconds)->int:
+    """"DELETE rows older than age_timestamp whose ids are between min_id and max_id
+
+    Each range of chunk_rows ids is deleted in its own transaction, so locks are held
+    briefly and autovacuum can reclaim space while the purge continues.
+    :return:
+        Number of rows removed
+    """
+    rows_removed = 0
+
+    for first_id in range(min_id, max_id + 1, chunk_rows):
+        last_id = min(first_id + chunk_rows - 1, max_id)
+        rows_removed += await delete_rows(table_name,
+                                          'id >= :first_id AND id <= :last_id AND user_ts <= :age_timestamp',
+                                          first_id=first_id, last_id=last_id, age_timestamp=age_timestamp)
+
+        # Let other coroutines, such as ingest, run between transactions
+        if last_id < max_id:
+            await asyncio.sleep(pause_seconds)
+
+    return rows_removed
+
+"""Size and rate limits"""
+
+
+async def estimate_row_bytes(table_name, row_count)->float:
+    """"Estimate the number of bytes used per row
+
+    Space freed by deleting rows from an unpartitioned table is reused rather than returned, so the
+    size on disk does not shrink. For those tables, the average column widths gathered by ANALYZE are
+    used when available, scaled by the ratio of the total size to the heap size so that indexes and
+    TOAST data are counted. Otherwise the size of the table, including its partitions, indexes and
+    TOAST data, is divided by row_count.
+    """
+    if not await is_partitioned(table_name):
+        width = await fetch_scalar(sqlalchemy.text(
+            "SELECT ((SELECT sum(avg_width) FROM pg_stats WHERE schemaname = 'foglamp' AND tablename = '{0}') + {1}) "
+            "* COALESCE(pg_total_relation_size(c)::double precision / NULLIF(pg_relation_size(c), 0), 1) "
+            "FROM to_regclass('{0}') AS c".format(table_name.name, _ROW_OVERHEAD_BYTES)))
+        if width:
+            return float(width)
+
+    if not row_count:
+        return 0.0
+
+    size = await fetch_scalar(sqlalchemy.text(
+        "SELECT pg_total_relation_size(c) + COALESCE((SELECT sum(pg_total_relation_size(inhrelid)) "
+        "FROM pg_inherits WHERE inhparent = c), 0) FROM to_regclass('{}') AS c".format(table_name.name)))
+    return float(size or 0) / row_count
+
+
+async def row_limit(config, table_name, row_count):
+    """"Returns the number of rows the table may hold under maxRows and maxTableSizeMB, or None if neither is set"""
+    limits = []
+
+    max_rows = max(int(config['maxRows']['value']), 0)
+    if max_rows:
+        limits.append(max_rows)
+
+    max_bytes = max(int(config['maxTableSizeMB']['value']), 0) * 1024 * 1024
+    if max_bytes:
+        row_bytes = await estimate_row_bytes(table_name, row_count)
+        if row_bytes:
+            limits.append(int(max_bytes // row_bytes))
+
+    return min(limits) if limits else None
+
+
+async def apply_row_limit(config, table_name, age_timestamp, row_count):
+    """"Move the age cutoff forward when the table holds more rows than row_limit allows
+    :return:
+        The later of age_timestamp and the user_ts of the newest row that must be removed
+    """
+    limit = await row_limit(config, table_name, row_count)
+
+    if limit is None or row_count <= limit:
+        return age_timestamp
+
+    # The rows with the smallest ids are removed first. Skipping rows in id order would read every row that is
+    # removed, so the cutoff id assumes that the ids between the smallest and the largest id are used evenly.
+    # Both statements are primary key lookups.
+    min_id, max_id = (await fetch_all(sqlalchemy.select([sqlalchemy.func.min(table_name.c.id),
+                                                         sqlalchemy.func.max(table_name.c.id)]).select_from(
+        table_name)))[0]
+    if max_id is None:
+        return age_timestamp
+
+    cutoff_id = max_id - int(math.ceil(limit * (max_id - min_id + 1) / row_count))
+    cutoff_query = sqlalchemy.select([table_name.c.user_ts]).select_from(table_name).where(
+        table_name.c.id <= cutoff_id).order_by(table_name.c.id.desc()).limit(1)
+    cutoff_timestamp = await fetch_scalar(cutoff_query)
+
+    if cutoff_timestamp is None or cutoff_timestamp <= age_timestamp:
+        return age_timestamp
+
+    _LOGGER.info('%s rows exceed the limit of %s rows. Removing rows up to %s.', row_count - limit, limit,
+                 cutoff_timestamp)
+    return cutoff_timestamp
+
+
+async def next_purge_delay(config, table_name):
+    """"Returns the number of seconds until the purge should run again, ahead of its schedule, or None
+
+    The ingest rate is measured from max(id) between calls. When the rows that can still be added under
+    row_limit would be used up before the next scheduled purge, the purge runs again after half of that
+    time, but no sooner than minPurgeIntervalSeconds.
+    """
+    global _last_max_id, _last_max_id_time
+
+    max_id = await fetch_scalar(sqlalchemy.select([sqlalchemy.func.max(table_name.c.id)]).select_from(table_name))
+    now = time.monotonic()
+
+    previous_max_id, previous_time = _last_max_id, _last_max_id_time
+    _last_max_id, _last_max_id_time = max_id, now
+
+    if previous_max_id is None or max_id is None or now <= previous_time:
+        return None
+
+    rows_per_second = (max_id - previous_max_id) / (now - previous_time)
+    if rows_per_second <= 0:
+        return None
+
+    row_count = await count_rows(table_name)
+    limit = await row_limit(config, table_name, row_count)
+    if limit is None:
+        return None
+
+    schedule_interval = await fetch_scalar(sqlalchemy.text(
+        "SELECT min(schedule_interval) FROM schedules WHERE process_name = 'purge'"))
+    if schedule_interval is None:
+        return None
+
+    seconds_to_limit = max(limit - row_count, 0) / rows_per_second
+    if seconds_to_limit >= schedule_interval.total_seconds():
+        return None
+
+    return max(seconds_to_limit / 2, int(config['minPurgeIntervalSeconds']['value']))
+
+"""Partitioned readings"""
+
+
+async def is_partitioned(table_name)->bool:
+    """"Returns True if the table is partitioned"""
+    stmt = sqlalchemy.text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+                           "WHERE partrelid = to_regclass('{}'))".format(table_name.name))
+    return await fetch_scalar(stmt)
+
+
+async def list_partitions(table_name)->list:
+    """"Returns the partitions of a table that are not the default partition
+    :return:
+        A list of (name, lower bound, upper bound) ordered by lower bound
+    """
+    stmt = sqlalchemy.text("SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+                           "JOIN pg_class c ON c.oid = i.inhrelid "
+                           "WHERE i.inhparent = to_regclass('{}')".format(table_name.name))
+
+    partitions = []
+    for name, bound in await fetch_all(stmt):
+        match = _PARTITION_BOUND_PATTERN.search(bound)
+        if match:
+            partitions.append((name, dateutil.parser.parse(match.group(1)), dateutil.parser.parse(match.group(2))))
+
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+async def create_partitions(table_name, interval, now=None)->list:
+    """"Create partitions for the period containing now and the next _PARTITIONS_AHEAD periods
+
+    Rows in the default partition that belong to a new partition are moved to it.
+    Periods that overlap an existing partition are skipped.
+    :return:
+        Names of the partitions created
+    """
+    try:
+        period, suffix_format = _PARTITION_INTERVALS[interval]
+    except KeyError:
+        raise ValueError('partitionInterval must be one of: ' + ', '.join(sorted(_PARTITION_INTERVALS)))
+
+    if now is None:
+        now = datetime.datetime.now(datetime.timezone.utc)
+
+    start = now.astimezone(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0)
+    if period >= datetime.timedelta(days=1):
+        start = start.replace(hour=0)
+
+    existing = await list_partitions(table_name)
+    created = []
+
+    for _ in range(_PARTITIONS_AHEAD + 1):
+        end = start + period
+
+        if not any(lower < end and start < upper for _, lower, upper in existing):
+            name = '{}_{}'.format(table_name.name, start.strftime(suffix_format))
+            bounds = "FROM ('{}') TO ('{}')".format(start.isoformat(), end.isoformat())
+
+            await execute_in_transaction(
+                sqlalchemy.text("CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS) TABLESPACE foglamp".format(
+                    name, table_name.name)),
+                sqlalchemy.text("WITH moved AS (DELETE FROM {0}_default WHERE user_ts >= '{1}' AND user_ts < '{2}' "
+                                "RETURNING *) INSERT INTO {3} SELECT * FROM moved".format(
+                                    table_name.name, start.isoformat(), end.isoformat(), name)),
+                sqlalchemy.text("ALTER TABLE {} ATTACH PARTITION {} FOR VALUES {}".format(
+                    table_name.name, name, bounds)))
+
+            _LOGGER.info('Created partition %s', name)
+            created.append(name)
+
+        start = end
+
+    return created
+
+
+async def drop_partitions(table_name, age_timestamp, last_id, retain_unsent)->(int, int):
+    """"DETACH and DROP partitions whose rows are all older than age_timestamp
+
+    The partition's rows are not read. Its readings are subtracted from the asset catalog using the counts of its
+    hours in foglamp.asset_catalog_hours, which requires partition bounds on whole hours. Only the unsent rows are
+    counted, through the primary key on (id, user_ts).
+    :return:
+        total_rows_removed, unsent_rows_removed
+    """
+    total_rows_removed = 0
+    unsent_rows_removed = 0
+
+    for name, lower, upper in await list_partitions(table_name):
+        if upper > age_timestamp:
+            break
+
+        partition = sqlalchemy.table(name, sqlalchemy.column('id'))
+        max_id = await fetch_scalar(sqlalchemy.select([sqlalchemy.func.max(partition.c.id)]).select_from(
+            partition))
+
+        # Keep the remaining partitions too, so that unsent rows are not left behind
+        if retain_unsent and max_id is not None and max_id > last_id:
+            break
+
+        total_rows_removed += await count_rows(partition)
+        if max_id is not None and max_id > last_id:
+            unsent_rows_removed += await fetch_scalar(
+                sqlalchemy.select([sqlalchemy.func.count()]).select_from(partition).where(
+                    partition.c.id > last_id))
+
+        await execute_in_transaction(
+            sqlalchemy.text(_CATALOG_LOCK),
+            sqlalchemy.text(_DROP_HOURS.format(_CATALOG_SUBTRACT.format('removed'))).bindparams(
+                lower=lower, upper=upper),
+            sqlalchemy.text("ALTER TABLE {} DETACH PARTITION {}".format(table_name.name, name)),
+            sqlalchemy.text("DROP TABLE {}".format(name)))
+
+        _LOGGER.info('Dropped partition %s', name)
+
+    return total_rows_removed, unsent_rows_removed
+
+
+async def purge_partitions(config, table_name):
+    """"Purge a table that is partitioned by user_ts
+    :return:
+        total_rows_removed, unsent_rows_removed
+    """
+    start_time = time.strftime('%Y-%m-%d %H:%M:%S.%s', time.localtime(time.time()))
+
+    last_id_query = sqlalchemy.select([sqlalchemy.func.min(_STREAMS_TABLE.c.last_object)]).select_from(_STREAMS_TABLE)
+    result = await fetch_scalar(last_id_query)
+    last_id = result if result else 0
+
+    age_query = sqlalchemy.select([sqlalchemy.func.current_timestamp() -
+                                   datetime.timedelta(hours=int(config['age']['value']))])
+    age_timestamp = await fetch_scalar(age_query)
+    total_count = await count_rows(table_name)
+    age_timestamp = await apply_row_limit(config, table_name, age_timestamp, total_count)
+    retain_unsent = config['retainUnsent']['value'] == 'True'
+
+    await create_partitions(table_name, config['partitionInterval']['value'])
+    total_rows_removed, unsent_rows_removed = await drop_partitions(table_name, age_timestamp, last_id,
+                                                                    retain_unsent)
+
+    # The default partition holds rows outside of every partition's range
+    default_partition = sqlalchemy.table('{}_default'.format(table_name.name))
+    if retain_unsent:
+        total_rows_removed += await delete_rows(default_partition, 'user_ts <= :age_timestamp AND id <= :last_id',
+                                                age_timestamp=age_timestamp, last_id=last_id)
+    else:
+        # Unsent rows are deleted separately so that they are counted
+        default_unsent_rows_removed = await delete_rows(
+            default_partition, 'user_ts <= :age_timestamp AND id > :last_id',
+            age_timestamp=age_timestamp, last_id=last_id)
+        unsent_rows_removed += default_unsent_rows_removed
+        total_rows_removed += default_unsent_rows_removed + await delete_rows(
+            default_partition, 'user_ts <= :age_timestamp', age_timestamp=age_timestamp)
+
+    await update_catalog_first_ts(table_name, age_timestamp)
+
+    rows_remaining = max(int(total_count) - int(total_rows_removed), 0)
+    error_level = 2 if unsent_rows_removed > 0 else 0
+
+    end_time = time.strftime('%Y-%m-%d %H:%M:%S.%s', time.localtime(time.time()))
+
+    await insert_into_log(level=error_level, log={"start_time": start_time, "end_time": end_time,
+                                            "rowsRemoved": total_rows_removed, "unsentRowsRemoved": unsent_rows_removed,
+                                            "failedRemovals": 0, "rowsRemaining": rows_remaining})
+
+    return total_rows_removed, unsent_rows_removed
 
 """The actual purge process"""
 
 
-def purge(config, table_name):
+async def purge_readings(config, table_name):
     """"Column information
     start_time - time that purge process began
     end_time - time that purge process ended
@@ -143,49 +649,67 @@ def purge(config, table_name):
     rows_remaining - total number of rows remain at screen shot
         - total_row - total_rows_removed
     """
+    if await is_partitioned(table_name):
+        return await purge_partitions(config, table_name)
+
     start_time = time.strftime('%Y-%m-%d %H:%M:%S.%s', time.localtime(time.time()))
 
     unsent_rows_removed = 0
     last_id_query = sqlalchemy.select([sqlalchemy.func.min(_STREAMS_TABLE.c.last_object)]).select_from(_STREAMS_TABLE)
-    result = execute_command(last_id_query).fetchall()[0][0]
+    result = await fetch_scalar(last_id_query)
     last_id = result if result else 0
 
     # Calculate current count and age_timestamp
-    age_and_count_query = sqlalchemy.select([sqlalchemy.func.current_timestamp() -
-                                             datetime.timedelta(hours=int(config['age']['value'])),
-    sqlalchemy.func.count()]).select_from(table_name)
+    age_query = sqlalchemy.select([sqlalchemy.func.current_timestamp() -
+                                   datetime.timedelta(hours=int(config['age']['value']))])
 
-    result = execute_command(age_and_count_query).fetchall()
-    age_timestamp = result[0][0]    
-    total_count = result[0][1]
+    age_timestamp = await fetch_scalar(age_query)
+    total_count = await count_rows(table_name)
+    age_timestamp = await apply_row_limit(config, table_name, age_timestamp, total_count)
 
-    delete_query = sqlalchemy.delete(table_name).where(table_name.c.user_ts <= age_timestamp)
-    failed_removal_query = sqlalchemy.select([sqlalchemy.func.count()]).select_from(table_name).where(
-        table_name.c.user_ts <= age_timestamp)
-    
+    chunk_rows = max(int(config['chunkRows']['value']), 0)
+
+    # The cutoff id is the largest id of a row older than age_timestamp. Finding it uses the BRIN index on
+    # user_ts, which only visits the block ranges that hold old rows. Every other statement is restricted
+    # to ids up to the cutoff so that it is an index range scan of the primary key.
     max_id_query = sqlalchemy.select([sqlalchemy.func.max(table_name.c.id)]).select_from(table_name).where(
         table_name.c.user_ts <= age_timestamp)
-    max_id = execute_command(max_id_query).fetchall()[0][0]
+    max_id = await fetch_scalar(max_id_query)
 
     # If max_id is not an integer than it is assumed that no rows would be removed
     if max_id is None: 
         total_rows_removed = 0 
         unsent_rows_removed = 0 
         failed_removal = 0 
-    # if retainUnsent is True then delete by both age_timestamp & last_id; else only by age_timestamp
-    elif config['retainUnsent']['value'] == 'True':
-        total_rows_removed = execute_command(delete_query.where(table_name.c.id <= last_id)).rowcount
-        failed_removal = execute_command(failed_removal_query.where(table_name.c.id <= last_id)).fetchall()[0][0]
-    else: 
-        total_rows_removed = execute_command(delete_query).rowcount
-        failed_removal = execute_command(failed_removal_query).fetchall()[0][0] 
-        unsent_rows_removed = int(max_id) - int(last_id)
+    else:
+        # if retainUnsent is True then delete by both age_timestamp & last_id; else only by age_timestamp
+        if config['retainUnsent']['value'] == 'True':
+            upper_id = min(int(max_id), int(last_id))
+        else:
+            upper_id = int(max_id)
+            unsent_rows_removed = int(max_id) - int(last_id)
+
+        if chunk_rows:
+            min_id_query = sqlalchemy.select([sqlalchemy.func.min(table_name.c.id)]).select_from(table_name)
+            min_id = await fetch_scalar(min_id_query)
+
+            total_rows_removed = await delete_chunks(table_name, age_timestamp, int(min_id), upper_id, chunk_rows,
+                                               int(config['chunkPauseMilliseconds']['value']) / 1000)
+        else:
+            total_rows_removed = await delete_rows(table_name, 'id <= :upper_id AND user_ts <= :age_timestamp',
+                                                   upper_id=upper_id, age_timestamp=age_timestamp)
+
+        await update_catalog_first_ts(table_name, age_timestamp)
+
+        failed_removal_query = sqlalchemy.select([sqlalchemy.func.count()]).select_from(table_name).where(
+            table_name.c.id <= upper_id).where(table_name.c.user_ts <= age_timestamp)
+        failed_removal = await fetch_scalar(failed_removal_query)
 
     if unsent_rows_removed < 0:
         unsent_rows_removed = 0 
            
     # Rows remaining is based on the snapshot taking at the start of the process 
-    rows_remaining = int(total_count) - int(total_rows_removed)
+    rows_remaining = max(int(total_count) - int(total_rows_removed), 0)
 
     """Error Levels: 
     - 0: No errors
@@ -200,22 +724,54 @@ def purge(config, table_name):
 
     end_time = time.strftime('%Y-%m-%d %H:%M:%S.%s', time.localtime(time.time()))
 
-    insert_into_log(level=error_level, log={"start_time": start_time, "end_time": end_time,
+    await insert_into_log(level=error_level, log={"start_time": start_time, "end_time": end_time,
                                             "rowsRemoved": total_rows_removed, "unsentRowsRemoved": unsent_rows_removed,
                                             "failedRemovals": failed_removal, "rowsRemaining": rows_remaining})
 
     return total_rows_removed, unsent_rows_removed 
 
 
+def purge(config, table_name):
+    """"Run purge_readings on the event loop
+    :return:
+        total_rows_removed, unsent_rows_removed
+    """
+    return asyncio.get_event_loop().run_until_complete(purge_readings(config, table_name))
+
+
+async def purge_task():
+    """"Purge the readings table and update the statistics
+
+    The scheduler in the core server runs this coroutine for the 'purge' process. It purges
+    repeatedly while next_purge_delay expects maxRows or maxTableSizeMB to be exceeded before
+    the next scheduled purge.
+    """
+    while True:
+        config = await read_configuration()
+        total_purged, unsent_purged = await purge_readings(config, _READING_TABLE)
+
+        statistics.increment('PURGED', total_purged)
+        statistics.increment('UNSNPURGED', unsent_purged)
+
+        delay = await next_purge_delay(config, _READING_TABLE)
+        if delay is None:
+            break
+
+        _LOGGER.info('Ingest rate is high. Purging again in %s seconds.', delay)
+        await asyncio.sleep(delay)
+
+
 def purge_main():
     """"Execute the processes around and including purge."""
-    config = set_configuration() 
-    total_purged, unsent_purged = purge(config, _READING_TABLE)
-
     event_loop = asyncio.get_event_loop()
-    event_loop.run_until_complete(statistics.update_statistics_value('PURGED', total_purged))
-    event_loop.run_until_complete(statistics.update_statistics_value('UNSNPURGED', unsent_purged))
+    try:
+        event_loop.run_until_complete(purge_task())
+    finally:
+        # The core server writes the statistics periodically. This process writes them before it exits.
+        try:
+            event_loop.run_until_complete(statistics.flush())
+        finally:
+            event_loop.run_until_complete(db_pool.close())
 
 if __name__ == '__main__':
     purge_main()
-
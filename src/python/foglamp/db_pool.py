@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""Process-wide database connection pools
+
+Modules that issue SQL text use :func:`acquire`, which lends asyncpg
+connections from a shared pool. asyncpg caches prepared statements per
+connection, so repeated queries are not parsed and planned again.
+
+Modules that build SQLAlchemy expressions use :func:`acquire_sa`, which
+lends connections from a shared aiopg.sa engine.
+
+Pools are created when first used and belong to the event loop that was
+running at the time. :func:`configure` reads the pool settings from the
+DB_POOL configuration category. When the database server is down, the
+current settings are used and reading them is retried in the background.
+"""
+
+import asyncio
+import time
+
+import aiopg.sa
+import asyncpg
+
+from foglamp import logger
+
+__author__ = "Terris Linenbach"
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+_LOGGER = logger.setup(__name__)
+
+_DB_NAME = 'foglamp'
+_CONNECTION_STRING = "dbname='foglamp'"
+
+_CONFIG_CATEGORY_NAME = 'DB_POOL'
+_CONFIG_CATEGORY_DESCRIPTION = 'Database connection pools'
+
+_DEFAULT_CONFIG = {
+    "minSize": {
+        "description": "Number of connections opened when a pool is created",
+        "type": "integer",
+        "default": "1",
+    },
+    "maxSize": {
+        "description": "Maximum number of connections in a pool",
+        "type": "integer",
+        "default": "10",
+    },
+    "statementCacheSize": {
+        "description": "Number of prepared statements cached per connection. 0 disables "
+                       "the cache.",
+        "type": "integer",
+        "default": "100",
+    },
+    "maxInactiveConnectionSeconds": {
+        "description": "Close pooled connections that have been idle for this number of "
+                       "seconds",
+        "type": "integer",
+        "default": "300",
+    },
+    "healthCheckSeconds": {
+        "description": "When a connection is acquired and this number of seconds has passed "
+                       "since the last check, verify the connection and recreate the pools "
+                       "if it is broken. 0 disables health checks.",
+        "type": "integer",
+        "default": "30",
+    }
+}
+
+# Configuration
+_min_size = 1
+_max_size = 10
+_statement_cache_size = 100
+_max_inactive_connection_seconds = 300
+_health_check_seconds = 30
+
+_configure_retry_seconds = 5
+"""When the settings could not be read, number of seconds between attempts to read them"""
+
+# State
+_loop = None  # type: asyncio.AbstractEventLoop
+"""The event loop that owns _pool and _engine"""
+
+_pool = None  # type: asyncpg.pool.Pool
+_pool_future = None  # type: asyncio.Future
+"""Completes when _pool has been created"""
+
+_engine = None  # type: aiopg.sa.Engine
+_engine_future = None  # type: asyncio.Future
+"""Completes when _engine has been created"""
+
+_last_health_check_time = 0.0
+"""When a connection was last verified (time.monotonic)"""
+
+_configure_task = None  # type: asyncio.Task
+"""asyncio task for :func:`_retry_configure`"""
+
+
+def _check_loop():
+    """Forgets pools that belong to a different event loop. They can not be
+    used, or closed, from the current loop."""
+    global _loop, _pool, _pool_future, _engine, _engine_future, _configure_task
+
+    loop = asyncio.get_event_loop()
+
+    if _loop is not loop:
+        _loop = loop
+        _pool = None
+        _pool_future = None
+        _engine = None
+        _engine_future = None
+        _configure_task = None
+
+
+async def _create_pool()->asyncpg.pool.Pool:
+    return await asyncpg.create_pool(
+        database=_DB_NAME,
+        min_size=_min_size,
+        max_size=_max_size,
+        max_inactive_connection_lifetime=_max_inactive_connection_seconds,
+        statement_cache_size=_statement_cache_size)
+
+
+async def _create_engine()->aiopg.sa.Engine:
+    return await aiopg.sa.create_engine(_CONNECTION_STRING, minsize=_min_size,
+                                        maxsize=_max_size)
+
+
+async def get_pool()->asyncpg.pool.Pool:
+    """Returns the asyncpg pool, creating it if necessary"""
+    global _pool, _pool_future
+
+    _check_loop()
+
+    if _pool is not None:
+        return _pool
+
+    # Concurrent callers wait for the same pool
+    if _pool_future is None:
+        _pool_future = asyncio.ensure_future(_create_pool())
+
+    future = _pool_future
+
+    try:
+        pool = await asyncio.shield(future)
+    finally:
+        if _pool_future is future:
+            _pool_future = None
+
+    if _pool is None:
+        _pool = pool
+
+    return pool
+
+
+async def get_engine()->aiopg.sa.Engine:
+    """Returns the aiopg.sa engine, creating it if necessary"""
+    global _engine, _engine_future
+
+    _check_loop()
+
+    if _engine is not None:
+        return _engine
+
+    if _engine_future is None:
+        _engine_future = asyncio.ensure_future(_create_engine())
+
+    future = _engine_future
+
+    try:
+        engine = await asyncio.shield(future)
+    finally:
+        if _engine_future is future:
+            _engine_future = None
+
+    if _engine is None:
+        _engine = engine
+
+    return engine
+
+
+async def _reset_if_unhealthy(connection: asyncpg.connection.Connection)->bool:
+    """Checks the connection when _health_check_seconds have passed since the
+    last check
+
+    A broken connection usually means the database server was restarted, in
+    which case every pooled connection is broken. Both pools are terminated so
+    that they are recreated.
+
+    Returns:
+        True if the pools were terminated. connection can not be used.
+    """
+    global _last_health_check_time, _pool, _engine
+
+    if not _health_check_seconds:
+        return False
+
+    now = time.monotonic()
+    if now - _last_health_check_time < _health_check_seconds:
+        return False
+
+    _last_health_check_time = now
+
+    try:
+        await connection.fetchval('SELECT 1')
+        return False
+    except Exception:
+        _LOGGER.warning('Database connection health check failed. Recreating the pools.')
+
+    pool, _pool = _pool, None
+    engine, _engine = _engine, None
+
+    if pool is not None:
+        pool.terminate()
+
+    if engine is not None:
+        engine.terminate()
+
+    return True
+
+
+class _AcquireContext(object):
+    """Returned by :func:`acquire`"""
+    __slots__ = ['_pool', '_connection']
+
+    async def __aenter__(self)->asyncpg.connection.Connection:
+        self._pool = await get_pool()
+        self._connection = await self._pool.acquire()
+
+        if await _reset_if_unhealthy(self._connection):
+            self._pool = await get_pool()
+            self._connection = await self._pool.acquire()
+
+        return self._connection
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._pool.release(self._connection)
+
+
+class _SAAcquireContext(object):
+    """Returned by :func:`acquire_sa`"""
+    __slots__ = ['_context']
+
+    async def __aenter__(self)->aiopg.sa.SAConnection:
+        engine = await get_engine()
+        self._context = engine.acquire()
+        return await self._context.__aenter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._context.__aexit__(exc_type, exc, tb)
+
+
+def acquire()->_AcquireContext:
+    """Lends an asyncpg connection from the shared pool
+
+    :Example:
+
+    .. code-block:: python
+
+        async with db_pool.acquire() as connection:
+            rows = await connection.fetch('SELECT key, value FROM statistics')
+    """
+    return _AcquireContext()
+
+
+def acquire_sa()->_SAAcquireContext:
+    """Lends an aiopg.sa connection from the shared engine
+
+    :Example:
+
+    .. code-block:: python
+
+        async with db_pool.acquire_sa() as connection:
+            await connection.execute(table.update().values(value=1))
+    """
+    return _SAAcquireContext()
+
+
+async def close():
+    """Closes the pools. They are recreated when next used."""
+    global _pool, _engine
+
+    _check_loop()
+
+    pool, _pool = _pool, None
+    engine, _engine = _engine, None
+
+    if pool is not None:
+        await pool.close()
+
+    if engine is not None:
+        engine.close()
+        await engine.wait_closed()
+
+
+async def configure():
+    """Reads the pool settings from the DB_POOL configuration category
+
+    Pools that were created with different settings are closed so that
+    they are recreated with the new settings.
+
+    When the settings can not be read, for example because the database
+    server is down, the current settings are kept and reading them is
+    retried every _configure_retry_seconds until it succeeds.
+    """
+    global _configure_task
+
+    _check_loop()
+
+    try:
+        await _read_config()
+    except Exception:
+        _LOGGER.exception('Unable to read the connection pool configuration. Using the current '
+                          'settings.')
+        if _configure_task is None:
+            _configure_task = asyncio.ensure_future(_retry_configure())
+
+
+async def _retry_configure():
+    """Reads the pool settings every _configure_retry_seconds until it succeeds"""
+    global _configure_task
+
+    try:
+        while True:
+            await asyncio.sleep(_configure_retry_seconds)
+
+            try:
+                await _read_config()
+            except Exception:
+                _LOGGER.warning('Unable to read the connection pool configuration. Retrying in %s '
+                                'seconds.', _configure_retry_seconds)
+                continue
+
+            _LOGGER.info('Read the connection pool configuration')
+            break
+    finally:
+        _configure_task = None
+
+
+async def _read_config():
+    """Reads and applies the pool settings"""
+    global _min_size, _max_size, _statement_cache_size, _max_inactive_connection_seconds
+    global _health_check_seconds
+
+    # configuration_manager uses this module
+    from foglamp import configuration_manager
+
+    await configuration_manager.create_category(_CONFIG_CATEGORY_NAME, _DEFAULT_CONFIG,
+                                                _CONFIG_CATEGORY_DESCRIPTION)
+
+    config = await configuration_manager.get_category_all_items(_CONFIG_CATEGORY_NAME)
+
+    settings = (_min_size, _max_size, _statement_cache_size, _max_inactive_connection_seconds)
+
+    _min_size = max(int(config['minSize']['value']), 1)
+    _max_size = max(int(config['maxSize']['value']), _min_size)
+    _statement_cache_size = max(int(config['statementCacheSize']['value']), 0)
+    _max_inactive_connection_seconds = max(
+        int(config['maxInactiveConnectionSeconds']['value']), 0)
+    _health_check_seconds = max(int(config['healthCheckSeconds']['value']), 0)
+
+    if settings != (_min_size, _max_size, _statement_cache_size,
+                    _max_inactive_connection_seconds):
+        await close()
@@ -47,16 +47,22 @@ _DEFAULT_CONFIG = {
 async def start():
     """Registers CoAP handler to accept sensor readings"""
 
-    # Retrieve CoAP configuration
-    await configuration_manager.create_category(
-        _CONFIG_CATEGORY_NAME,
-        _DEFAULT_CONFIG,
-        _CONFIG_CATEGORY_DESCRIPTION)
-
-    config = await configuration_manager.get_category_all_items(_CONFIG_CATEGORY_NAME)
-
-    uri = config["uri"]["value"]
-    port = config["port"]["value"]
+    # Retrieve CoAP configuration. Readings are accepted, and spooled by Ingest when
+    # enabled, while the database is down.
+    try:
+        await configuration_manager.create_category(
+            _CONFIG_CATEGORY_NAME,
+            _DEFAULT_CONFIG,
+            _CONFIG_CATEGORY_DESCRIPTION)
+
+        config = await configuration_manager.get_category_all_items(_CONFIG_CATEGORY_NAME)
+
+        uri = config["uri"]["value"]
+        port = config["port"]["value"]
+    except Exception:
+        _LOGGER.exception('Unable to read the CoAP configuration. Using the default configuration.')
+        uri = _DEFAULT_CONFIG["uri"]["default"]
+        port = _DEFAULT_CONFIG["port"]["default"]
 
     root = aiocoap.resource.Site()
 
@@ -71,6 +77,96 @@ async def start():
 class CoAPIngest(aiocoap.resource.Resource):
     """Handles incoming sensor readings from CoAP"""
 
+    @staticmethod
+    def _columns_to_readings(payload: dict)->list:
+        """Converts a columnar payload to a list of readings records
+
+        Args:
+            payload:
+                A dictionary similar to the following. keys is optional.
+
+                .. code-block:: python
+
+                    {
+                        "asset": "pump1",
+                        "timestamps": ["2017-01-02T01:02:03.23232Z", "2017-01-02T01:02:04Z"],
+                        "keys": ["80a43623-ebe5-40d6-8d80-3f892da9b3b4",
+                                 "d0bd5fa1-1b17-4a5b-a4d3-3b0d2f1d5c46"],
+                        "readings": {
+                            "velocity": ["500", "501"],
+                            "temperature": [32, 33]
+                        }
+                    }
+
+        Raises:
+            ValueError, TypeError:
+                The payload is not a valid columnar payload
+        """
+        asset = payload.get('asset')
+        timestamps = payload['timestamps']
+        keys = payload.get('keys')
+        columns = payload.get('readings')
+
+        if not isinstance(timestamps, list):
+            raise TypeError('timestamps must be an array')
+
+        num_readings = len(timestamps)
+
+        if keys is None:
+            keys = [None] * num_readings
+        elif not isinstance(keys, list) or len(keys) != num_readings:
+            raise ValueError('keys must be an array the same length as timestamps')
+
+        if columns is None:
+            columns = dict()
+        elif not isinstance(columns, dict):
+            raise TypeError('readings must be a dictionary')
+
+        for name, values in columns.items():
+            if not isinstance(values, list) or len(values) != num_readings:
+                raise ValueError(
+                    'readings.{} must be an array the same length as timestamps'.format(name))
+
+        return [{'asset': asset,
+                 'timestamp': timestamp,
+                 'key': key,
+                 'readings': {name: values[index] for name, values in columns.items()}}
+                for index, (timestamp, key) in enumerate(zip(timestamps, keys))]
+
+    @staticmethod
+    def _count_readings(payload)->int:
+        """Returns the number of readings in a decoded payload"""
+        if isinstance(payload, dict) and isinstance(payload.get('timestamps'), list):
+            return len(payload['timestamps'])
+        if isinstance(payload, list):
+            return len(payload)
+        return 1
+
+    @staticmethod
+    async def _add_readings_bulk(readings_list: list):
+        """Adds a list of readings records
+
+        Returns:
+            A tuple of (CoAP response code, message). The message summarizes
+            how many records were accepted and why records were rejected.
+        """
+        results = await Ingest.add_readings_bulk([
+            dict(item, readings=item.get('readings', item.get('sensor_values')))
+            if isinstance(item, dict) else item
+            for item in readings_list])
+
+        errors = [{'index': index, 'message': str(result)}
+                  for index, result in enumerate(results) if result is not None]
+        accepted = len(results) - len(errors)
+
+        if accepted:
+            code = aiocoap.numbers.codes.Code.VALID
+        else:
+            code = aiocoap.numbers.codes.Code.BAD_REQUEST
+
+        return code, json.dumps({'accepted': accepted, 'rejected': len(errors),
+                                 'errors': errors})
+
     @staticmethod
     async def render_post(request):
         """Store sensor readings from CoAP to FogLAMP
@@ -94,6 +190,18 @@ class CoAPIngest(aiocoap.resource.Resource):
                             }
                         }
                     }
+
+                The payload can also be an array of such dictionaries, or a
+                columnar dictionary with one asset and arrays of timestamps and
+                values (see :meth:`_columns_to_readings`). For these payloads,
+                the response payload is a JSON summary such as
+                {"accepted": 9, "rejected": 1, "errors": [{"index": 3, "message": "..."}]}
+                and the response code is VALID when at least one reading was accepted.
+
+                When FogLAMP is busy, the response code is SERVICE_UNAVAILABLE
+                and the Max-Age option is the number of seconds to wait before
+                resending the payload. The readings are counted as deferred
+                rather than discarded.
         """
         # TODO: aiocoap handlers must be defensive about exceptions. If an exception
         # is raised out of a handler, it is permanently disabled by aiocoap.
@@ -104,44 +212,61 @@ class CoAPIngest(aiocoap.resource.Resource):
         # and will be moved to a .rst file
 
         code = aiocoap.numbers.codes.Code.INTERNAL_SERVER_ERROR
-        increment_discarded_counter = True
+        discarded_readings = 1
         message = ''
+        retry_after_seconds = None
 
         try:
+            payload = cbor2.loads(request.payload)
+            discarded_readings = CoAPIngest._count_readings(payload)
+
             if not Ingest.is_available():
-                message = '{"busy": true}'
+                Ingest.increment_deferred_readings(discarded_readings)
+                discarded_readings = 0
+                retry_after_seconds = Ingest.get_retry_after_seconds()
+                code = aiocoap.numbers.codes.Code.SERVICE_UNAVAILABLE
+                message = json.dumps({'busy': True, 'retryAfter': retry_after_seconds})
             else:
-                payload = cbor2.loads(request.payload)
+                if isinstance(payload, dict) and 'timestamps' in payload:
+                    payload = CoAPIngest._columns_to_readings(payload)
 
-                if not isinstance(payload, dict):
-                    raise ValueError('Payload must be a dictionary')
+                if isinstance(payload, list):
+                    code, message = await CoAPIngest._add_readings_bulk(payload)
+                    discarded_readings = 0
+                else:
+                    if not isinstance(payload, dict):
+                        raise ValueError('Payload must be a dictionary')
 
-                asset = payload.get('asset')
-                timestamp = payload.get('timestamp')
+                    asset = payload.get('asset')
+                    timestamp = payload.get('timestamp')
 
-                key = payload.get('key')
+                    key = payload.get('key')
 
-                # readings and sensor_readings are optional
-                try:
-                    readings = payload['readings']
-                except KeyError:
-                    readings = payload.get('sensor_values')  # sensor_values is deprecated
+                    # readings and sensor_readings are optional
+                    try:
+                        readings = payload['readings']
+                    except KeyError:
+                        readings = payload.get('sensor_values')  # sensor_values is deprecated
 
-                increment_discarded_counter = False
+                    discarded_readings = 0
 
-                await Ingest.add_readings(asset=asset, timestamp=timestamp, key=key,
-                                          readings=readings)
+                    await Ingest.add_readings(asset=asset, timestamp=timestamp, key=key,
+                                              readings=readings)
 
-                # Success
-                code = aiocoap.numbers.codes.Code.VALID
+                    # Success
+                    code = aiocoap.numbers.codes.Code.VALID
         except (ValueError, TypeError) as e:
             code = aiocoap.numbers.codes.Code.BAD_REQUEST
-            message = json.dumps({message: str(e)})
+            message = json.dumps({'message': str(e)})
         except Exception:
             _LOGGER.exception('Add readings failed')
 
-        if increment_discarded_counter:
+        for _ in range(discarded_readings):
             Ingest.increment_discarded_readings()
 
-        return aiocoap.Message(payload=message.encode('utf-8'), code=code)
+        response = aiocoap.Message(payload=message.encode('utf-8'), code=code)
+
+        if retry_after_seconds is not None:
+            response.opt.max_age = retry_after_seconds
 
+        return response
@@ -8,16 +8,33 @@
 
 import asyncio
 import datetime
+import itertools
 import logging
+import math
+import os
+import re
+import time
 import uuid
-from typing import List, Union
+from typing import Callable, List, Union
 
 import asyncpg
 import dateutil.parser
 import json
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+from foglamp import configuration_manager
 from foglamp import logger
 from foglamp import statistics
+from foglamp.device.spool import Spool
 
 
 __author__ = "Terris Linenbach"
@@ -29,7 +46,134 @@ _LOGGER = logger.setup(__name__)  # type: logging.Logger
 # _LOGGER = logger.setup(__name__, level=logging.DEBUG)  # type: logging.Logger
 # _LOGGER = logger.setup(__name__, destination=logger.CONSOLE, level=logging.DEBUG)
 
-_STATISTICS_WRITE_FREQUENCY_SECONDS = 5
+
+_TIMESTAMP_PATTERN = re.compile(
+    r'(\d{4})-(\d{2})-(\d{2})[Tt ](\d{2}):(\d{2}):(\d{2})(?:[.,](\d{1,6})\d*)?'
+    r'(?:([Zz])|([+-])(\d{2}):?(\d{2}))?$')
+"""Matches RFC 3339 and common ISO 8601 timestamps"""
+
+try:
+    _fromisoformat = datetime.datetime.fromisoformat
+except AttributeError:  # Python < 3.7
+    _fromisoformat = None
+
+
+def _parse_timestamp(timestamp)->datetime.datetime:
+    """Converts a timestamp string to a datetime
+
+    Tries datetime.datetime.fromisoformat, then _TIMESTAMP_PATTERN. Other
+    formats, and values that are not strings, are passed to
+    dateutil.parser.parse, which is much slower.
+
+    Raises:
+        ValueError, TypeError:
+            timestamp could not be converted
+    """
+    if isinstance(timestamp, str):
+        if _fromisoformat is not None:
+            try:
+                return _fromisoformat(timestamp)
+            except ValueError:
+                pass
+
+        match = _TIMESTAMP_PATTERN.match(timestamp)
+        if match is not None:
+            (year, month, day, hour, minute, second, fraction,
+             utc, offset_sign, offset_hours, offset_minutes) = match.groups()
+
+            if utc:
+                tzinfo = datetime.timezone.utc
+            elif offset_sign:
+                offset = datetime.timedelta(hours=int(offset_hours), minutes=int(offset_minutes))
+                tzinfo = datetime.timezone(-offset if offset_sign == '-' else offset)
+            else:
+                tzinfo = None
+
+            try:
+                return datetime.datetime(int(year), int(month), int(day), int(hour),
+                                         int(minute), int(second),
+                                         int(fraction.ljust(6, '0')) if fraction else 0,
+                                         tzinfo)
+            except ValueError:
+                pass
+
+    return dateutil.parser.parse(timestamp)
+
+
+def _encode_readings_json(readings: List[dict])->List[str]:
+    """Converts readings dicts to JSON strings using the standard library"""
+    encode = json.JSONEncoder().encode
+    return [encode(reading) for reading in readings]
+
+
+def _encode_readings_ujson(readings: List[dict])->List[str]:
+    """Converts readings dicts to JSON strings using ujson"""
+    dumps = ujson.dumps
+    return [dumps(reading) for reading in readings]
+
+
+def _encode_readings_orjson(readings: List[dict])->List[str]:
+    """Converts readings dicts to JSON strings using orjson"""
+    dumps = orjson.dumps
+    return [dumps(reading).decode('utf-8') for reading in readings]
+
+
+READINGS_ENCODERS = {'json': _encode_readings_json}
+"""Available readings encoders by name"""
+
+if ujson is not None:
+    READINGS_ENCODERS['ujson'] = _encode_readings_ujson
+
+if orjson is not None:
+    READINGS_ENCODERS['orjson'] = _encode_readings_orjson
+
+_CONFIG_CATEGORY_NAME = 'DEVICE'
+_CONFIG_CATEGORY_DESCRIPTION = 'Device server configuration'
+
+_DEFAULT_CONFIG = {
+    "readingsQueues": {
+        "description": "Number of readings insert queues. Each queue has its own database "
+                       "connection.",
+        "type": "integer",
+        "default": "1",
+    },
+    "autoScaleReadingsQueues": {
+        "description": "Add readings insert queues, up to maxReadingsQueues, when queues are "
+                       "full and remove idle queues, down to readingsQueues",
+        "type": "boolean",
+        "default": "False",
+    },
+    "maxReadingsQueues": {
+        "description": "Maximum number of readings insert queues when auto-scaling",
+        "type": "integer",
+        "default": "4",
+    },
+    "writeStatisticsSeconds": {
+        "description": "Number of seconds between updates of the readings statistics. They are "
+                       "written to storage every flushSeconds (STATISTICS).",
+        "type": "integer",
+        "default": "5",
+    },
+    "spoolReadings": {
+        "description": "Write batches of readings that can not be inserted into the database "
+                       "to local files and insert them when the database is available again",
+        "type": "boolean",
+        "default": "False",
+    },
+    "spoolDirectory": {
+        "description": "Directory for spooled readings",
+        "type": "string",
+        "default": "~/var/spool/foglamp/readings",
+    },
+    "spoolFsync": {
+        "description": "Flush each spooled batch to disk before continuing",
+        "type": "boolean",
+        "default": "True",
+    }
+}
+
+_READINGS_COLUMNS = ('asset_code', 'user_ts', 'read_key', 'reading')
+"""Columns provided by items in the readings queues, in order"""
 
 
 class Ingest(object):
@@ -50,6 +194,10 @@ class Ingest(object):
     _discarded_readings_stats = 0  # type: int
     """Number of readings rejected before statistics were flushed to storage"""
 
+    _deferred_readings_stats = 0  # type: int
+    """Number of readings turned away because the queues were full before statistics
+    were flushed to storage"""
+
     _write_statistics_task = None  # type: asyncio.Task
     """asyncio task for :meth:`_write_statistics`"""
 
@@ -76,9 +224,80 @@ class Ingest(object):
     _insert_readings_wait_tasks = None  # type: List[asyncio.Task]
     """asyncio tasks for asyncio.Queue.get called by :meth:`_insert_readings`"""
 
-    # Configuration
     _num_readings_queues = 1
-    """Maximum number of insert queues. Each queue has its own database connection."""
+    """Current number of insert queues. Each queue has its own database connection."""
+
+    _full_readings_queue_count = 0
+    """Number of consecutive times :meth:`is_available` found the current queue full"""
+
+    _readings_arrivals = 0  # type: int
+    """Number of readings added since :meth:`_adjust_readings_batch_size` last ran"""
+
+    _last_batch_size_adjust_time = None  # type: float
+    """When :meth:`_adjust_readings_batch_size` last ran (time.monotonic)"""
+
+    _readings_arrival_rate = 0.0  # type: float
+    """Moving average of the number of readings added per second"""
+
+    _readings_insert_rate = 0.0  # type: float
+    """Moving average of the number of rows a single batch insert commits per second"""
+
+    _last_readings_insert_time = None  # type: float
+    """When a batch was last inserted successfully (time.monotonic)"""
+
+    _spool = None  # type: Spool
+    """Batches that could not be inserted. None when spooling is disabled."""
+
+    _retired_spools = []  # type: List[Spool]
+    """Spools replaced by a configuration change. Their segments are replayed
+    by :meth:`_replay_spool` until none remain."""
+
+    _spool_segment_offsets = {}  # type: dict
+    """Number of batches already replayed from each spool segment, by path.
+    Not persisted, so a segment that was partially replayed before a restart
+    is replayed again from the start. Readings with keys are not duplicated."""
+
+    _spool_replay_attempts = 0
+    """Number of consecutive times the database rejected the oldest spooled batch"""
+
+    _last_spool_time = None  # type: float
+    """When a batch was last appended to the spool (time.monotonic)"""
+
+    _drain_spool_task = None  # type: asyncio.Task
+    """asyncio task for :meth:`_drain_spool`"""
+
+    _drain_spool_sleep_task = None  # type: asyncio.Task
+    """asyncio task for asyncio.sleep"""
+
+    _read_config_task = None  # type: asyncio.Task
+    """asyncio task for :meth:`_retry_read_config`"""
+
+    # Configuration
+    _read_config_retry_seconds = 5
+    """When the configuration could not be read at startup, number of seconds between
+    attempts to read it"""
+
+    _config_cache_path = '~/var/lib/foglamp/device-config.json'
+    """Where the last configuration that was read is saved. It is used when the
+    configuration can not be read at startup."""
+
+    _min_readings_queues = 1
+    """Number of insert queues created by :meth:`start`. When auto-scaling, idle queues
+    are removed down to this number."""
+
+    _max_readings_queues = 4
+    """When auto-scaling, queues are added up to this number"""
+
+    _auto_scale_readings_queues = False
+    """True: Add and remove queues at runtime. False: _min_readings_queues queues are used."""
+
+    _readings_queues_scale_up_count = 10
+    """When auto-scaling, add a queue after :meth:`is_available` finds the current queue
+    full this number of consecutive times"""
+
+    _write_statistics_seconds = 5
+    """Number of seconds between updates of the readings statistics in foglamp.statistics,
+    which writes them to storage"""
 
     _max_idle_db_connection_seconds = 180
     """Close database connections when idle for this number of seconds"""
@@ -88,8 +307,28 @@ class Ingest(object):
 
     _max_readings_batch_size = 150
     """Maximum number of rows in a batch of inserts"""
-    
-    _max_readings_queue_size = 4*_max_readings_batch_size
+
+    _adapt_readings_batch_size = True
+    """True: :meth:`_adjust_readings_batch_size` resizes batches and the batch wait time
+    after every insert. False: The batch sizes and wait time are fixed"""
+
+    _target_insert_latency_seconds = 0.5
+    """When adapting batch sizes, the preferred number of seconds between a reading being
+    queued and its batch being committed"""
+
+    _min_readings_batch_size_limit = 10
+    """When adapting batch sizes, _max_readings_batch_size is never set below this value"""
+
+    _max_readings_batch_size_limit = 2000
+    """When adapting batch sizes, _max_readings_batch_size is never set above this value"""
+
+    _max_retry_after_seconds = 60
+    """Maximum value returned by :meth:`get_retry_after_seconds`"""
+
+    _readings_rate_smoothing = 0.3
+    """Weight (0 to 1) of the newest sample in the arrival and insert rate moving averages"""
+
+    _max_readings_queue_size = 4*_max_readings_batch_size_limit
     """Maximum number of items in a queue"""
 
     _readings_batch_yield_items = 50
@@ -105,39 +344,248 @@ class Ingest(object):
     second between attempts. 
     """
 
+    _spool_after_insert_attempts = 3
+    """When spooling is enabled, spool a batch after this number of failed insert
+    attempts instead of retrying _max_insert_readings_batch_attempts times"""
+
+    _spool_drain_interval_seconds = 5
+    """Number of seconds between attempts to replay spooled batches"""
+
+    _max_spool_segment_bytes = 16*1024*1024
+    """Start a new spool segment after a segment reaches this size"""
+
     _queue_readings_as_dict = True
     """True: readings are stored in the queue as a dict object. False: Readings are
     stored in the queue as a string.
     """
 
+    _readings_encoder = None  # type: Callable[[List[dict]], List[str]]
+    """When _queue_readings_as_dict is True, converts a batch of readings dicts to JSON
+    strings. None: Use the fastest encoder in READINGS_ENCODERS"""
+
+    _encode_readings_in_executor = False
+    """True: Encode batches of readings in the event loop's default executor (a thread
+    pool). False: Encode batches of readings on the event loop."""
+
     _populate_readings_queues_round_robin = False
     """True: Fill all queues round robin. False: Fill one queue with _max_readings_batch_size before
     filling the next queue"""
 
+    _copy_readings_without_keys_directly = True
+    """True: Batches in which no reading has a key are copied directly into the readings
+    table. False: All batches are copied into a temp table first"""
+
+    @classmethod
+    async def _read_config(cls):
+        """Reads configuration"""
+        await configuration_manager.create_category(
+            _CONFIG_CATEGORY_NAME,
+            _DEFAULT_CONFIG,
+            _CONFIG_CATEGORY_DESCRIPTION)
+
+        config = await configuration_manager.get_category_all_items(_CONFIG_CATEGORY_NAME)
+
+        cls._apply_config(config)
+        cls._write_config_cache(config)
+
+    @classmethod
+    def _apply_config(cls, config: dict):
+        """Applies the items of the configuration category"""
+        cls._min_readings_queues = max(int(config['readingsQueues']['value']), 1)
+        cls._max_readings_queues = max(int(config['maxReadingsQueues']['value']),
+                                       cls._min_readings_queues)
+        cls._auto_scale_readings_queues = (
+            config['autoScaleReadingsQueues']['value'] == 'True')
+        cls._write_statistics_seconds = max(int(config['writeStatisticsSeconds']['value']), 1)
+
+        if config['spoolReadings']['value'] == 'True':
+            directory = os.path.expanduser(config['spoolDirectory']['value'])
+            fsync = config['spoolFsync']['value'] == 'True'
+
+            if cls._spool is None or cls._spool.directory != directory:
+                cls._retire_spool()
+                cls._spool = cls._revive_spool(directory)
+
+                if cls._spool is None:
+                    cls._spool = Spool(directory, max_segment_bytes=cls._max_spool_segment_bytes,
+                                       fsync=fsync)
+
+            cls._spool.fsync = fsync
+        else:
+            cls._retire_spool()
+
+    @classmethod
+    def _retire_spool(cls):
+        """Stops spooling to _spool. Batches already spooled, including batches
+        that insert tasks are still appending, are replayed by :meth:`_replay_spool`."""
+        if cls._spool is not None:
+            cls._spool.roll()
+            cls._retired_spools.append(cls._spool)
+            cls._spool = None
+
+    @classmethod
+    def _revive_spool(cls, directory: str)->Spool:
+        """Returns the retired spool for directory, if any, so that a directory is
+        never appended to by two Spool objects"""
+        for spool in cls._retired_spools:
+            if spool.directory == directory:
+                cls._retired_spools.remove(spool)
+                return spool
+        return None
+
+    @classmethod
+    def _start_drain_spool(cls):
+        """Starts :meth:`_drain_spool` unless it is running or there is nothing to replay"""
+        if cls._drain_spool_task is None and (cls._spool is not None or cls._retired_spools):
+            cls._spool_segment_offsets = {}
+            cls._last_spool_time = None
+            cls._spool_replay_attempts = 0
+            cls._drain_spool_task = asyncio.ensure_future(cls._drain_spool())
+
+    @classmethod
+    def _write_config_cache(cls, config: dict):
+        """Saves the configuration to _config_cache_path"""
+        path = os.path.expanduser(cls._config_cache_path)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + '.tmp', 'w') as cache_file:
+                json.dump(config, cache_file)
+            os.replace(path + '.tmp', path)
+        except OSError:
+            _LOGGER.exception('Unable to save the configuration to %s', path)
+
+    @classmethod
+    def _read_config_cache(cls)->bool:
+        """Applies the configuration saved by :meth:`_write_config_cache`
+
+        Returns:
+            False if no configuration has been saved or it could not be applied
+        """
+        path = os.path.expanduser(cls._config_cache_path)
+        try:
+            with open(path) as cache_file:
+                config = json.load(cache_file)
+            cls._apply_config(config)
+        except FileNotFoundError:
+            return False
+        except Exception:
+            _LOGGER.exception('Unable to apply the configuration saved in %s', path)
+            return False
+
+        return True
+
     @classmethod
     async def start(cls):
         """Starts the server"""
         if cls._started:
             return
 
-        # TODO: Read config
+        # Readings are accepted, and spooled when enabled, while the database is down
+        try:
+            await cls._read_config()
+        except Exception:
+            if cls._read_config_cache():
+                _LOGGER.exception('Unable to read the configuration. Starting with the saved '
+                                  'configuration.')
+            else:
+                _LOGGER.exception('Unable to read the configuration. Starting with the current '
+                                  'settings.')
+            cls._read_config_task = asyncio.ensure_future(cls._retry_read_config())
+
+        cls._last_batch_size_adjust_time = time.monotonic()
+        cls._last_readings_insert_time = cls._last_batch_size_adjust_time
+        cls._readings_arrivals = 0
 
         # Start asyncio tasks
         cls._write_statistics_task = asyncio.ensure_future(cls._write_statistics())
+        cls._start_drain_spool()
 
         cls._insert_readings_tasks = []
         cls._insert_readings_wait_tasks = []
         cls._queue_events = []
         cls._readings_queues = []
+        cls._num_readings_queues = 0
+        cls._current_readings_queue_index = 0
+        cls._full_readings_queue_count = 0
 
-        for _ in range(cls._num_readings_queues):
-            cls._readings_queues.append(asyncio.Queue(maxsize=cls._max_readings_queue_size))
-            cls._insert_readings_wait_tasks.append(None)
-            cls._insert_readings_tasks.append(asyncio.ensure_future(cls._insert_readings(_)))
-            cls._queue_events.append(asyncio.Event())
+        for _ in range(cls._min_readings_queues):
+            cls._add_readings_queue()
 
         cls._started = True
 
+    @classmethod
+    async def _retry_read_config(cls):
+        """Reads the configuration every _read_config_retry_seconds until it succeeds,
+        then applies the settings that can change while the server runs"""
+        while not cls._stop:
+            await asyncio.sleep(cls._read_config_retry_seconds)
+
+            try:
+                await cls._read_config()
+            except Exception:
+                _LOGGER.warning('Unable to read the configuration. Retrying in %s seconds.',
+                                cls._read_config_retry_seconds)
+                continue
+
+            _LOGGER.info('Read the configuration')
+
+            while cls._num_readings_queues < cls._min_readings_queues:
+                cls._add_readings_queue()
+
+            cls._start_drain_spool()
+            break
+
+        cls._read_config_task = None
+
+    @classmethod
+    def _add_readings_queue(cls)->int:
+        """Adds a queue and starts its :meth:`_insert_readings` task
+
+        Returns:
+            The index of the new queue
+        """
+        queue_index = cls._num_readings_queues
+
+        cls._readings_queues.append(asyncio.Queue(maxsize=cls._max_readings_queue_size))
+        cls._insert_readings_wait_tasks.append(None)
+        cls._queue_events.append(asyncio.Event())
+        cls._insert_readings_tasks.append(
+            asyncio.ensure_future(cls._insert_readings(queue_index)))
+        cls._num_readings_queues += 1
+
+        return queue_index
+
+    @classmethod
+    def _remove_readings_queue(cls, queue_index: int)->bool:
+        """Removes an idle queue when auto-scaling
+
+        Only the last queue is removed, so the indexes of the remaining queues
+        do not change. The caller's :meth:`_insert_readings` task must exit when
+        True is returned.
+
+        Returns:
+            True if the queue was removed
+        """
+        if (not cls._auto_scale_readings_queues
+                or cls._stop
+                or queue_index != cls._num_readings_queues - 1
+                or cls._num_readings_queues <= cls._min_readings_queues
+                or not cls._readings_queues[queue_index].empty()):
+            return False
+
+        cls._num_readings_queues -= 1
+        cls._readings_queues.pop()
+        cls._insert_readings_wait_tasks.pop()
+        cls._queue_events.pop()
+        cls._insert_readings_tasks.pop()
+
+        if cls._current_readings_queue_index >= cls._num_readings_queues:
+            cls._current_readings_queue_index = 0
+
+        _LOGGER.info('Removed idle readings queue. Queues: %s', cls._num_readings_queues)
+
+        return True
+
     @classmethod
     async def stop(cls):
         """Stops the server
@@ -149,11 +597,15 @@ class Ingest(object):
 
         cls._stop = True
 
+        if cls._read_config_task is not None:
+            cls._read_config_task.cancel()
+            cls._read_config_task = None
+
         for task in cls._insert_readings_wait_tasks:
             if task is not None:
                 task.cancel()
 
-        for task in cls._insert_readings_tasks:
+        for task in list(cls._insert_readings_tasks):
             try:
                 await task
             except Exception:
@@ -166,6 +618,23 @@ class Ingest(object):
         cls._readings_queues = None
         cls._queue_events = None
 
+        # Stop replaying spooled batches. Whatever remains is replayed after
+        # the next start.
+        if cls._drain_spool_task is not None:
+            if cls._drain_spool_sleep_task is not None:
+                cls._drain_spool_sleep_task.cancel()
+                cls._drain_spool_sleep_task = None
+
+            try:
+                await cls._drain_spool_task
+            except Exception:
+                _LOGGER.exception('An exception occurred in Ingest._drain_spool')
+
+            cls._drain_spool_task = None
+
+        if cls._spool is not None:
+            cls._spool.close()
+
         # Write statistics
         if cls._write_statistics_sleep_task is not None:
             cls._write_statistics_sleep_task.cancel()
@@ -184,6 +653,39 @@ class Ingest(object):
         """Increments the number of discarded sensor readings"""
         cls._discarded_readings_stats += 1
 
+    @classmethod
+    def increment_deferred_readings(cls, num_readings: int = 1):
+        """Increments the number of sensor readings that were not accepted
+        because :meth:`is_available` returned False"""
+        cls._deferred_readings_stats += num_readings
+
+    @classmethod
+    def get_retry_after_seconds(cls)->int:
+        """Estimates how many seconds it will take to insert the readings
+        that are currently queued
+
+        Intended to tell clients when to retry after :meth:`is_available`
+        returns False. Based on the insert rate measured by
+        :meth:`_adjust_readings_batch_size`.
+
+        Returns:
+            A number of seconds between 1 and _max_retry_after_seconds.
+            _max_retry_after_seconds is returned when no batch has been
+            inserted for that long (for example, the database is down).
+        """
+        if cls._readings_queues is None:
+            return cls._max_retry_after_seconds
+
+        insert_rate = cls._readings_insert_rate * cls._num_readings_queues
+
+        if insert_rate <= 0 or (time.monotonic() - cls._last_readings_insert_time
+                                >= cls._max_retry_after_seconds):
+            return cls._max_retry_after_seconds
+
+        queued = sum(queue.qsize() for queue in cls._readings_queues)
+
+        return int(min(max(math.ceil(queued / insert_rate), 1), cls._max_retry_after_seconds))
+
     @classmethod
     async def _close_connection(cls, connection: asyncpg.connection.Connection):
         if connection is not None:
@@ -196,15 +698,18 @@ class Ingest(object):
     async def _insert_readings(cls, queue_index):
         """Inserts rows into the readings table using _queue
 
-        Uses "copy" to load rows into a temp table and then
-        inserts the temp table into the readings table because
-        "copy" does not support "on conflict ignore"
+        When no reading in a batch has a key, "copy" loads the batch
+        directly into the readings table. Otherwise, uses "copy" to load
+        rows into a temp table and then inserts the temp table into the
+        readings table because "copy" does not support "on conflict ignore"
         """
         _LOGGER.info('Insert readings loop started')
 
         queue = cls._readings_queues[queue_index]  # type: asyncio.Queue
         event = cls._queue_events[queue_index]  # type: asyncio.Event
         connection = None  # type: asyncpg.connection.Connection
+        temp_table_created = False
+        """True when t_readings exists for the current connection"""
 
         while True:
             # Wait for enough items in the queue to fill a batch
@@ -239,7 +744,12 @@ class Ingest(object):
                 insert = queue.get_nowait()
             except asyncio.QueueEmpty:
                 if cls._stop:
-                    break
+                    # Producers that were waiting for room resume before this
+                    # task does and add their items
+                    await asyncio.sleep(0)
+                    if queue.empty():
+                        break
+                    continue
 
                 # Wait for one item in the queue
                 waiter = asyncio.ensure_future(queue.get())
@@ -264,12 +774,16 @@ class Ingest(object):
                     #               queue_index, queue.qsize())
                     await cls._close_connection(connection)
                     connection = None
-                    continue
+                    insert = None
                 finally:
                     cls._insert_readings_wait_tasks[queue_index] = None
 
-            if cls._queue_readings_as_dict:
-                insert = (insert[0], insert[1], insert[2], json.dumps(insert[3]))
+                if insert is None:
+                    # The connection was idle
+                    if cls._remove_readings_queue(queue_index):
+                        break
+                    continue
+
             inserts = [insert]
 
             yield_num = 1
@@ -281,8 +795,6 @@ class Ingest(object):
                 except asyncio.QueueEmpty:
                     break
 
-                if cls._queue_readings_as_dict:
-                    insert = (insert[0], insert[1], insert[2], json.dumps(insert[3]))
                 inserts.append(insert)
 
                 if len(inserts) >= cls._max_readings_batch_size:
@@ -295,6 +807,18 @@ class Ingest(object):
                     else:
                         yield_num += 1
 
+            if cls._queue_readings_as_dict:
+                try:
+                    if cls._encode_readings_in_executor:
+                        inserts = await asyncio.get_event_loop().run_in_executor(
+                            None, cls._encode_readings, inserts)
+                    else:
+                        inserts = cls._encode_readings(inserts)
+                except Exception:
+                    _LOGGER.exception('Unable to convert a batch of readings to JSON')
+                    cls._discarded_readings_stats += len(inserts)
+                    continue
+
             # _LOGGER.debug('Begin insert: Queue index: %s Batch size: %s',
             #              queue_index, len(inserts))
 
@@ -302,21 +826,19 @@ class Ingest(object):
                 try:
                     if connection is None:
                         connection = await asyncpg.connect(database='foglamp')
-                        # Create a temp table for 'copy' command
-                        await connection.execute('create temp table t_readings '
-                                                 'as select asset_code, user_ts, read_key, reading '
-                                                 'from foglamp.readings where 1=0')
-                    else:
-                        await connection.execute('truncate table t_readings')
+                        temp_table_created = False
 
-                    await connection.copy_records_to_table(table_name='t_readings',
-                                                           records=inserts)
+                    insert_start_time = time.monotonic()
 
-                    await connection.execute('insert into foglamp.readings '
-                                             '(asset_code,user_ts,read_key,reading) '
-                                             'select * from t_readings on conflict do nothing')
+                    temp_table_created = await cls._copy_readings(connection, inserts,
+                                                                  temp_table_created)
 
                     cls._readings_stats += len(inserts)
+                    cls._last_readings_insert_time = time.monotonic()
+
+                    cls._adjust_readings_batch_size(len(inserts),
+                                                    time.monotonic() - insert_start_time,
+                                                    queue.qsize())
 
                     # _LOGGER.debug('End insert: Queue index: %s Batch size: %s',
                     #               queue_index, len(inserts))
@@ -326,24 +848,305 @@ class Ingest(object):
                     next_attempt = attempt + 1
                     _LOGGER.exception('Insert failed on attempt #%s', next_attempt)
 
-                    if cls._stop or next_attempt >= cls._max_insert_readings_batch_attempts:
-                        cls._discarded_readings_stats += len(inserts)
+                    if (cls._stop
+                            or next_attempt >= cls._max_insert_readings_batch_attempts
+                            or (cls._spool is not None
+                                and next_attempt >= cls._spool_after_insert_attempts)):
+                        if not await cls._spool_readings(inserts):
+                            cls._discarded_readings_stats += len(inserts)
+                        break
+
+                    if connection is None:
+                        # Connection failure
+                        await asyncio.sleep(1)
                     else:
-                        if connection is None:
-                            # Connection failure
-                            await asyncio.sleep(1)
-                        else:
-                            await cls._close_connection(connection)
-                            connection = None
+                        await cls._close_connection(connection)
+                        connection = None
 
         # Exiting this method
         await cls._close_connection(connection)
 
         _LOGGER.info('Insert readings loop stopped')
 
+    @classmethod
+    async def _copy_readings(cls, connection: asyncpg.connection.Connection,
+                             inserts: List[tuple], temp_table_created: bool)->bool:
+        """Inserts a batch of queue items, whose readings are JSON strings, into the
+        readings table
+
+        Args:
+            temp_table_created: True if t_readings exists for connection
+
+        Returns:
+            True if t_readings exists for connection
+        """
+        # Readings without a key can not conflict with existing rows
+        if cls._copy_readings_without_keys_directly and not any(
+                insert[2] is not None for insert in inserts):
+            await connection.copy_records_to_table(table_name='readings',
+                                                   schema_name='foglamp',
+                                                   columns=_READINGS_COLUMNS,
+                                                   records=inserts)
+            return temp_table_created
+
+        if temp_table_created:
+            await connection.execute('truncate table t_readings')
+        else:
+            # Create a temp table for 'copy' command
+            await connection.execute('create temp table t_readings '
+                                     'as select asset_code, user_ts, read_key, '
+                                     'reading from foglamp.readings where 1=0')
+
+        await connection.copy_records_to_table(table_name='t_readings',
+                                               records=inserts)
+
+        # When readings is partitioned by user_ts, its unique constraint is on
+        # (read_key, user_ts), so keys are also looked up in every partition
+        await connection.execute('insert into foglamp.readings '
+                                 '(asset_code,user_ts,read_key,reading) '
+                                 'select * from t_readings t where t.read_key is null '
+                                 'or not exists (select 1 from foglamp.readings r '
+                                 'where r.read_key = t.read_key) '
+                                 'on conflict do nothing')
+        return True
+
+    @classmethod
+    async def _spool_readings(cls, inserts: List[tuple])->bool:
+        """Appends a batch that could not be inserted to the spool in the
+        event loop's default executor, so that writing and fsync do not block
+        the event loop
+
+        Returns:
+            True if the batch was spooled
+        """
+        spool = cls._spool
+        if spool is None:
+            return False
+
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, spool.append, inserts)
+        except Exception:
+            _LOGGER.exception('Unable to spool a batch of %s readings', len(inserts))
+            return False
+
+        if spool is cls._spool:
+            cls._last_spool_time = time.monotonic()
+        else:
+            # The spool was replaced during the append
+            spool.roll()
+            if spool not in cls._retired_spools:
+                cls._retired_spools.append(spool)
+
+        return True
+
+    @classmethod
+    async def _drain_spool(cls):
+        """Periodically replays spooled batches"""
+        _LOGGER.info('Spool drainer started')
+
+        replay_failed = False
+
+        while not cls._stop:
+            # See _write_statistics
+            cls._drain_spool_sleep_task = asyncio.ensure_future(
+                asyncio.sleep(cls._spool_drain_interval_seconds))
+
+            try:
+                await cls._drain_spool_sleep_task
+            except asyncio.CancelledError:
+                pass
+            finally:
+                cls._drain_spool_sleep_task = None
+
+            if cls._stop:
+                break
+
+            try:
+                await cls._replay_spool()
+            except Exception:
+                # Log the traceback once, not every interval while the database is down
+                if not replay_failed:
+                    _LOGGER.exception('An error occurred while replaying spooled readings. '
+                                      'Retrying every %s seconds.',
+                                      cls._spool_drain_interval_seconds)
+                    replay_failed = True
+            else:
+                if replay_failed:
+                    _LOGGER.info('Resumed replaying spooled readings')
+                    replay_failed = False
+
+        _LOGGER.info('Spool drainer stopped')
+
+    @classmethod
+    async def _replay_spool(cls):
+        """Inserts spooled batches, oldest first, and removes replayed segments
+
+        The segment being appended to is closed once no batch has been spooled
+        for _spool_drain_interval_seconds. The segments of retired spools are
+        replayed before the segments of _spool, and a retired spool is
+        forgotten once it has none left. Returns when the spools are empty or
+        the server is stopping. Raises when a batch can not be inserted. A batch
+        that the database rejects _max_insert_readings_batch_attempts times is
+        discarded.
+        """
+        spools = list(cls._retired_spools)
+
+        spool = cls._spool
+        if spool is not None:
+            if (cls._last_spool_time is not None and time.monotonic() - cls._last_spool_time
+                    >= cls._spool_drain_interval_seconds):
+                spool.roll()
+                cls._last_spool_time = None
+
+            spools.append(spool)
+
+        segments = [segment for spool in spools for segment in spool.closed_segments()]
+
+        connection = None  # type: asyncpg.connection.Connection
+        temp_table_created = False
+
+        try:
+            if segments:
+                connection = await asyncpg.connect(database='foglamp')
+
+            for segment in segments:
+                offset = cls._spool_segment_offsets.get(segment, 0)
+
+                for inserts in itertools.islice(Spool.read_segment(segment, _parse_timestamp),
+                                                offset, None):
+                    if cls._stop:
+                        return
+
+                    try:
+                        temp_table_created = await cls._copy_readings(connection, inserts,
+                                                                      temp_table_created)
+                    except asyncpg.PostgresError:
+                        if connection.is_closed():
+                            raise
+
+                        # The database rejected the batch
+                        cls._spool_replay_attempts += 1
+                        if cls._spool_replay_attempts < cls._max_insert_readings_batch_attempts:
+                            raise
+
+                        _LOGGER.exception('Discarding %s spooled readings from %s',
+                                          len(inserts), segment)
+                        cls._discarded_readings_stats += len(inserts)
+                    else:
+                        cls._readings_stats += len(inserts)
+
+                    cls._spool_replay_attempts = 0
+                    offset += 1
+                    cls._spool_segment_offsets[segment] = offset
+
+                Spool.remove_segment(segment)
+                cls._spool_segment_offsets.pop(segment, None)
+
+                _LOGGER.info('Replayed spooled readings from %s', segment)
+
+            for spool in spools:
+                if spool in cls._retired_spools and not spool.closed_segments():
+                    cls._retired_spools.remove(spool)
+        finally:
+            await cls._close_connection(connection)
+
+    @classmethod
+    def _encode_readings(cls, inserts: List[tuple])->List[tuple]:
+        """Converts the readings dict in each queue item to a JSON string
+
+        Falls back to the standard library when the configured encoder rejects
+        a batch (for example, orjson does not accept non-string keys).
+
+        Returns:
+            A new list of queue items
+        """
+        readings = [insert[3] for insert in inserts]
+
+        encoder = cls._readings_encoder
+        if encoder is None:
+            encoder = (READINGS_ENCODERS.get('orjson') or READINGS_ENCODERS.get('ujson')
+                       or _encode_readings_json)
+
+        try:
+            readings = encoder(readings)
+        except (TypeError, ValueError, OverflowError):
+            if encoder is _encode_readings_json:
+                raise
+            readings = _encode_readings_json(readings)
+
+        return [(insert[0], insert[1], insert[2], reading)
+                for insert, reading in zip(inserts, readings)]
+
+    @classmethod
+    def _adjust_readings_batch_size(cls, batch_size: int, insert_seconds: float,
+                                    queue_size: int)->None:
+        """Resizes batches and the batch wait time based on measured performance
+
+        _max_readings_batch_size is set to the number of rows that can be
+        committed within _target_insert_latency_seconds, and is increased
+        further while readings are queued faster than they are inserted.
+        _min_readings_batch_size is set to the number of readings that arrive
+        within _target_insert_latency_seconds so that light traffic does not
+        wait for a large batch. _readings_batch_wait_seconds is whatever
+        remains of the target latency after inserting a minimum-sized batch.
+
+        The arrival and insert rates are measured even when
+        _adapt_readings_batch_size is False.
+
+        Args:
+            batch_size: Number of rows in the batch that was just inserted
+            insert_seconds: Number of seconds it took to insert the batch
+            queue_size: Number of items remaining in the batch's queue
+        """
+        now = time.monotonic()
+        elapsed_seconds = now - cls._last_batch_size_adjust_time
+        cls._last_batch_size_adjust_time = now
+
+        smoothing = cls._readings_rate_smoothing
+
+        if elapsed_seconds > 0:
+            arrival_rate = cls._readings_arrivals / elapsed_seconds
+            cls._readings_arrivals = 0
+            cls._readings_arrival_rate += smoothing * (arrival_rate - cls._readings_arrival_rate)
+
+        if insert_seconds > 0:
+            insert_rate = batch_size / insert_seconds
+            if cls._readings_insert_rate:
+                cls._readings_insert_rate += smoothing * (insert_rate - cls._readings_insert_rate)
+            else:
+                cls._readings_insert_rate = insert_rate
+
+        if not cls._adapt_readings_batch_size:
+            return
+
+        target_seconds = cls._target_insert_latency_seconds
+
+        max_batch_size = cls._readings_insert_rate * target_seconds
+        if queue_size > cls._max_readings_batch_size:
+            # Inserts are falling behind. Larger batches amortize the
+            # per-transaction overhead.
+            max_batch_size = max(max_batch_size, 2 * cls._max_readings_batch_size)
+        max_batch_size = int(min(max(max_batch_size, cls._min_readings_batch_size_limit),
+                                 cls._max_readings_batch_size_limit))
+
+        min_batch_size = int(min(max(cls._readings_arrival_rate * target_seconds, 1),
+                                 max_batch_size))
+
+        wait_seconds = target_seconds
+        if cls._readings_insert_rate:
+            wait_seconds -= min_batch_size / cls._readings_insert_rate
+
+        cls._max_readings_batch_size = max_batch_size
+        cls._min_readings_batch_size = min_batch_size
+        cls._readings_batch_wait_seconds = max(wait_seconds, 0.01)
+
+        # _LOGGER.debug('Batch size: min %s max %s wait %s arrival rate %s insert rate %s',
+        #               min_batch_size, max_batch_size, cls._readings_batch_wait_seconds,
+        #               cls._readings_arrival_rate, cls._readings_insert_rate)
+
     @classmethod
     async def _write_statistics(cls):
-        """Periodically commits collected readings statistics"""
+        """Periodically adds collected readings statistics to foglamp.statistics"""
         _LOGGER.info('Device statistics writer started')
 
         while not cls._stop:
@@ -352,7 +1155,7 @@ class Ingest(object):
             # this entire coroutine because allowing database activity to be
             # interrupted will result in strange behavior.
             cls._write_statistics_sleep_task = asyncio.ensure_future(
-                asyncio.sleep(_STATISTICS_WRITE_FREQUENCY_SECONDS))
+                asyncio.sleep(cls._write_statistics_seconds))
 
             try:
                 await cls._write_statistics_sleep_task
@@ -361,23 +1164,12 @@ class Ingest(object):
             finally:
                 cls._write_statistics_sleep_task = None
 
-            readings = cls._readings_stats
+            statistics.increment('READINGS', cls._readings_stats)
             cls._readings_stats = 0
-
-            try:
-                await statistics.update_statistics_value('READINGS', readings)
-            except Exception:  # TODO catch real exception
-                cls._readings_stats += readings
-                _LOGGER.exception('An error occurred while writing readings statistics')
-
-            readings = cls._discarded_readings_stats
+            statistics.increment('DISCARDED', cls._discarded_readings_stats)
             cls._discarded_readings_stats = 0
-            try:
-                await statistics.update_statistics_value('DISCARDED', readings)
-            # TODO catch real exception
-            except Exception:  # TODO catch real exception
-                cls._discarded_readings_stats += readings
-                _LOGGER.exception('An error occurred while writing readings statistics')
+            statistics.increment('DEFERRED', cls._deferred_readings_stats)
+            cls._deferred_readings_stats = 0
 
         _LOGGER.info('Device statistics writer stopped')
 
@@ -385,6 +1177,9 @@ class Ingest(object):
     def is_available(cls) -> bool:
         """Indicates whether all queues are currently full
 
+        When auto-scaling, a queue is added when the current queue keeps
+        being found full or when all queues are full.
+
         Returns:
             False - All of the queues are empty
             True - Otherwise
@@ -394,8 +1189,18 @@ class Ingest(object):
 
         queue_index = cls._current_readings_queue_index
         if cls._readings_queues[queue_index].qsize() < cls._max_readings_queue_size:
+            cls._full_readings_queue_count = 0
             return True
 
+        can_scale_up = (cls._auto_scale_readings_queues
+                        and cls._num_readings_queues < cls._max_readings_queues)
+
+        if can_scale_up:
+            cls._full_readings_queue_count += 1
+            if cls._full_readings_queue_count >= cls._readings_queues_scale_up_count:
+                cls._scale_up_readings_queues()
+                return True
+
         for _ in range(1, cls._num_readings_queues):
             queue_index += 1
             if queue_index >= cls._num_readings_queues:
@@ -404,9 +1209,102 @@ class Ingest(object):
                 cls._current_readings_queue_index = queue_index
                 return True
 
+        if can_scale_up:
+            cls._scale_up_readings_queues()
+            return True
+
         _LOGGER.warning('The ingest service is unavailable')
         return False
 
+    @classmethod
+    def _scale_up_readings_queues(cls):
+        """Adds a queue and makes it the current queue"""
+        cls._full_readings_queue_count = 0
+        cls._current_readings_queue_index = cls._add_readings_queue()
+        _LOGGER.info('Added readings queue. Queues: %s', cls._num_readings_queues)
+
+    @classmethod
+    def _validate_readings(cls, asset: str, timestamp: Union[str, datetime.datetime],
+                           key: Union[str, uuid.UUID] = None, readings: dict = None)->tuple:
+        """Validates the arguments of :meth:`add_readings`
+
+        Returns:
+            A queue item
+
+        Raises:
+            ValueError, TypeError:
+                An invalid value was provided
+        """
+        if asset is None:
+            raise ValueError('asset can not be None')
+
+        if not isinstance(asset, str):
+            raise TypeError('asset must be a string')
+
+        if timestamp is None:
+            raise ValueError('timestamp can not be None')
+
+        if not isinstance(timestamp, datetime.datetime):
+            # validate
+            timestamp = _parse_timestamp(timestamp)
+
+        if key is not None and not isinstance(key, uuid.UUID):
+            # Validate
+            if not isinstance(key, str):
+                raise TypeError('key must be a uuid.UUID or a string')
+            # If key is not a string, uuid.UUID throws an Exception that appears to
+            # be a TypeError but can not be caught as a TypeError
+            key = uuid.UUID(key)
+
+        if readings is None:
+            readings = dict()
+        elif not isinstance(readings, dict):
+            # Postgres allows values like 5 be converted to JSON
+            # Downstream processors can not handle this
+            raise TypeError('readings must be a dictionary')
+
+        # Comment out to test IntegrityError
+        # key = '123e4567-e89b-12d3-a456-426655440000'
+
+        return asset, timestamp, key, readings
+
+    @classmethod
+    def _check_started(cls):
+        """Raises RuntimeError if readings can not be added"""
+        if cls._stop:
+            raise RuntimeError('The device server is stopping')
+
+        if not cls._started:
+            raise RuntimeError('The device server was not started')
+            # cls._logger = logger.setup(__name__, destination=logger.CONSOLE, level=logging.DEBUG)
+
+    @classmethod
+    def _readings_queued(cls, queue_index: int, queue: asyncio.Queue)->None:
+        """Called after an item is added to a queue
+
+        Releases the queue's insert task when a batch is ready and
+        moves on to the next queue when appropriate
+        """
+        cls._readings_arrivals += 1
+
+        if queue.qsize() >= cls._min_readings_batch_size:
+            event = cls._queue_events[queue_index]
+            # _LOGGER.debug('Set event queue index: %s size: %s',
+            #               cls._current_readings_queue_index, queue.qsize())
+            # if not event.is_set():  # TODO is this check necessary?
+            event.set()
+
+        # _LOGGER.debug('Queue index: %s size: %s', cls._current_readings_queue_index,
+        #               queue.qsize())
+
+        # When the current queue is full, move on to the next queue
+        if cls._num_readings_queues > 1 and (cls._populate_readings_queues_round_robin
+                                             or queue.qsize() >= cls._max_readings_batch_size):
+            queue_index += 1
+            if queue_index >= cls._num_readings_queues:
+                queue_index = 0
+            cls._current_readings_queue_index = queue_index
+
     @classmethod
     async def add_readings(cls, asset: str, timestamp: Union[str, datetime.datetime],
                            key: Union[str, uuid.UUID] = None, readings: dict = None)->None:
@@ -430,51 +1328,18 @@ class Ingest(object):
             ValueError, TypeError:
                 An invalid value was provided
         """
-        if cls._stop:
-            raise RuntimeError('The device server is stopping')
+        cls._check_started()
         # Assume the code beyond this point doesn't 'await'
         # to make sure that the queue is not appended to
         # when cls._stop is True
 
-        if not cls._started:
-            raise RuntimeError('The device server was not started')
-            # cls._logger = logger.setup(__name__, destination=logger.CONSOLE, level=logging.DEBUG)
-
         try:
-            if asset is None:
-                raise ValueError('asset can not be None')
-
-            if not isinstance(asset, str):
-                raise TypeError('asset must be a string')
-
-            if timestamp is None:
-                raise ValueError('timestamp can not be None')
-
-            if not isinstance(timestamp, datetime.datetime):
-                # validate
-                timestamp = dateutil.parser.parse(timestamp)
-
-            if key is not None and not isinstance(key, uuid.UUID):
-                # Validate
-                if not isinstance(key, str):
-                    raise TypeError('key must be a uuid.UUID or a string')
-                # If key is not a string, uuid.UUID throws an Exception that appears to
-                # be a TypeError but can not be caught as a TypeError
-                key = uuid.UUID(key)
-
-            if readings is None:
-                readings = dict()
-            elif not isinstance(readings, dict):
-                # Postgres allows values like 5 be converted to JSON
-                # Downstream processors can not handle this
-                raise TypeError('readings must be a dictionary')
+            asset, timestamp, key, readings = cls._validate_readings(asset, timestamp,
+                                                                     key, readings)
         except Exception:
             cls.increment_discarded_readings()
             raise
 
-        # Comment out to test IntegrityError
-        # key = '123e4567-e89b-12d3-a456-426655440000'
-
         cls.is_available()  # Locate a queue that isn't maxed out
         queue_index = cls._current_readings_queue_index
         queue = cls._readings_queues[queue_index]
@@ -483,20 +1348,96 @@ class Ingest(object):
             readings = json.dumps(readings)
 
         await queue.put((asset, timestamp, key, readings))
-        if queue.qsize() >= cls._min_readings_batch_size:
-            event = cls._queue_events[queue_index]
-            # _LOGGER.debug('Set event queue index: %s size: %s',
-            #               cls._current_readings_queue_index, queue.qsize())
-            # if not event.is_set():  # TODO is this check necessary?
-            event.set()
+        cls._readings_queued(queue_index, queue)
 
-        # _LOGGER.debug('Queue index: %s size: %s', cls._current_readings_queue_index,
-        #               queue.qsize())
+    @classmethod
+    async def add_readings_bulk(cls, readings_list: List[dict])->List[Exception]:
+        """Adds multiple asset readings records to FogLAMP
 
-        # When the current queue is full, move on to the next queue
-        if cls._num_readings_queues > 1 and (cls._populate_readings_queues_round_robin
-                                             or queue.qsize() >= cls._max_readings_batch_size):
-            queue_index += 1
-            if queue_index >= cls._num_readings_queues:
-                queue_index = 0
-            cls._current_readings_queue_index = queue_index
+        The list is validated in one pass and the valid records are added
+        to the queues together. Waits only when all of the queues are full.
+
+        Args:
+            readings_list:
+                A list of dicts. Each dict has the keys 'asset', 'timestamp'
+                and, optionally, 'key' and 'readings'. See :meth:`add_readings`.
+
+        Returns:
+            A list with one entry per item in readings_list. The entry is
+            None when the item was added. Otherwise it is the exception
+            (usually a ValueError or TypeError) that explains why the item
+            was rejected. Items that had not been added to a queue when the
+            server started stopping are rejected with a RuntimeError.
+            The discarded readings counter is incremented for each rejected
+            item.
+
+        Raises:
+            RuntimeError:
+                The server is stopping or has been stopped
+
+            TypeError:
+                readings_list is not a list
+        """
+        cls._check_started()
+
+        if not isinstance(readings_list, list):
+            raise TypeError('readings_list must be a list')
+
+        results = []
+        inserts = []
+        positions = []
+        """Index in results of each item in inserts"""
+
+        for item in readings_list:
+            try:
+                if not isinstance(item, dict):
+                    raise TypeError('Each item must be a dictionary')
+
+                inserts.append(cls._validate_readings(item.get('asset'),
+                                                      item.get('timestamp'),
+                                                      item.get('key'),
+                                                      item.get('readings')))
+                positions.append(len(results))
+                results.append(None)
+            except Exception as e:
+                cls.increment_discarded_readings()
+                results.append(e)
+
+        if inserts and not cls._queue_readings_as_dict:
+            inserts = cls._encode_readings(inserts)
+
+        for position, insert in zip(positions, inserts):
+            while True:
+                # Nothing takes items from the queues once the server has stopped
+                if cls._stop or not cls._started:
+                    results[position] = RuntimeError('The device server is stopping')
+                    cls.increment_discarded_readings()
+                    break
+
+                queue_index = cls._current_readings_queue_index
+                queue = cls._readings_queues[queue_index]
+
+                if queue.full():
+                    cls.is_available()  # Locate a queue that isn't maxed out
+                    queue_index = cls._current_readings_queue_index
+                    queue = cls._readings_queues[queue_index]
+
+                try:
+                    queue.put_nowait(insert)
+                except asyncio.QueueFull:
+                    # The wait ends when the queue's insert task takes an item. The task
+                    # then takes this item too, even when the server is stopping, and
+                    # an idle queue is only removed when it is empty.
+                    await queue.put(insert)
+
+                    # Nothing else to do when the server started stopping or the
+                    # queue was replaced while waiting
+                    if (cls._stop or cls._readings_queues is None
+                            or queue_index >= len(cls._readings_queues)
+                            or cls._readings_queues[queue_index] is not queue):
+                        break
+
+                cls._readings_queued(queue_index, queue)
+                break
+
+        return results
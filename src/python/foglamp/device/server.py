@@ -9,6 +9,8 @@
 import asyncio
 import signal
 
+from foglamp import db_pool
+from foglamp import statistics
 from foglamp.device import coap
 from foglamp.device.ingest import Ingest
 
@@ -22,6 +24,8 @@ __version__ = "${VERSION}"
 async def _stop(loop):
     """Stops the device server"""
     await Ingest.stop()
+    await statistics.stop()
+    await db_pool.close()
 
     for task in asyncio.Task.all_tasks():
         task.cancel()
@@ -31,6 +35,8 @@ async def _stop(loop):
 
 async def _start():
     """Starts all device ingest servers"""
+    await db_pool.configure()
+    await statistics.start()
     await Ingest.start()
     await coap.start()
 
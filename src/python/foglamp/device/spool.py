@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""Local write-ahead spool for batches of sensor readings
+
+Batches that can not be inserted into the database are appended to
+segment files in a directory. Each line in a segment is one batch
+encoded as a JSON array of [asset, timestamp, key, reading] items.
+Segments are read back with mmap so that replaying a large spool does
+not copy whole files into memory.
+"""
+
+import datetime
+import json
+import mmap
+import os
+import threading
+import uuid
+from typing import Callable, Iterator, List
+
+__author__ = "Terris Linenbach"
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+_SEGMENT_PREFIX = 'readings-'
+_SEGMENT_SUFFIX = '.spool'
+
+
+class Spool(object):
+    """An append-only sequence of segment files
+
+    Batches are appended to the newest segment. A new segment is started when
+    the newest segment reaches max_segment_bytes or :meth:`roll` is called.
+    Only segments that are no longer being appended to are returned by
+    :meth:`closed_segments`.
+
+    Thread safe. :meth:`append` can be called from an executor while the
+    event loop reads closed segments.
+    """
+
+    def __init__(self, directory: str, max_segment_bytes: int = 16*1024*1024,
+                 fsync: bool = True):
+        """
+        Args:
+            directory: Where segment files are stored. Created if necessary.
+            max_segment_bytes: Start a new segment after a segment reaches this size
+            fsync: True: Call os.fsync after every append
+        """
+        self._directory = os.path.expanduser(directory)
+        self._max_segment_bytes = max_segment_bytes
+        self.fsync = fsync
+        """True: Call os.fsync after every append. Can be changed between appends."""
+        self._file = None
+        """The segment file being appended to"""
+        self._file_path = None  # type: str
+        self._lock = threading.Lock()
+        """Serializes changes to the segment being appended to"""
+
+        os.makedirs(self._directory, exist_ok=True)
+
+        segments = self._segments()
+        self._next_segment_number = self._segment_number(segments[-1]) + 1 if segments else 1
+
+    @property
+    def directory(self)->str:
+        """Where segment files are stored, with ~ expanded"""
+        return self._directory
+
+    @staticmethod
+    def _segment_number(path: str)->int:
+        return int(os.path.basename(path)[len(_SEGMENT_PREFIX):-len(_SEGMENT_SUFFIX)])
+
+    def _segments(self)->List[str]:
+        """Returns the paths of all segments, oldest first"""
+        names = [name for name in os.listdir(self._directory)
+                 if name.startswith(_SEGMENT_PREFIX) and name.endswith(_SEGMENT_SUFFIX)]
+        return [os.path.join(self._directory, name) for name in sorted(names)]
+
+    def append(self, inserts: List[tuple])->None:
+        """Appends a batch of readings
+
+        Args:
+            inserts:
+                Ingest queue items: (asset, timestamp as a datetime, key as a
+                uuid.UUID or None, reading as a JSON string or a dict)
+
+        Raises:
+            OSError: The batch could not be written
+        """
+        record = json.dumps([[insert[0], insert[1].isoformat(),
+                              None if insert[2] is None else str(insert[2]), insert[3]]
+                             for insert in inserts], separators=(',', ':'))
+
+        with self._lock:
+            if self._file is None:
+                self._file_path = os.path.join(
+                    self._directory,
+                    '{}{:020d}{}'.format(_SEGMENT_PREFIX, self._next_segment_number,
+                                         _SEGMENT_SUFFIX))
+                self._next_segment_number += 1
+                self._file = open(self._file_path, 'ab')
+
+            self._file.write(record.encode('utf-8') + b'\n')
+            self._file.flush()
+
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+            if self._file.tell() >= self._max_segment_bytes:
+                self._roll()
+
+    def roll(self)->None:
+        """Closes the segment being appended to. The next append starts a new segment."""
+        with self._lock:
+            self._roll()
+
+    def _roll(self)->None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._file_path = None
+
+    def close(self)->None:
+        """Closes the segment being appended to"""
+        self.roll()
+
+    def closed_segments(self)->List[str]:
+        """Returns the paths of segments that are no longer appended to, oldest first"""
+        with self._lock:
+            return [path for path in self._segments() if path != self._file_path]
+
+    @staticmethod
+    def read_segment(path: str,
+                     parse_timestamp: Callable[[str], datetime.datetime])->Iterator[List[tuple]]:
+        """Yields the batches in a segment
+
+        A final line that was only partially written (the process stopped
+        during :meth:`append`) is ignored.
+
+        Args:
+            path: A path returned by :meth:`closed_segments`
+            parse_timestamp: Converts timestamps written by :meth:`append` to datetimes
+
+        Yields:
+            Lists of Ingest queue items. Readings are JSON strings when
+            they were appended as JSON strings.
+        """
+        with open(path, 'rb') as segment_file:
+            if os.fstat(segment_file.fileno()).st_size == 0:
+                return
+
+            with mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ) as segment:
+                for line in iter(segment.readline, b''):
+                    try:
+                        batch = json.loads(line.decode('utf-8'))
+                    except ValueError:
+                        if line.endswith(b'\n'):
+                            raise
+                        break
+
+                    yield [(item[0], parse_timestamp(item[1]),
+                            None if item[2] is None else uuid.UUID(item[2]), item[3])
+                           for item in batch]
+
+    @staticmethod
+    def remove_segment(path: str)->None:
+        """Deletes a segment after its batches have been replayed"""
+        os.remove(path)
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""Maintains foglamp.reading_aggregates
+
+reading_aggregates holds the count, sum, min and max of the numeric values
+in readings, per asset, per key within reading and per bucket of
+BUCKET_SECONDS of user_ts. The asset browser answers summary and series
+requests from it instead of scanning readings.
+
+Each call to :func:`roll_up` adds the readings whose ids are greater than
+reading_aggregates_state.last_id to the buckets and to asset_catalog, and
+advances last_id, in a single statement. Readings inserted during the last
+_SETTLE_SECONDS are left for the next call.
+
+A transaction can commit after a transaction that inserted larger ids, so
+last_id may move past ids that are not visible yet. Ranges of missing ids
+are kept in reading_aggregates_gaps. Each call also adds the readings that
+have appeared in those ranges and narrows the ranges, so every reading is
+aggregated once. Ranges are forgotten after _LATE_COMMIT_SECONDS.
+
+asset_catalog holds the number of readings, the first and last user_ts and
+the keys within reading per asset. asset_catalog_hours holds the same
+numbers of readings per hour of user_ts, so that dropping a partition of
+readings does not count its readings. The purge process subtracts the
+readings it removes whose ids are not greater than last_id from both. Both hold a lock on the
+reading_aggregates_state row while they change asset_catalog, so a reading
+is never added after it was removed.
+
+The core server's scheduler runs :func:`roll_up` for the 'readings
+aggregator' process. Running this module as a script performs one call.
+"""
+
+import asyncio
+import datetime
+
+from foglamp import db_pool
+
+__author__ = "Terris Linenbach"
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+BUCKET_SECONDS = (1, 60, 3600)
+"""Lengths of the buckets, in seconds, finest first"""
+
+BUCKET_RETENTION = {
+    1: datetime.timedelta(days=1),
+    60: datetime.timedelta(days=31),
+    3600: None,
+}
+"""How long buckets are kept, by bucket length. None: Forever."""
+
+_SETTLE_SECONDS = 2
+"""Readings inserted more recently than this are aggregated by the next call"""
+
+_LATE_COMMIT_SECONDS = 600
+"""How long readings whose ids last_id has moved past are still aggregated when they appear"""
+
+_MAX_READINGS_PER_CALL = 100000
+"""Maximum number of readings aggregated by a call to :func:`roll_up`"""
+
+NUMERIC_VALUE = """
+    CASE WHEN jsonb_typeof({0}) = 'number' THEN
+        CASE WHEN abs(({0})::text::numeric) > 1e300 THEN NULL
+             WHEN abs(({0})::text::numeric) < 1e-300 THEN 0
+             ELSE ({0})::text::double precision
+        END
+    END"""
+"""SQL expression for the double precision value of the jsonb expression {0}. NULL when
+it is not a number or its magnitude is too large to be summed as a double precision.
+Numbers too close to zero to be a double precision are 0."""
+
+_ROLL_UP_STATEMENT = """
+    WITH state AS (
+        SELECT last_id FROM foglamp.reading_aggregates_state WHERE id = 1 FOR UPDATE
+    ), upper_bound AS (
+        SELECT max(settled.id) AS id FROM (
+            SELECT readings.id FROM foglamp.readings AS readings, state
+            WHERE readings.id > state.last_id AND readings.ts < now() - $2 * interval '1 second'
+            ORDER BY readings.id
+            LIMIT $1
+        ) AS settled
+    ), gaps AS (
+        SELECT first_id, last_id, ts FROM foglamp.reading_aggregates_gaps
+    ), late_readings AS (
+        SELECT readings.id, readings.asset_code, readings.user_ts, readings.reading, gaps.first_id AS gap_id
+        FROM foglamp.readings AS readings JOIN gaps ON readings.id BETWEEN gaps.first_id AND gaps.last_id
+    ), new_readings AS (
+        SELECT readings.id, readings.asset_code, readings.user_ts, readings.reading
+        FROM foglamp.readings AS readings, state, upper_bound
+        WHERE readings.id > state.last_id AND readings.id <= upper_bound.id
+        UNION ALL
+        SELECT id, asset_code, user_ts, reading FROM late_readings
+    ), new_gaps AS (
+        -- Ids up to upper_bound that are missing
+        SELECT first_id, last_id FROM (
+            SELECT lag(readings.id, 1, state.last_id) OVER (ORDER BY readings.id) + 1 AS first_id,
+                   readings.id - 1 AS last_id
+            FROM foglamp.readings AS readings, state, upper_bound
+            WHERE readings.id > state.last_id AND readings.id <= upper_bound.id
+        ) AS ranges
+        WHERE first_id <= last_id
+    ), remaining_gaps AS (
+        -- The parts of the gaps in which no reading has appeared
+        SELECT gap_id, first_id, last_id FROM (
+            SELECT gap_id, lag(id, 1, gap_id - 1) OVER (PARTITION BY gap_id ORDER BY id) + 1 AS first_id,
+                   id - 1 AS last_id
+            FROM (SELECT gap_id, id FROM late_readings
+                  UNION ALL
+                  SELECT first_id, last_id + 1 FROM gaps) AS bounds
+        ) AS ranges
+        WHERE first_id <= last_id
+    ), deleted_gaps AS (
+        DELETE FROM foglamp.reading_aggregates_gaps
+    ), inserted_gaps AS (
+        INSERT INTO foglamp.reading_aggregates_gaps (first_id, last_id, ts)
+        SELECT remaining_gaps.first_id, remaining_gaps.last_id, gaps.ts
+        FROM remaining_gaps JOIN gaps ON gaps.first_id = remaining_gaps.gap_id
+        WHERE gaps.ts > now() - $3 * interval '1 second'
+        UNION ALL
+        SELECT first_id, last_id, now() FROM new_gaps
+    ), new_values AS (
+        SELECT asset_code, reading_key, user_ts, value FROM (
+            SELECT readings.asset_code, value.key AS reading_key, readings.user_ts,
+                   """ + NUMERIC_VALUE.format('value.value') + """ AS value
+            FROM new_readings AS readings, jsonb_each(readings.reading) AS value
+            WHERE length(value.key) <= 255
+        ) AS reading_values
+        WHERE value IS NOT NULL
+    ), new_assets AS (
+        SELECT asset_code, count(*) AS reading_count, min(user_ts) AS first_ts, max(user_ts) AS last_ts
+        FROM new_readings
+        GROUP BY asset_code
+    ), new_keys AS (
+        SELECT readings.asset_code, array_agg(DISTINCT reading_key) AS reading_keys
+        FROM new_readings AS readings, jsonb_object_keys(readings.reading) AS reading_key
+        GROUP BY readings.asset_code
+    ), catalog_rows AS (
+        INSERT INTO foglamp.asset_catalog AS catalog
+            (asset_code, reading_count, first_ts, last_ts, reading_keys)
+        SELECT new_assets.asset_code, new_assets.reading_count, new_assets.first_ts, new_assets.last_ts,
+               COALESCE(new_keys.reading_keys, '{}')
+        FROM new_assets LEFT JOIN new_keys ON new_keys.asset_code = new_assets.asset_code
+        ON CONFLICT (asset_code) DO UPDATE
+        SET reading_count = catalog.reading_count + EXCLUDED.reading_count,
+            first_ts = LEAST(catalog.first_ts, EXCLUDED.first_ts),
+            last_ts = GREATEST(catalog.last_ts, EXCLUDED.last_ts),
+            reading_keys = ARRAY(SELECT DISTINCT reading_key
+                                 FROM unnest(catalog.reading_keys || EXCLUDED.reading_keys) AS reading_key
+                                 ORDER BY reading_key)
+    ), catalog_hours AS (
+        INSERT INTO foglamp.asset_catalog_hours AS hours (hour_ts, asset_code, reading_count)
+        SELECT to_timestamp(floor(extract(epoch FROM user_ts) / 3600) * 3600), asset_code, count(*)
+        FROM new_readings
+        GROUP BY 1, 2
+        ON CONFLICT (hour_ts, asset_code) DO UPDATE
+        SET reading_count = hours.reading_count + EXCLUDED.reading_count
+    )""" + "".join("""
+    , buckets_{seconds} AS (
+        INSERT INTO foglamp.reading_aggregates AS aggregates
+            (asset_code, reading_key, bucket_seconds, bucket_ts, count, sum, min, max)
+        SELECT asset_code, reading_key, {seconds},
+               to_timestamp(floor(extract(epoch FROM user_ts) / {seconds}) * {seconds}),
+               count(*), sum(value), min(value), max(value)
+        FROM new_values
+        GROUP BY 1, 2, 3, 4
+        ON CONFLICT (asset_code, reading_key, bucket_seconds, bucket_ts) DO UPDATE
+        SET count = aggregates.count + EXCLUDED.count,
+            sum = aggregates.sum + EXCLUDED.sum,
+            min = LEAST(aggregates.min, EXCLUDED.min),
+            max = GREATEST(aggregates.max, EXCLUDED.max)
+    )""".format(seconds=seconds) for seconds in BUCKET_SECONDS) + """
+    UPDATE foglamp.reading_aggregates_state AS state
+    SET last_id = upper_bound.id
+    FROM upper_bound
+    WHERE state.id = 1 AND upper_bound.id IS NOT NULL
+"""
+
+
+def bucket_seconds_for_window(window_seconds: float = None)->int:
+    """Returns the finest bucket length whose buckets are kept for window_seconds
+
+    Args:
+        window_seconds: Length of the period to read, ending now. None: All readings.
+    """
+    for seconds in BUCKET_SECONDS:
+        retention = BUCKET_RETENTION[seconds]
+        if retention is None or (window_seconds is not None and
+                                 window_seconds <= retention.total_seconds()):
+            return seconds
+
+    return BUCKET_SECONDS[-1]
+
+
+def bucket_seconds_for_width(width_seconds: int)->int:
+    """Returns the longest bucket length that width_seconds is a multiple of
+
+    Buckets of that length can be combined into buckets of width_seconds.
+    """
+    return max(seconds for seconds in BUCKET_SECONDS if width_seconds % seconds == 0)
+
+
+async def roll_up()->None:
+    """Adds readings that have not been aggregated to the buckets and to
+    asset_catalog and deletes buckets that are older than BUCKET_RETENTION"""
+    async with db_pool.acquire() as conn:
+        async with conn.transaction():
+            # Waits for a purge that is changing asset_catalog. The roll-up statement then
+            # takes a snapshot that does not include the readings the purge removed.
+            await conn.execute('SELECT last_id FROM foglamp.reading_aggregates_state WHERE id = 1 FOR UPDATE')
+            await conn.execute(_ROLL_UP_STATEMENT, _MAX_READINGS_PER_CALL, _SETTLE_SECONDS,
+                               _LATE_COMMIT_SECONDS)
+
+            for seconds, retention in BUCKET_RETENTION.items():
+                if retention is not None:
+                    await conn.execute('DELETE FROM foglamp.reading_aggregates '
+                                       'WHERE bucket_seconds = $1 AND bucket_ts < now() - $2::interval',
+                                       seconds, retention)
+
+
+def main():
+    """Performs one call to :func:`roll_up`"""
+    event_loop = asyncio.get_event_loop()
+    try:
+        event_loop.run_until_complete(roll_up())
+    finally:
+        event_loop.run_until_complete(db_pool.close())
+
+
+if __name__ == '__main__':
+    main()
@@ -4,12 +4,21 @@
 # See: http://foglamp.readthedocs.io/
 # FOGLAMP_END
 
-""" Statistics API """
+""" Statistics API
+
+Increments are accumulated in memory by :func:`increment` and written to the
+statistics table in a single UPDATE by :func:`flush`. Servers call
+:func:`start`, which flushes every flushSeconds (STATISTICS configuration
+category), and :func:`stop`, which flushes once more. Processes that do not
+start the periodic flush call :func:`flush` before they exit.
+"""
 
 # import logging
-import aiopg.sa
-import sqlalchemy as sa
+import asyncio
+from typing import Dict
 
+from foglamp import configuration_manager
+from foglamp import db_pool
 from foglamp import logger
 
 __author__ = "Ashwin Gopalakrishnan"
@@ -17,29 +26,156 @@ __copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
 __license__ = "Apache 2.0"
 __version__ = "${VERSION}"
 
-_statistics_tbl = sa.Table(
-    'statistics',
-    sa.MetaData(),
-    sa.Column('key', sa.types.CHAR(10)),
-    sa.Column('description', sa.types.VARCHAR(255)),
-    sa.Column('value', sa.types.BIGINT),
-    sa.Column('previous_value', sa.types.BIGINT),
-    sa.Column('ts', sa.types.TIMESTAMP)
-)
-"""Defines the table that data will be used for CRUD operations"""
-
-_connection_string = "dbname='foglamp'"
 _logger = logger.setup(__name__)
 
-async def _update_statistics_value(statistics_key, value_increment):
-    async with aiopg.sa.create_engine(_connection_string) as engine:
-        async with engine.acquire() as conn:
-            await conn.execute(_statistics_tbl.update(_statistics_tbl.c.key == statistics_key).values(value=_statistics_tbl.c.value + value_increment))
+_CONFIG_CATEGORY_NAME = 'STATISTICS'
+_CONFIG_CATEGORY_DESCRIPTION = 'Statistics'
+
+_DEFAULT_CONFIG = {
+    "flushSeconds": {
+        "description": "Number of seconds between writes of statistics increments to storage",
+        "type": "integer",
+        "default": "5",
+    }
+}
+
+# Configuration
+_flush_seconds = 5
+"""Number of seconds between writes of pending increments"""
+
+# State
+_pending = {}  # type: Dict[str, int]
+"""Increments by statistics key that have not been written to storage"""
+
+_flush_task = None  # type: asyncio.Task
+"""asyncio task for :func:`_flush_periodically`"""
+
+_flush_sleep_task = None  # type: asyncio.Task
+"""asyncio task that :func:`_flush_periodically` sleeps in"""
+
+_stopping = False
+"""True while :func:`stop` is stopping the periodic flush"""
+
+
+def increment(statistics_key: str, value_increment: int = 1)->None:
+    """Adds to a statistics value in memory. The value is written to storage
+    by the next :func:`flush`.
+
+    Does not await, so concurrent coroutines can not lose increments.
+    """
+    if value_increment:
+        _pending[statistics_key] = _pending.get(statistics_key, 0) + value_increment
+
+
+async def flush()->None:
+    """Writes all pending increments to the statistics table in a single UPDATE
+
+    If the UPDATE fails, the increments remain pending and are written by
+    the next call.
+    """
+    global _pending
+
+    if not _pending:
+        return
+
+    pending = _pending
+    _pending = {}
+    written = False
+
+    try:
+        async with db_pool.acquire() as conn:
+            await conn.execute('UPDATE foglamp.statistics AS s '
+                               'SET value = s.value + v.increment '
+                               'FROM (SELECT unnest($1::text[]) AS key, '
+                               'unnest($2::bigint[]) AS increment) AS v '
+                               'WHERE s.key = v.key',
+                               list(pending.keys()), list(pending.values()))
+        written = True
+    except Exception:
+        _logger.exception('Unable to update statistics values %s', pending)
+        raise
+    finally:
+        # Also when the flush is cancelled
+        if not written:
+            for statistics_key, value_increment in pending.items():
+                increment(statistics_key, value_increment)
+
+
+async def start()->None:
+    """Reads the configuration and starts writing pending increments every
+    flushSeconds
+
+    When the configuration can not be read, for example because the database
+    server is down, the current interval is used.
+    """
+    global _flush_task, _flush_seconds
+
+    if _flush_task is not None:
+        return
+
+    try:
+        await configuration_manager.create_category(_CONFIG_CATEGORY_NAME, _DEFAULT_CONFIG,
+                                                    _CONFIG_CATEGORY_DESCRIPTION)
+        config = await configuration_manager.get_category_all_items(_CONFIG_CATEGORY_NAME)
+        _flush_seconds = max(int(config['flushSeconds']['value']), 1)
+    except Exception:
+        _logger.exception('Unable to read the statistics configuration. Writing statistics every %s '
+                          'seconds.', _flush_seconds)
+
+    _flush_task = asyncio.ensure_future(_flush_periodically())
+
+
+async def stop()->None:
+    """Stops writing pending increments periodically and writes them once more"""
+    global _flush_task, _stopping
+
+    if _flush_task is not None:
+        _stopping = True
+
+        # Cancelling the sleep rather than the task does not interrupt a flush
+        if _flush_sleep_task is not None:
+            _flush_sleep_task.cancel()
+
+        try:
+            await _flush_task
+        finally:
+            _flush_task = None
+            _stopping = False
+
+    try:
+        await flush()
+    except Exception:
+        _logger.exception('Unable to write statistics at shutdown')
+
+
+async def _flush_periodically()->None:
+    """Calls :func:`flush` every _flush_seconds until :func:`stop` is called"""
+    global _flush_sleep_task
+
+    while not _stopping:
+        _flush_sleep_task = asyncio.ensure_future(asyncio.sleep(_flush_seconds))
+
+        try:
+            await _flush_sleep_task
+        except asyncio.CancelledError:
+            break
+        finally:
+            _flush_sleep_task = None
+
+        # Increments that can not be written remain pending
+        try:
+            await flush()
+        except Exception:
+            pass
 
 
 async def update_statistics_value(statistics_key, value_increment):
     """Update the value column only of a statistics row based on key
 
+    Also writes increments made by :func:`increment`. If an exception is
+    raised, the increment remains pending and is written by the next
+    :func:`flush`.
+
     Keyword Arguments:
     category_name -- statistics key value (required)
     value_increment -- amount to increment the value by
@@ -47,12 +183,8 @@ async def update_statistics_value(statistics_key, value_increment):
     Return Values:
     None
     """
-    try:
-        return await _update_statistics_value(statistics_key, value_increment)
-    except:
-        _logger.exception(
-            'Unable to update statistics value based on statistics_key %s and value_increment %s', statistics_key, value_increment)
-        raise
+    increment(statistics_key, value_increment)
+    await flush()
 
 # async def main():
 #     await update_statistics_value('READINGS',10)
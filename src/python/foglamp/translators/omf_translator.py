@@ -826,7 +826,7 @@ async def send_data_to_picromf():
             _logger.debug("{0}".format("omf_translator_perf - send_in_memory_data_to_picromf END "))
 
             position_update(new_position)
-            await update_statistics()
+            update_statistics()
 
     except Exception:
         message = _message_list["e000004"]
@@ -1011,15 +1011,21 @@ def send_init():
         raise
 
 
-async def update_statistics():
-    """Updates FogLAMP statistics
+def update_statistics():
+    """Adds the number of readings sent to FogLAMP statistics. They are written by flush_statistics."""
+
+    statistics.increment('SENT', _num_sent)
+
+
+async def flush_statistics():
+    """Writes FogLAMP statistics
 
     Raises :
         Exception - cannot update statistics
     """
 
     try:
-        await statistics.update_statistics_value('SENT', _num_sent)
+        await statistics.flush()
 
     except Exception:
         message = _message_list["e000015"]
@@ -1047,7 +1053,10 @@ if __name__ == "__main__":
         send_init()
         _logger.debug("{0}".format("omf_translator_perf - send_init END "))
 
-        _event_loop.run_until_complete(send_data_to_picromf())
+        try:
+            _event_loop.run_until_complete(send_data_to_picromf())
+        finally:
+            _event_loop.run_until_complete(flush_statistics())
 
         _logger.info(_message_list["i000003"])
 
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""Fixtures shared by the unit tests"""
+
+import pytest
+
+from foglamp import db_pool
+
+__author__ = "Terris Linenbach"
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+
+class _Transaction(object):
+    async def __aenter__(self):
+        pass
+
+    async def __aexit__(self, exc_type, exc, tb):
+        pass
+
+
+class _Cursor(object):
+    def __init__(self, rows):
+        self._rows = iter(rows)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._rows)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class _Connection(object):
+    """Records the queries run through an asyncpg connection and returns rows"""
+    def __init__(self):
+        self.rows = []
+        """Returned by fetch and cursor. fetchrow and fetchval return the first row."""
+
+        self.pages = None
+        """When not None, fetch returns the next of these lists of rows"""
+
+        self.values = {}
+        """fetchval returns the value of the first key that the query contains"""
+
+        self.fail = False
+        """True: execute raises ConnectionError"""
+
+        self.blocked = None
+        """When not None, execute waits for this asyncio.Event"""
+
+        self.queries = []
+        """(query, args) of each call"""
+
+    async def execute(self, query, *args):
+        if self.blocked is not None:
+            await self.blocked.wait()
+        if self.fail:
+            raise ConnectionError('Connection lost')
+        self.queries.append((query, args))
+
+    async def fetch(self, query, *args):
+        self.queries.append((query, args))
+        if self.pages is not None:
+            return self.pages.pop(0)
+        return self.rows
+
+    async def fetchrow(self, query, *args):
+        self.queries.append((query, args))
+        return self.rows[0]
+
+    async def fetchval(self, query, *args):
+        self.queries.append((query, args))
+        for text, value in self.values.items():
+            if text in query:
+                return value
+        return self.rows[0]
+
+    def cursor(self, query, *args, prefetch=None):
+        self.queries.append((query, args))
+        return _Cursor(self.rows)
+
+    def transaction(self, **kwargs):
+        return _Transaction()
+
+
+class _AcquireContext(object):
+    def __init__(self, connection):
+        self._connection = connection
+
+    async def __aenter__(self):
+        return self._connection
+
+    async def __aexit__(self, exc_type, exc, tb):
+        pass
+
+
+@pytest.fixture
+def connection(monkeypatch):
+    """Replaces db_pool.acquire. Returns the connection it lends."""
+    connection = _Connection()
+    monkeypatch.setattr(db_pool, 'acquire', lambda: _AcquireContext(connection))
+    return connection
@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""Unit test for foglamp.core.api.browser"""
+
+import datetime
+import json
+
+import asyncpg
+import pytest
+from aiohttp import web
+
+from foglamp import db_pool
+from foglamp import reading_aggregates
+from foglamp.core.api import browser
+
+__author__ = "Terris Linenbach"
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+
+class _Request(object):
+    def __init__(self, **query):
+        self.query = query
+        self.match_info = {'asset_code': 'a'}
+
+
+class _StreamResponse(object):
+    def __init__(self, headers):
+        self.headers = headers
+        self.chunks = []
+        self.eof = False
+
+    async def prepare(self, request):
+        pass
+
+    async def write(self, data):
+        self.chunks.append(data)
+
+    async def write_eof(self):
+        self.eof = True
+
+
+_FIRST_TS = datetime.datetime(2017, 9, 1, tzinfo=datetime.timezone.utc)
+"""asset_catalog.first_ts"""
+
+_BUCKETS_START = datetime.datetime(2017, 9, 1, 1, tzinfo=datetime.timezone.utc)
+"""The start of the first reading_aggregates bucket read"""
+
+
+def _rows(count):
+    user_ts = datetime.datetime(2017, 10, 1, 12, 0, 0, 500, tzinfo=datetime.timezone.utc)
+    return [{'user_ts': user_ts, 'id': reading_id} for reading_id in range(count, 0, -1)]
+
+
+@pytest.fixture
+def connection(connection):
+    """Returns readings and the values of reading_aggregates_state.last_id, asset_catalog.first_ts and the
+    first bucket read"""
+    connection.rows = _rows(2)
+    connection.values = {'reading_aggregates_state': 7, 'asset_catalog': _FIRST_TS, 'ceil': _BUCKETS_START}
+    return connection
+
+
+@pytest.allure.feature("TestBrowser")
+class TestBrowser(object):
+    """Unit tests for foglamp.core.api.browser
+    """
+    @pytest.mark.asyncio
+    async def test_fetch_page_after(self, connection):
+        rows, next_after = await browser._fetch_page(_Request(limit='2', after=''), 'reading', 'a')
+        assert next_after == '2017-10-01T12:00:00.000500,1'
+        query, args = connection.queries[-1]
+        assert 'OFFSET' not in query
+        assert args == ('a', 2)
+
+        await browser._fetch_page(_Request(limit='2', after=next_after, minutes='1'), 'reading', 'a')
+        query, args = connection.queries[-1]
+        assert '(user_ts, id) < ($3::timestamptz, $4::bigint)' in query
+        assert args == ('a', 60.0, browser._parse_after(next_after)[0], 1, 2)
+
+        # Last page
+        _, next_after = await browser._fetch_page(_Request(limit='3', after=next_after), 'reading', 'a')
+        assert next_after is None
+
+    @pytest.mark.asyncio
+    async def test_fetch_page_skip(self, connection):
+        await browser._fetch_page(_Request(limit='2', skip='4'), 'reading', 'a')
+        query, args = connection.queries[-1]
+        assert query.endswith('LIMIT $2 OFFSET $3')
+        assert args == ('a', 2, 4)
+
+    def test_parse_after(self):
+        assert browser._parse_after('2017-10-01T12:00:00.000500,17') == (
+            datetime.datetime(2017, 10, 1, 12, 0, 0, 500, tzinfo=datetime.timezone.utc), 17)
+
+        with pytest.raises(web.HTTPBadRequest):
+            browser._parse_after('17')
+
+    @pytest.mark.asyncio
+    async def test_asset_export(self, connection, monkeypatch):
+        monkeypatch.setattr(browser.web, 'StreamResponse', _StreamResponse)
+        monkeypatch.setattr(browser, '_EXPORT_CHUNK_ROWS', 2)
+        user_ts = datetime.datetime(2017, 10, 1, 12, tzinfo=datetime.timezone.utc)
+        rows = [{'user_ts': user_ts, 'id': reading_id, 'line': str(reading_id)} for reading_id in range(3)]
+
+        connection.pages = [rows[:2], rows[2:]]
+        response = await browser.asset_export(_Request(format='csv', limit='3'))
+        assert response.headers['Content-Type'] == 'text/csv; charset=utf-8'
+        assert response.chunks == [b'timestamp,reading\n0\n1\n', b'2\n']
+        assert response.eof
+
+        # Each page starts after the last reading of the previous page
+        query, args = connection.queries[-2]
+        assert query.endswith('ORDER BY user_ts, id LIMIT $2')
+        assert args == ('a', 2)
+        query, args = connection.queries[-1]
+        assert query.endswith('AND (user_ts, id) > ($2::timestamptz, $3::bigint) ORDER BY user_ts, id LIMIT $4')
+        assert args == ('a', user_ts, 1, 1)
+
+        connection.pages = [rows[:2], rows[2:]]
+        response = await browser.asset_export(_Request())
+        assert response.headers['Content-Type'] == 'application/x-ndjson; charset=utf-8'
+        assert response.chunks == [b'0\n1\n', b'2\n']
+        assert connection.pages == []
+
+        response = await browser.asset_export(_Request(format='csv', limit='0'))
+        assert response.chunks == [b'timestamp,reading\n']
+
+        with pytest.raises(web.HTTPBadRequest):
+            await browser.asset_export(_Request(format='xml'))
+
+    @pytest.mark.asyncio
+    async def test_asset_counts(self, connection):
+        connection.rows = [('a', 3, '2017-10-01 12:00:00.000', '2017-10-01 12:00:02.000', ['humidity', 'x'])]
+
+        response = await browser.asset_counts(_Request())
+        assert json.loads(response.text) == [{
+            'asset_code': 'a', 'count': 3, 'first_timestamp': '2017-10-01 12:00:00.000',
+            'last_timestamp': '2017-10-01 12:00:02.000', 'sensors': ['humidity', 'x']}]
+
+        query, args = connection.queries[-1]
+        assert args == (7,)
+        assert 'GROUP BY asset_code' in query
+        assert 'foglamp.asset_catalog' in query
+
+    @pytest.mark.asyncio
+    async def test_asset_summary(self, connection):
+        request = _Request()
+        request.match_info['reading'] = 'x'
+        connection.rows = [(1.0, 3.0, 2.0)]
+
+        response = await browser.asset_summary(request)
+        assert json.loads(response.text) == {'x': {'min': 1.0, 'max': 3.0, 'average': 2.0}}
+
+        # Readings, hourly aggregates, last_id and the first bucket read
+        query, args = connection.queries[-1]
+        assert args == ('a', 'x', 3600, 7, _BUCKETS_START)
+        assert '(user_ts < $5 OR id > $4)' in query
+        assert 'bucket_ts >= $5::timestamptz' in query
+
+    @pytest.mark.asyncio
+    async def test_asset_averages(self, connection):
+        request = _Request(bucket='30s', fill='previous', minutes='10')
+        request.match_info['reading'] = 'y,x,y'
+        connection.rows = [('2017-10-01 12:00:00', 'x', 1.0, 3.0, 2.0),
+                           ('2017-10-01 12:00:00', 'y', 4.0, 4.0, 4.0),
+                           ('2017-10-01 12:00:30', 'x', 1.0, 3.0, 2.0)]
+
+        response = await browser.asset_averages(request)
+        assert json.loads(response.text) == [
+            {'time': '2017-10-01 12:00:00', 'readings': {'x': {'min': 1.0, 'max': 3.0, 'average': 2.0},
+                                                         'y': {'min': 4.0, 'max': 4.0, 'average': 4.0}}},
+            {'time': '2017-10-01 12:00:30', 'readings': {'x': {'min': 1.0, 'max': 3.0, 'average': 2.0}}}]
+
+        query, args = connection.queries[-1]
+        # Readings, 1 second aggregates, window, bucket width, limit, last_id and the first bucket read
+        assert args == ('a', ['y', 'x'], 1, 600.0, 30, 20, 7, _BUCKETS_START)
+        assert '(user_ts < $8 OR id > $7)' in query
+        assert 'bucket_ts >= $8::timestamptz' in query
+        assert 'generate_series' in query
+        assert 'first_value(average) OVER previous_values' in query
+
+        # One reading keeps the flat entries
+        request = _Request(group='minutes')
+        request.match_info['reading'] = 'x'
+        response = await browser.asset_averages(request)
+        assert json.loads(response.text)[0] == {'time': '2017-10-01 12:00:00', 'min': 1.0, 'max': 3.0,
+                                                'average': 2.0}
+        query, args = connection.queries[-1]
+        # Minute buckets are not kept since _FIRST_TS, so readings are read instead of buckets
+        assert args == ('a', ['x'], None, 60, 20, 0, None)
+        assert 'generate_series' not in query
+
+    def test_series_bucket_seconds(self):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        assert browser._series_bucket_seconds(30, 600, None) == 1
+        assert browser._series_bucket_seconds(120, 600, None) == 60
+        assert browser._series_bucket_seconds(7200, None, now - datetime.timedelta(days=400)) == 3600
+
+        # Per-second buckets are kept for a day
+        assert browser._series_bucket_seconds(120, None, now - datetime.timedelta(days=2)) == 60
+        assert browser._series_bucket_seconds(30, 2 * 86400, None) is None
+        assert browser._series_bucket_seconds(30, None, now - datetime.timedelta(days=2)) is None
+
+    def test_bucket_width_seconds(self):
+        assert browser._bucket_width_seconds(_Request()) == 1
+        assert browser._bucket_width_seconds(_Request(group='hours')) == 3600
+        assert browser._bucket_width_seconds(_Request(bucket='90')) == 90
+        assert browser._bucket_width_seconds(_Request(bucket='2d', group='hours')) == 2 * 86400
+
+        for bucket in ('0s', '1.5m', '10w'):
+            with pytest.raises(web.HTTPBadRequest):
+                browser._bucket_width_seconds(_Request(bucket=bucket))
+
+
+_ASSET = 'test_browser'
+
+
+async def _delete_asset(conn):
+    for table in ('readings', 'reading_aggregates', 'asset_catalog', 'asset_catalog_hours'):
+        await conn.execute('DELETE FROM foglamp.{} WHERE asset_code = $1'.format(table), _ASSET)
+
+
+def _values(entries):
+    return [(entry['min'], entry['max'], entry['average']) for entry in entries]
+
+
+def _reading_request(reading='x', **query):
+    request = _Request(**query)
+    request.match_info.update(asset_code=_ASSET, reading=reading)
+    return request
+
+
+async def _insert_settled(conn, reading, user_ts):
+    """Inserts a reading that the readings aggregator adds to reading_aggregates"""
+    await conn.execute("INSERT INTO foglamp.readings (asset_code, reading, user_ts, ts) "
+                       "VALUES ($1, $2::jsonb, $3, now() - interval '1 minute')",
+                       _ASSET, json.dumps(reading), user_ts)
+
+
+@pytest.allure.feature("TestBrowserReadings")
+class TestBrowserReadings(object):
+    """Tests for the summary and series of foglamp.core.api.browser against readings in the foglamp database
+    """
+    @pytest.mark.asyncio
+    async def test_summary_and_series(self):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        start = now.replace(second=0, microsecond=0) - datetime.timedelta(minutes=5)
+        conn = await asyncpg.connect(database='foglamp')
+        request = _reading_request
+
+        try:
+            await _delete_asset(conn)
+            for value, seconds in ((1, 0), (3, 10)):
+                await _insert_settled(conn, {'x': value}, start + datetime.timedelta(seconds=seconds))
+            await reading_aggregates.roll_up()
+
+            # Not aggregated yet
+            await conn.execute('INSERT INTO foglamp.readings (asset_code, reading, user_ts) VALUES ($1, $2::jsonb, $3)',
+                               _ASSET, '{"x": 5, "y": 1e400}', start + datetime.timedelta(seconds=40))
+
+            response = await browser.asset_summary(request())
+            assert json.loads(response.text) == {'x': {'min': 1.0, 'max': 5.0, 'average': 3.0}}
+
+            response = await browser.asset_summary(request('y'))
+            assert json.loads(response.text) == {'y': {'min': None, 'max': None, 'average': None}}
+
+            response = await browser.asset_averages(request(bucket='30s'))
+            assert _values(json.loads(response.text)) == [(1.0, 3.0, 2.0), (5.0, 5.0, 5.0)]
+
+            # Every 30 seconds of the last 10 minutes, with null values for empty buckets
+            response = await browser.asset_averages(request(bucket='30s', fill='null', minutes='10', limit='100'))
+            series = json.loads(response.text)
+            assert len(series) == 21
+            assert [values for values in _values(series) if values != (None, None, None)] == [
+                (1.0, 3.0, 2.0), (5.0, 5.0, 5.0)]
+
+            # The buckets after a bucket that has values repeat its values
+            response = await browser.asset_averages(request(bucket='30s', fill='previous', minutes='10',
+                                                            limit='100'))
+            values = _values(json.loads(response.text))
+            first = values.index((1.0, 3.0, 2.0))
+            assert values[first + 1:] == [(5.0, 5.0, 5.0)] * (len(values) - first - 1)
+        finally:
+            await _delete_asset(conn)
+            await conn.close()
+            await db_pool.close()
+
+    @pytest.mark.asyncio
+    async def test_partial_buckets(self):
+        hour = (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=40)).replace(
+            minute=0, second=0, microsecond=0)
+        conn = await asyncpg.connect(database='foglamp')
+
+        try:
+            await _delete_asset(conn)
+            for value, minutes in ((100, 10), (200, 50)):
+                await _insert_settled(conn, {'x': value}, hour + datetime.timedelta(minutes=minutes))
+            await reading_aggregates.roll_up()
+
+            # The time limit starts within the hourly bucket of both readings
+            seconds = (datetime.datetime.now(datetime.timezone.utc) - hour -
+                       datetime.timedelta(minutes=30)).total_seconds()
+            response = await browser.asset_summary(_reading_request(seconds=str(seconds)))
+            assert json.loads(response.text) == {'x': {'min': 200.0, 'max': 200.0, 'average': 200.0}}
+
+            response = await browser.asset_averages(_reading_request(bucket='1h', seconds=str(seconds)))
+            assert _values(json.loads(response.text)) == [(200.0, 200.0, 200.0)]
+
+            # Purge the first reading. Its bucket holds the oldest reading that remains.
+            await conn.execute('DELETE FROM foglamp.readings WHERE asset_code = $1 AND user_ts < $2',
+                               _ASSET, hour + datetime.timedelta(minutes=30))
+            await conn.execute('UPDATE foglamp.asset_catalog SET reading_count = 1, first_ts = $2 '
+                               'WHERE asset_code = $1', _ASSET, hour + datetime.timedelta(minutes=50))
+
+            response = await browser.asset_summary(_reading_request())
+            assert json.loads(response.text) == {'x': {'min': 200.0, 'max': 200.0, 'average': 200.0}}
+        finally:
+            await _delete_asset(conn)
+            await conn.close()
+            await db_pool.close()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""Unit test for foglamp.core.api.statistics_db_services"""
+
+import pytest
+
+from foglamp.core.api import statistics_db_services
+
+__author__ = "Terris Linenbach"
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+
+@pytest.fixture
+def connection(connection):
+    """Returns two statistics_history rows"""
+    connection.rows = [
+        {'history_ts': '2017-09-30 12:00:00+00', 'statistics': '{"READINGS": 10, "PURGED": 0}'},
+        {'history_ts': '2017-09-30 12:00:15+00', 'statistics': '{"READINGS": 4, "PURGED": 2}'}]
+    return connection
+
+
+@pytest.allure.feature("TestStatisticsDbServices")
+class TestStatisticsDbServices(object):
+    """Unit tests for foglamp.core.api.statistics_db_services
+    """
+    @pytest.mark.asyncio
+    async def test_read_statistics_history(self, connection):
+        results = await statistics_db_services.read_statistics_history(10, ['READINGS'])
+
+        assert results == [{'history_ts': '2017-09-30 12:00:00+00', 'READINGS': 10, 'PURGED': 0},
+                           {'history_ts': '2017-09-30 12:00:15+00', 'READINGS': 4, 'PURGED': 2}]
+
+        query, args = connection.queries[0]
+        assert args == (10, ['READINGS'])
+        assert query.count('key = ANY($2::character(10)[])') == 2
+        # history_ts is compared without casts so that the index can be used
+        assert '::varchar IN' not in query
+
+    @pytest.mark.asyncio
+    async def test_read_all_statistics_history(self, connection):
+        await statistics_db_services.read_statistics_history()
+
+        query, args = connection.queries[0]
+        assert args == ()
+        assert 'LIMIT' not in query
+        assert 'ANY' not in query
+
+    @pytest.mark.asyncio
+    async def test_read_stats_collector_interval(self, connection):
+        connection.rows = [15.0]
+
+        assert await statistics_db_services.read_stats_collector_interval() == 15.0
+        _, args = connection.queries[0]
+        assert args == ('stats collector',)
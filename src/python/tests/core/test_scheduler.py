@@ -54,6 +54,29 @@ class TestScheduler:
 
         await self.stop_scheduler(scheduler)
 
+    @pytest.mark.asyncio
+    async def test_coroutine_process(self):
+        """Test that coroutines run in place of processes report exit codes like processes
+        :assert:
+            A coroutine that returns exits with 0, one that raises exits with 1 and one
+            that is terminated exits with a negative code
+        """
+        Scheduler()  # Initializes the logger
+
+        async def succeed():
+            await asyncio.sleep(0)
+
+        async def fail():
+            raise RuntimeError('Purge failed')
+
+        assert await Scheduler._CoroutineProcess(succeed()).wait() == 0
+        assert await Scheduler._CoroutineProcess(fail()).wait() == 1
+
+        process = Scheduler._CoroutineProcess(asyncio.sleep(60))
+        assert process.pid == os.getpid()
+        process.terminate()
+        assert await process.wait() < 0
+
     @pytest.mark.asyncio
     async def test_create_interval(self):
         """Test the creation of a new schedule interval
@@ -34,7 +34,8 @@ import sqlalchemy
 import uuid
 
 from foglamp import configuration_manager
-from foglamp.data_purge.purge import (_READING_TABLE, _LOG_TABLE,  execute_command, 
+from foglamp.data_purge import purge as purge_module
+from foglamp.data_purge.purge import (_READING_TABLE, _LOG_TABLE,
                                       _CONFIG_CATEGORY_NAME, set_configuration, purge)
 
 __author__ = "Ori Shadmon"
@@ -44,6 +45,19 @@ __version__ = "${VERSION}"
 
 """Support methods for testing"""
 
+__ENGINE = sqlalchemy.create_engine("postgres:///foglamp", pool_size=5, max_overflow=0)
+
+
+def execute_command(stmt):
+    """"Executes a statement synchronously
+    Args:
+        stmt (str): generated SQL query
+    Returns:
+        Returns result set
+    """
+    with __ENGINE.connect() as conn:
+        return conn.execute(stmt)
+
 
 @pytest.fixture(scope="module")
 def clean_tables(): 
@@ -381,3 +395,145 @@ def test_delete_all_stored_data():
     assert log['rowsRemaining'] == row_count - total_purged
     clean_tables()
 
+
+@pytest.mark.asyncio
+async def test_delete_chunks(monkeypatch):
+    """"Test that rows are deleted in id ranges of chunk_rows ids, one statement per range
+    :assert:
+        Every id from min_id to max_id is covered exactly once, ranges are no larger than chunk_rows,
+        the removed rows are subtracted from the asset catalog and the row counts of the statements are summed
+    """
+    ranges = []
+
+    async def _fetch_scalar(stmt):
+        assert 'UPDATE foglamp.asset_catalog' in str(stmt)
+        params = stmt.compile().params
+        ranges.append((params['first_id'], params['last_id']))
+        return 7
+
+    monkeypatch.setattr(purge_module, 'fetch_scalar', _fetch_scalar)
+
+    rows_removed = await purge_module.delete_chunks(_READING_TABLE, datetime.datetime.now(), 5, 30, 10, 0)
+
+    assert ranges == [(5, 14), (15, 24), (25, 30)]
+    assert rows_removed == 21
+
+
+@pytest.mark.asyncio
+async def test_create_partitions(monkeypatch):
+    """"Test that partitions are created for the current and next periods unless they overlap existing partitions
+    :assert:
+        Partition names and bounds for day partitions, where the current day already has a partition
+    """
+    statements = []
+    today = datetime.datetime(2017, 10, 1, tzinfo=datetime.timezone.utc)
+
+    async def _list_partitions(table_name):
+        return [('readings_20171001', today, today + datetime.timedelta(days=1))]
+
+    async def _execute_in_transaction(*stmts):
+        statements.extend(str(stmt) for stmt in stmts)
+
+    monkeypatch.setattr(purge_module, 'list_partitions', _list_partitions)
+    monkeypatch.setattr(purge_module, 'execute_in_transaction', _execute_in_transaction)
+
+    created = await purge_module.create_partitions(_READING_TABLE, 'day', today + datetime.timedelta(hours=13))
+
+    assert created == ['readings_20171002', 'readings_20171003']
+    assert "ATTACH PARTITION readings_20171002 FOR VALUES FROM ('2017-10-02T00:00:00+00:00') " \
+           "TO ('2017-10-03T00:00:00+00:00')" in statements[2]
+
+    with pytest.raises(ValueError):
+        await purge_module.create_partitions(_READING_TABLE, 'week')
+
+
+@pytest.mark.asyncio
+async def test_drop_partitions(monkeypatch):
+    """"Test that partitions older than age_timestamp are dropped without reading their rows
+    :assert:
+        The asset catalog is updated from the hours of each dropped partition, only the unsent rows are counted and
+        the first partition that is not older than age_timestamp is kept
+    """
+    statements = []
+    queries = []
+    today = datetime.datetime(2017, 10, 1, tzinfo=datetime.timezone.utc)
+    partitions = [('readings_20170930', today - datetime.timedelta(days=1), today),
+                  ('readings_20171001', today, today + datetime.timedelta(days=1))]
+
+    async def _list_partitions(table_name):
+        return partitions
+
+    async def _count_rows(table_name):
+        return 100
+
+    async def _fetch_scalar(stmt):
+        queries.append(str(stmt))
+        if 'max(' in str(stmt):
+            return 60
+        return 10
+
+    async def _execute_in_transaction(*stmts):
+        statements.append(stmts)
+
+    monkeypatch.setattr(purge_module, 'list_partitions', _list_partitions)
+    monkeypatch.setattr(purge_module, 'count_rows', _count_rows)
+    monkeypatch.setattr(purge_module, 'fetch_scalar', _fetch_scalar)
+    monkeypatch.setattr(purge_module, 'execute_in_transaction', _execute_in_transaction)
+
+    assert await purge_module.drop_partitions(_READING_TABLE, today, 50, False) == (100, 10)
+
+    assert len(statements) == 1
+    lock, hours, detach, drop = statements[0]
+    assert 'FOR SHARE' in str(lock)
+    assert 'DELETE FROM foglamp.asset_catalog_hours' in str(hours)
+    assert 'UPDATE foglamp.asset_catalog' in str(hours)
+    assert hours.compile().params == {'lower': today - datetime.timedelta(days=1), 'upper': today}
+    assert str(drop) == 'DROP TABLE readings_20170930'
+    assert 'WHERE readings_20170930.id >' in queries[-1]
+
+    # Unsent rows are retained
+    statements.clear()
+    assert await purge_module.drop_partitions(_READING_TABLE, today, 50, True) == (0, 0)
+    assert statements == []
+
+
+@pytest.mark.asyncio
+async def test_apply_row_limit(monkeypatch):
+    """"Test that maxRows and maxTableSizeMB move the age cutoff to the newest row that must be removed
+    :assert:
+        The stricter limit applies, the cutoff id leaves room for the rows that are kept and an older cutoff than
+        age_timestamp is ignored
+    """
+    queries = []
+    age_timestamp = datetime.datetime(2017, 10, 1, tzinfo=datetime.timezone.utc)
+    cutoff_timestamp = age_timestamp + datetime.timedelta(hours=1)
+
+    async def _is_partitioned(table_name):
+        return False
+
+    async def _fetch_scalar(stmt):
+        queries.append(stmt)
+        if 'avg_width' in str(stmt):
+            # The heap width and overhead scaled by the size of the indexes and TOAST data
+            assert 'pg_total_relation_size' in str(stmt)
+            return 1024  # 1 KB per row
+        return cutoff_timestamp
+
+    async def _fetch_all(stmt):
+        # Half of the ids from 1 to 20000 are used
+        return [(1, 20000)]
+
+    monkeypatch.setattr(purge_module, 'is_partitioned', _is_partitioned)
+    monkeypatch.setattr(purge_module, 'fetch_scalar', _fetch_scalar)
+    monkeypatch.setattr(purge_module, 'fetch_all', _fetch_all)
+
+    config = {'maxRows': {'value': '5000'}, 'maxTableSizeMB': {'value': '2'}}
+    assert await purge_module.row_limit(config, _READING_TABLE, 10000) == 2048
+
+    assert await purge_module.apply_row_limit(config, _READING_TABLE, age_timestamp, 10000) == cutoff_timestamp
+    assert 20000 - 2048 * 2 in queries[-1].compile().params.values()
+
+    assert await purge_module.apply_row_limit(config, _READING_TABLE, age_timestamp, 2000) == age_timestamp
+
+    cutoff_timestamp = age_timestamp - datetime.timedelta(hours=1)
+    assert await purge_module.apply_row_limit(config, _READING_TABLE, age_timestamp, 10000) == age_timestamp
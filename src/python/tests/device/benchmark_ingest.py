@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""Micro-benchmarks for foglamp.device.ingest
+
+Run with:
+
+.. code-block:: console
+
+    python -m tests.device.benchmark_ingest
+"""
+
+import asyncio
+import datetime
+import json
+import timeit
+import uuid
+
+import dateutil.parser
+
+from foglamp.device import ingest
+from foglamp.device.ingest import Ingest, READINGS_ENCODERS
+
+__author__ = "Terris Linenbach"
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+_BATCH_SIZE = 1000
+_REPEAT = 5
+_NUMBER = 20
+
+_TIMESTAMPS = [
+    '2017-01-02T01:02:03.232320Z',
+    '2017-01-02T01:02:03Z',
+    '2017-01-02T01:02:03.23232+05:30',
+    '2017-01-02T01:02:03.232-08:00',
+    '2017-01-02 01:02:03.232320',
+]
+"""Timestamps in the formats sent by devices and gateways"""
+
+
+def _make_batch():
+    """Returns queue items similar to those created by Ingest.add_readings"""
+    timestamp = datetime.datetime.now(datetime.timezone.utc)
+    return [('pump{}'.format(i % 10), timestamp, uuid.uuid4(),
+             {'velocity': 500 + i, 'rpm': 1200.5,
+              'temperature': {'value': 32.25, 'unit': 'kelvin'},
+              'status': 'running'})
+            for i in range(_BATCH_SIZE)]
+
+
+def _report(name, seconds):
+    """Prints microseconds per item"""
+    per_item = seconds / (_NUMBER * _BATCH_SIZE) * 1e6
+    print('{:<28} {:8.3f} us/item'.format(name, per_item))
+
+
+def benchmark_encode_readings():
+    """Compares inline json.dumps per reading with each batch encoder"""
+    batch = _make_batch()
+    saved_encoder = Ingest._readings_encoder
+
+    def inline():
+        return [(i[0], i[1], i[2], json.dumps(i[3])) for i in batch]
+
+    print('Encode {} readings per batch'.format(_BATCH_SIZE))
+    _report('inline json.dumps', min(timeit.repeat(inline, repeat=_REPEAT, number=_NUMBER)))
+
+    try:
+        for name, encoder in sorted(READINGS_ENCODERS.items()):
+            Ingest._readings_encoder = encoder
+            _report('batch ' + name, min(timeit.repeat(
+                lambda: Ingest._encode_readings(batch), repeat=_REPEAT, number=_NUMBER)))
+
+        Ingest._readings_encoder = None
+        loop = asyncio.get_event_loop()
+
+        async def in_executor():
+            for _ in range(_NUMBER):
+                await loop.run_in_executor(None, Ingest._encode_readings, batch)
+
+        _report('batch default, executor', min(timeit.repeat(
+            lambda: loop.run_until_complete(in_executor()), repeat=_REPEAT, number=1)))
+    finally:
+        Ingest._readings_encoder = saved_encoder
+
+
+def benchmark_parse_timestamp():
+    """Compares dateutil with ingest._parse_timestamp, with and without fromisoformat"""
+    timestamps = _TIMESTAMPS * (_BATCH_SIZE // len(_TIMESTAMPS))
+    saved_fromisoformat = ingest._fromisoformat
+
+    def parse(parser):
+        return lambda: [parser(timestamp) for timestamp in timestamps]
+
+    print('Parse {} timestamps'.format(len(timestamps)))
+    _report('dateutil.parser.parse', min(timeit.repeat(
+        parse(dateutil.parser.parse), repeat=_REPEAT, number=_NUMBER)))
+
+    try:
+        if saved_fromisoformat is not None:
+            _report('_parse_timestamp', min(timeit.repeat(
+                parse(ingest._parse_timestamp), repeat=_REPEAT, number=_NUMBER)))
+
+        ingest._fromisoformat = None
+        _report('_parse_timestamp, regex', min(timeit.repeat(
+            parse(ingest._parse_timestamp), repeat=_REPEAT, number=_NUMBER)))
+    finally:
+        ingest._fromisoformat = saved_fromisoformat
+
+
+if __name__ == '__main__':
+    benchmark_encode_readings()
+    print()
+    benchmark_parse_timestamp()
@@ -6,6 +6,7 @@
 
 """Unit test for foglamp.device.coap"""
 
+import json
 import pytest
 from unittest.mock import MagicMock
 from aiocoap.numbers.codes import Code as CoAP_CODES
@@ -20,6 +21,15 @@ __license__ = "Apache 2.0"
 __version__ = "${VERSION}"
 
 
+@pytest.fixture(autouse=True)
+def config(monkeypatch):
+    """Keeps Ingest.start from reading the configuration from the database"""
+    async def read_config():
+        pass
+
+    monkeypatch.setattr(Ingest, '_read_config', read_config)
+
+
 @pytest.allure.feature("TestIngestReadings")
 class TestIngestReadings(object):
     """Unit tests for foglamp.device.coap.IngestReadings
@@ -60,6 +70,46 @@ class TestIngestReadings(object):
 
         await Ingest.stop()
 
+    __BULK_REQUESTS = [
+        ([{'timestamp': '2017-01-01T00:00:00Z', 'asset': 'test'},
+          {'asset': 'test'},
+          5,
+          {'timestamp': '2017-01-01T00:00:00Z', 'asset': 'test2', 'readings': {'a': 5}}],
+         CoAP_CODES.VALID, 2, 2),
+        ([], CoAP_CODES.BAD_REQUEST, 0, 0),
+        ([{'asset': 'test'}], CoAP_CODES.BAD_REQUEST, 0, 1),
+        ({'asset': 'test', 'timestamps': ['2017-01-01T00:00:00Z', '2017-01-01T00:00:01Z'],
+          'readings': {'a': [1, 2], 'b': ['x', 'y']}}, CoAP_CODES.VALID, 2, 0),
+        ({'asset': 'test', 'timestamps': ['2017-01-01T00:00:00Z', 'bad timestamp'],
+          'keys': [None, '123e4567-e89b-12d3-a456-426655440000']}, CoAP_CODES.VALID, 1, 1),
+        ({'asset': 'test', 'timestamps': ['2017-01-01T00:00:00Z'],
+          'readings': {'a': [1, 2]}}, CoAP_CODES.BAD_REQUEST, None, None),
+        ({'asset': 'test', 'timestamps': '2017-01-01T00:00:00Z'}, CoAP_CODES.BAD_REQUEST,
+         None, None),
+    ]
+    """An array of (payload, expected status code, accepted, rejected)
+    """
+
+    @pytest.mark.parametrize("payload, expected, accepted, rejected", __BULK_REQUESTS)
+    @pytest.mark.asyncio
+    async def test_bulk_payload(self, payload, expected, accepted, rejected):
+        """Runs all test cases in the __BULK_REQUESTS array"""
+        await Ingest.start()
+
+        sv = CoAPIngest()
+        request = MagicMock()
+        request.payload = dumps(payload)
+        return_val = await sv.render_post(request)
+        assert return_val.code == expected
+
+        if accepted is not None:
+            summary = json.loads(return_val.payload.decode('utf-8'))
+            assert summary['accepted'] == accepted
+            assert summary['rejected'] == rejected
+            assert len(summary['errors']) == rejected
+
+        await Ingest.stop()
+
     @pytest.mark.asyncio
     async def test_bad_cbor(self):
         await Ingest.start()
@@ -71,3 +121,48 @@ class TestIngestReadings(object):
         assert return_val.code == CoAP_CODES.BAD_REQUEST
 
         await Ingest.stop()
+
+    @pytest.mark.asyncio
+    async def test_busy(self, monkeypatch):
+        monkeypatch.setattr(Ingest, 'is_available', lambda: False)
+        monkeypatch.setattr(Ingest, 'get_retry_after_seconds', lambda: 7)
+        monkeypatch.setattr(Ingest, '_deferred_readings_stats', 0)
+        monkeypatch.setattr(Ingest, '_discarded_readings_stats', 0)
+
+        sv = CoAPIngest()
+        request = MagicMock()
+        request.payload = dumps([{'timestamp': '2017-01-01T00:00:00Z', 'asset': 'test'}] * 3)
+        return_val = await sv.render_post(request)
+
+        assert return_val.code == CoAP_CODES.SERVICE_UNAVAILABLE
+        assert return_val.opt.max_age == 7
+        assert Ingest._deferred_readings_stats == 3
+        assert Ingest._discarded_readings_stats == 0
+
+    __DISCARDED_REQUESTS = [
+        ({'asset': 'test', 'timestamps': ['2017-01-01T00:00:00Z'] * 3,
+          'readings': {'a': [1, 2]}}, CoAP_CODES.BAD_REQUEST),
+        ([{'timestamp': '2017-01-01T00:00:00Z', 'asset': 'test'}] * 3,
+         CoAP_CODES.INTERNAL_SERVER_ERROR),
+    ]
+    """An array of (payload of 3 readings, expected status code)
+    """
+
+    @pytest.mark.parametrize("payload, expected", __DISCARDED_REQUESTS)
+    @pytest.mark.asyncio
+    async def test_discarded(self, payload, expected, monkeypatch):
+        """Every reading in a payload that fails as a whole is counted as discarded"""
+        async def add_readings_bulk(readings_list):
+            raise RuntimeError('Unexpected')
+
+        monkeypatch.setattr(Ingest, 'is_available', lambda: True)
+        monkeypatch.setattr(Ingest, 'add_readings_bulk', add_readings_bulk)
+        monkeypatch.setattr(Ingest, '_discarded_readings_stats', 0)
+
+        sv = CoAPIngest()
+        request = MagicMock()
+        request.payload = dumps(payload)
+        return_val = await sv.render_post(request)
+
+        assert return_val.code == expected
+        assert Ingest._discarded_readings_stats == 3
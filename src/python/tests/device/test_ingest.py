@@ -0,0 +1,511 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""Unit test for foglamp.device.ingest"""
+
+import asyncio
+import datetime
+import json
+import time
+import uuid
+
+import asyncpg
+import dateutil.parser
+import pytest
+
+from foglamp.device import ingest
+from foglamp.device.ingest import Ingest, READINGS_ENCODERS
+from foglamp.device.spool import Spool
+
+__author__ = "Terris Linenbach"
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+
+@pytest.fixture
+def batch_size_attributes():
+    """Restores the Ingest attributes altered by _adjust_readings_batch_size"""
+    names = ('_min_readings_batch_size', '_max_readings_batch_size',
+             '_readings_batch_wait_seconds', '_readings_arrivals',
+             '_last_batch_size_adjust_time', '_readings_arrival_rate',
+             '_readings_insert_rate')
+    saved = {name: getattr(Ingest, name) for name in names}
+    Ingest._readings_arrival_rate = 0.0
+    Ingest._readings_insert_rate = 0.0
+    Ingest._readings_arrivals = 0
+    Ingest._last_batch_size_adjust_time = time.monotonic() - 1
+    yield
+    for name, value in saved.items():
+        setattr(Ingest, name, value)
+
+
+@pytest.allure.feature("TestAdjustReadingsBatchSize")
+class TestAdjustReadingsBatchSize(object):
+    """Unit tests for foglamp.device.ingest.Ingest._adjust_readings_batch_size
+    """
+    def test_batch_fits_target_latency(self, batch_size_attributes):
+        # 1000 rows per second
+        Ingest._adjust_readings_batch_size(100, 0.1, 0)
+        assert Ingest._max_readings_batch_size == int(
+            1000 * Ingest._target_insert_latency_seconds)
+
+    def test_backlog_grows_batches(self, batch_size_attributes):
+        Ingest._max_readings_batch_size = 150
+        Ingest._adjust_readings_batch_size(150, 10, Ingest._max_readings_queue_size)
+        assert Ingest._max_readings_batch_size == 300
+
+    def test_limits(self, batch_size_attributes):
+        Ingest._adjust_readings_batch_size(1, 100, 0)
+        assert Ingest._max_readings_batch_size == Ingest._min_readings_batch_size_limit
+
+        Ingest._readings_insert_rate = 0.0
+        Ingest._adjust_readings_batch_size(10**9, 1, 0)
+        assert Ingest._max_readings_batch_size == Ingest._max_readings_batch_size_limit
+
+    def test_light_traffic(self, batch_size_attributes):
+        Ingest._readings_arrivals = 1
+        Ingest._adjust_readings_batch_size(1, 0.001, 0)
+        assert Ingest._min_readings_batch_size == 1
+        assert 0 < Ingest._readings_batch_wait_seconds <= Ingest._target_insert_latency_seconds
+
+
+@pytest.fixture
+def readings_queues(monkeypatch):
+    """Initializes Ingest's queues without starting insert tasks or reading configuration"""
+    async def insert_readings(queue_index):
+        pass
+
+    monkeypatch.setattr(Ingest, '_insert_readings', insert_readings)
+    monkeypatch.setattr(Ingest, '_max_readings_queue_size', 2)
+    monkeypatch.setattr(Ingest, '_min_readings_queues', 1)
+    monkeypatch.setattr(Ingest, '_max_readings_queues', 2)
+    monkeypatch.setattr(Ingest, '_auto_scale_readings_queues', True)
+    monkeypatch.setattr(Ingest, '_readings_queues_scale_up_count', 2)
+
+    for name in ('_readings_queues', '_insert_readings_wait_tasks', '_queue_events',
+                 '_insert_readings_tasks'):
+        monkeypatch.setattr(Ingest, name, [])
+    monkeypatch.setattr(Ingest, '_num_readings_queues', 0)
+    monkeypatch.setattr(Ingest, '_current_readings_queue_index', 0)
+    monkeypatch.setattr(Ingest, '_full_readings_queue_count', 0)
+
+
+@pytest.allure.feature("TestAutoScaleReadingsQueues")
+class TestAutoScaleReadingsQueues(object):
+    """Unit tests for auto-scaling foglamp.device.ingest.Ingest readings queues
+    """
+    @pytest.mark.asyncio
+    async def test_scale_up_and_down(self, readings_queues):
+        Ingest._add_readings_queue()
+        assert Ingest.is_available()
+
+        Ingest._readings_queues[0].put_nowait(1)
+        Ingest._readings_queues[0].put_nowait(2)
+        assert Ingest.is_available()
+        assert Ingest._num_readings_queues == 2
+        assert Ingest._current_readings_queue_index == 1
+
+        # The maximum number of queues has been reached
+        Ingest._readings_queues[1].put_nowait(1)
+        Ingest._readings_queues[1].put_nowait(2)
+        assert not Ingest.is_available()
+
+        # Queues that are not empty are not removed
+        assert not Ingest._remove_readings_queue(1)
+
+        Ingest._readings_queues[1].get_nowait()
+        Ingest._readings_queues[1].get_nowait()
+        assert not Ingest._remove_readings_queue(0)
+        assert Ingest._remove_readings_queue(1)
+        assert Ingest._num_readings_queues == 1
+        assert Ingest._current_readings_queue_index == 0
+
+        # Never fewer than _min_readings_queues
+        Ingest._readings_queues[0].get_nowait()
+        Ingest._readings_queues[0].get_nowait()
+        assert not Ingest._remove_readings_queue(0)
+
+
+@pytest.allure.feature("TestEncodeReadings")
+class TestEncodeReadings(object):
+    """Unit tests for foglamp.device.ingest.Ingest._encode_readings
+    """
+    __READINGS = [
+        {},
+        {'velocity': 500, 'temperature': {'value': 32.5, 'unit': 'kelvin'}},
+        {1: 'non-string key'},
+    ]
+
+    @pytest.mark.parametrize("encoder", sorted(READINGS_ENCODERS))
+    def test_encoder(self, encoder, monkeypatch):
+        monkeypatch.setattr(Ingest, '_readings_encoder', READINGS_ENCODERS[encoder])
+        inserts = [('asset', None, None, reading) for reading in self.__READINGS]
+
+        for insert, expected in zip(Ingest._encode_readings(inserts), self.__READINGS):
+            assert insert[:3] == ('asset', None, None)
+            assert json.loads(insert[3]) == json.loads(json.dumps(expected))
+
+
+@pytest.allure.feature("TestAddReadingsBulk")
+class TestAddReadingsBulk(object):
+    """Unit tests for foglamp.device.ingest.Ingest.add_readings_bulk
+    """
+    @pytest.mark.asyncio
+    async def test_results(self, readings_queues, monkeypatch):
+        monkeypatch.setattr(Ingest, '_max_readings_queue_size', 10)
+        monkeypatch.setattr(Ingest, '_auto_scale_readings_queues', False)
+        monkeypatch.setattr(Ingest, '_started', True)
+        monkeypatch.setattr(Ingest, '_discarded_readings_stats', 0)
+        Ingest._add_readings_queue()
+
+        results = await Ingest.add_readings_bulk([
+            {'timestamp': '2017-01-01T00:00:00Z', 'asset': 'test'},
+            {'timestamp': 'bad timestamp', 'asset': 'test'},
+            {'timestamp': '2017-01-01T00:00:00Z', 'asset': 'test', 'readings': 5},
+            5,
+            {'timestamp': '2017-01-01T00:00:00Z', 'asset': 'test',
+             'key': '123e4567-e89b-12d3-a456-426655440000', 'readings': {'a': 5}},
+        ])
+
+        assert results[0] is None
+        assert isinstance(results[1], ValueError)
+        assert isinstance(results[2], TypeError)
+        assert isinstance(results[3], TypeError)
+        assert results[4] is None
+        assert Ingest._discarded_readings_stats == 3
+        assert Ingest._readings_queues[0].qsize() == 2
+
+    @pytest.mark.asyncio
+    async def test_stop_while_waiting(self, readings_queues, monkeypatch):
+        monkeypatch.setattr(Ingest, '_max_readings_queue_size', 1)
+        monkeypatch.setattr(Ingest, '_auto_scale_readings_queues', False)
+        monkeypatch.setattr(Ingest, '_started', True)
+        monkeypatch.setattr(Ingest, '_stop', False)
+        monkeypatch.setattr(Ingest, '_discarded_readings_stats', 0)
+        Ingest._add_readings_queue()
+
+        # Another producer's reading is at the head of the queue
+        queue = Ingest._readings_queues[0]
+        queue.put_nowait('other')
+
+        reading = {'timestamp': '2017-01-01T00:00:00Z', 'asset': 'test'}
+        task = asyncio.ensure_future(Ingest.add_readings_bulk([reading, reading]))
+        await asyncio.sleep(0)
+
+        # The first reading waits for room in the queue
+        assert not task.done()
+        Ingest._stop = True
+        assert queue.get_nowait() == 'other'
+
+        # The waiting reading is added for the insert task to take. The next one is rejected.
+        results = await task
+        assert results[0] is None
+        assert isinstance(results[1], RuntimeError)
+        assert queue.qsize() == 1
+        assert queue.get_nowait()[0] == 'test'
+        assert Ingest._discarded_readings_stats == 1
+
+    @pytest.mark.asyncio
+    async def test_not_started(self, monkeypatch):
+        monkeypatch.setattr(Ingest, '_started', False)
+        with pytest.raises(RuntimeError):
+            await Ingest.add_readings_bulk([])
+
+
+@pytest.allure.feature("TestParseTimestamp")
+class TestParseTimestamp(object):
+    """Unit tests for foglamp.device.ingest._parse_timestamp
+    """
+    __TIMESTAMPS = [
+        '2017-01-01T00:00:00Z',
+        '2017-01-01T00:00:00z',
+        '2017-01-02T01:02:03.23232Z',
+        '2017-01-02T01:02:03.123456789+05:30',
+        '2017-01-02T01:02:03-0800',
+        '2017-01-02 01:02:03.5',
+        '2017-01-02T01:02:03.23232Z-05:00',
+        '2017-01-02',
+        'Jan 2 2017 1:02:03',
+    ]
+
+    @pytest.mark.parametrize("timestamp", __TIMESTAMPS)
+    @pytest.mark.parametrize("fromisoformat", [True, False])
+    def test_same_as_dateutil(self, timestamp, fromisoformat, monkeypatch):
+        if not fromisoformat:
+            monkeypatch.setattr(ingest, '_fromisoformat', None)
+        assert ingest._parse_timestamp(timestamp) == dateutil.parser.parse(timestamp)
+
+    @pytest.mark.parametrize("timestamp", ['bad timestamp', '2017-13-01T00:00:00Z', 5])
+    def test_invalid(self, timestamp):
+        with pytest.raises((ValueError, TypeError)):
+            ingest._parse_timestamp(timestamp)
+
+
+@pytest.allure.feature("TestGetRetryAfterSeconds")
+class TestGetRetryAfterSeconds(object):
+    """Unit tests for foglamp.device.ingest.Ingest.get_retry_after_seconds
+    """
+    @pytest.mark.asyncio
+    async def test_retry_after_seconds(self, readings_queues, monkeypatch):
+        Ingest._add_readings_queue()
+        Ingest._readings_queues[0].put_nowait(1)
+        Ingest._readings_queues[0].put_nowait(2)
+
+        monkeypatch.setattr(Ingest, '_last_readings_insert_time', time.monotonic())
+        monkeypatch.setattr(Ingest, '_readings_insert_rate', 0.5)
+        assert Ingest.get_retry_after_seconds() == 4
+
+        monkeypatch.setattr(Ingest, '_readings_insert_rate', 1000.0)
+        assert Ingest.get_retry_after_seconds() == 1
+
+        monkeypatch.setattr(Ingest, '_readings_insert_rate', 0.0)
+        assert Ingest.get_retry_after_seconds() == Ingest._max_retry_after_seconds
+
+        # Nothing has been inserted recently
+        monkeypatch.setattr(Ingest, '_readings_insert_rate', 1000.0)
+        monkeypatch.setattr(Ingest, '_last_readings_insert_time',
+                            time.monotonic() - Ingest._max_retry_after_seconds)
+        assert Ingest.get_retry_after_seconds() == Ingest._max_retry_after_seconds
+
+
+@pytest.allure.feature("TestReplaySpool")
+class TestReplaySpool(object):
+    """Unit tests for foglamp.device.ingest.Ingest._replay_spool
+    """
+    @pytest.mark.asyncio
+    async def test_replay(self, tmpdir, monkeypatch):
+        class Connection(object):
+            async def close(self):
+                pass
+
+        async def connect(**kwargs):
+            return Connection()
+
+        copied = []
+
+        async def copy_readings(connection, inserts, temp_table_created):
+            if len(copied) == 1:
+                copied.append(None)
+                raise OSError('Connection lost')
+            copied.append(inserts)
+            return True
+
+        spool = Spool(str(tmpdir), fsync=False)
+        batch = [('asset', datetime.datetime(2017, 1, 1, tzinfo=datetime.timezone.utc),
+                  None, '{}')]
+        for _ in range(3):
+            spool.append(batch)
+
+        monkeypatch.setattr(ingest.asyncpg, 'connect', connect)
+        monkeypatch.setattr(Ingest, '_copy_readings', copy_readings)
+        monkeypatch.setattr(Ingest, '_spool', spool)
+        monkeypatch.setattr(Ingest, '_spool_segment_offsets', {})
+        monkeypatch.setattr(Ingest, '_last_spool_time',
+                            time.monotonic() - Ingest._spool_drain_interval_seconds)
+        monkeypatch.setattr(Ingest, '_readings_stats', 0)
+
+        with pytest.raises(OSError):
+            await Ingest._replay_spool()
+        assert Ingest._readings_stats == 1
+
+        # Resumes after the last batch that was inserted
+        await Ingest._replay_spool()
+        assert copied == [batch, None, batch, batch]
+        assert Ingest._readings_stats == 3
+        assert spool.closed_segments() == []
+
+
+    @pytest.mark.asyncio
+    async def test_replay_retired(self, tmpdir, monkeypatch):
+        class Connection(object):
+            async def close(self):
+                pass
+
+        async def connect(**kwargs):
+            return Connection()
+
+        copied = []
+
+        async def copy_readings(connection, inserts, temp_table_created):
+            copied.append(inserts)
+            return True
+
+        spool = Spool(str(tmpdir), fsync=False)
+        batch = [('asset', datetime.datetime(2017, 1, 1, tzinfo=datetime.timezone.utc),
+                  None, '{}')]
+        spool.append(batch)
+
+        monkeypatch.setattr(ingest.asyncpg, 'connect', connect)
+        monkeypatch.setattr(Ingest, '_copy_readings', copy_readings)
+        monkeypatch.setattr(Ingest, '_spool', spool)
+        monkeypatch.setattr(Ingest, '_retired_spools', [])
+        monkeypatch.setattr(Ingest, '_spool_segment_offsets', {})
+        monkeypatch.setattr(Ingest, '_readings_stats', 0)
+
+        # Spooling is disabled while a batch is still being appended
+        spool_readings_task = asyncio.ensure_future(Ingest._spool_readings(batch))
+        await asyncio.sleep(0)
+        config = {name: dict(item, value=item['default'])
+                  for name, item in ingest._DEFAULT_CONFIG.items()}
+        Ingest._apply_config(config)
+        assert Ingest._spool is None
+        assert await spool_readings_task
+        assert Ingest._retired_spools == [spool]
+
+        await Ingest._replay_spool()
+        assert copied == [batch, batch]
+        assert Ingest._retired_spools == []
+        assert spool.closed_segments() == []
+
+
+@pytest.allure.feature("TestApplyConfig")
+class TestApplyConfig(object):
+    """Unit tests for foglamp.device.ingest.Ingest._apply_config
+    """
+    def test_spool(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(Ingest, '_min_readings_queues', Ingest._min_readings_queues)
+        monkeypatch.setattr(Ingest, '_max_readings_queues', Ingest._max_readings_queues)
+        monkeypatch.setattr(Ingest, '_auto_scale_readings_queues', Ingest._auto_scale_readings_queues)
+        monkeypatch.setattr(Ingest, '_write_statistics_seconds', Ingest._write_statistics_seconds)
+        monkeypatch.setattr(Ingest, '_spool', None)
+        monkeypatch.setattr(Ingest, '_retired_spools', [])
+
+        config = {name: dict(item, value=item['default'])
+                  for name, item in ingest._DEFAULT_CONFIG.items()}
+        config['spoolReadings']['value'] = 'True'
+        config['spoolDirectory']['value'] = str(tmpdir.join('a'))
+        config['spoolFsync']['value'] = 'True'
+        Ingest._apply_config(config)
+        spool = Ingest._spool
+        assert spool.fsync
+
+        # Changing fsync keeps the spool
+        config['spoolFsync']['value'] = 'False'
+        Ingest._apply_config(config)
+        assert Ingest._spool is spool
+        assert not spool.fsync
+
+        # Changing the directory retires the spool
+        config['spoolDirectory']['value'] = str(tmpdir.join('b'))
+        Ingest._apply_config(config)
+        assert Ingest._spool is not spool
+        assert Ingest._retired_spools == [spool]
+
+        config['spoolReadings']['value'] = 'False'
+        Ingest._apply_config(config)
+        assert Ingest._spool is None
+        assert len(Ingest._retired_spools) == 2
+
+        # A directory is appended to by one spool at a time
+        config['spoolReadings']['value'] = 'True'
+        config['spoolDirectory']['value'] = str(tmpdir.join('a'))
+        Ingest._apply_config(config)
+        assert Ingest._spool is spool
+        assert len(Ingest._retired_spools) == 1
+
+
+@pytest.allure.feature("TestCopyReadings")
+class TestCopyReadings(object):
+    """Tests for foglamp.device.ingest.Ingest._copy_readings against the foglamp database
+    """
+    __ASSET = 'test_copy_readings'
+
+    @pytest.mark.asyncio
+    async def test_duplicate_key(self):
+        key = uuid.uuid4()
+        user_ts = datetime.datetime(2017, 10, 1, 12, tzinfo=datetime.timezone.utc)
+        connection = await asyncpg.connect(database='foglamp')
+
+        try:
+            await connection.execute('DELETE FROM foglamp.readings WHERE asset_code = $1', self.__ASSET)
+
+            temp_table_created = await Ingest._copy_readings(
+                connection, [(self.__ASSET, user_ts, key, '{"x": 1}')], False)
+
+            # The same key with a different user_ts is not stored again, including when
+            # readings is partitioned by user_ts
+            await Ingest._copy_readings(
+                connection, [(self.__ASSET, user_ts + datetime.timedelta(days=1), key, '{"x": 2}'),
+                             (self.__ASSET, user_ts, None, '{"x": 3}')], temp_table_created)
+
+            rows = await connection.fetch('SELECT reading FROM foglamp.readings WHERE asset_code = $1 '
+                                          'ORDER BY id', self.__ASSET)
+            assert [json.loads(row['reading']) for row in rows] == [{'x': 1}, {'x': 3}]
+        finally:
+            await connection.execute('DELETE FROM foglamp.readings WHERE asset_code = $1', self.__ASSET)
+            await connection.close()
+
+
+@pytest.allure.feature("TestStartWithoutDatabase")
+class TestStartWithoutDatabase(object):
+    """Unit tests for foglamp.device.ingest.Ingest.start when the configuration can not be read
+    """
+    @pytest.mark.asyncio
+    async def test_start(self, tmpdir, monkeypatch):
+        attempts = []
+
+        async def read_config():
+            attempts.append(None)
+            if len(attempts) == 1:
+                raise ConnectionError('Connection refused')
+            Ingest._min_readings_queues = 2
+
+        async def insert_readings(queue_index):
+            pass
+
+        monkeypatch.setattr(Ingest, '_read_config', read_config)
+        monkeypatch.setattr(Ingest, '_read_config_retry_seconds', 0)
+        monkeypatch.setattr(Ingest, '_config_cache_path', str(tmpdir.join('config.json')))
+        monkeypatch.setattr(Ingest, '_insert_readings', insert_readings)
+        monkeypatch.setattr(Ingest, '_min_readings_queues', 1)
+        monkeypatch.setattr(Ingest, '_auto_scale_readings_queues', False)
+
+        await Ingest.start()
+        assert Ingest._started
+        assert Ingest._num_readings_queues == 1
+
+        await Ingest._read_config_task
+        assert len(attempts) == 2
+        assert Ingest._num_readings_queues == 2
+        assert Ingest._read_config_task is None
+
+        await Ingest.stop()
+
+    @pytest.mark.asyncio
+    async def test_saved_config(self, tmpdir, monkeypatch):
+        async def get_category_all_items(category_name):
+            raise ConnectionError('Connection refused')
+
+        async def create_category(*args):
+            pass
+
+        async def insert_readings(queue_index):
+            pass
+
+        monkeypatch.setattr(ingest.configuration_manager, 'create_category', create_category)
+        monkeypatch.setattr(ingest.configuration_manager, 'get_category_all_items',
+                            get_category_all_items)
+        monkeypatch.setattr(Ingest, '_config_cache_path', str(tmpdir.join('config.json')))
+        monkeypatch.setattr(Ingest, '_insert_readings', insert_readings)
+        monkeypatch.setattr(Ingest, '_min_readings_queues', 1)
+        monkeypatch.setattr(Ingest, '_auto_scale_readings_queues', False)
+        monkeypatch.setattr(Ingest, '_max_readings_queues', Ingest._max_readings_queues)
+        monkeypatch.setattr(Ingest, '_write_statistics_seconds', Ingest._write_statistics_seconds)
+        monkeypatch.setattr(Ingest, '_spool', None)
+
+        config = {name: dict(item, value=item['default'])
+                  for name, item in ingest._DEFAULT_CONFIG.items()}
+        config['readingsQueues']['value'] = '3'
+        config['spoolReadings']['value'] = 'True'
+        config['spoolDirectory']['value'] = str(tmpdir.join('spool'))
+        Ingest._write_config_cache(config)
+
+        await Ingest.start()
+        assert Ingest._num_readings_queues == 3
+        assert Ingest._spool is not None
+
+        await Ingest.stop()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""Unit test for foglamp.device.server"""
+
+import asyncio
+
+import pytest
+
+from foglamp import configuration_manager
+from foglamp import db_pool
+from foglamp import statistics
+from foglamp.device import coap
+from foglamp.device import server
+from foglamp.device.ingest import Ingest
+
+__author__ = "Terris Linenbach"
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+
+@pytest.allure.feature("TestStartWithoutDatabase")
+class TestStartWithoutDatabase(object):
+    """Unit tests for foglamp.device.server._start when the database is down
+    """
+    @pytest.mark.asyncio
+    async def test_start(self, tmpdir, monkeypatch):
+        binds = []
+
+        async def create_category(*args):
+            raise ConnectionRefusedError('Connection refused')
+
+        async def insert_readings(queue_index):
+            pass
+
+        async def create_server_context(site, bind):
+            binds.append(bind)
+
+        monkeypatch.setattr(configuration_manager, 'create_category', create_category)
+        monkeypatch.setattr(db_pool, '_loop', None)
+        monkeypatch.setattr(db_pool, '_configure_task', None)
+        monkeypatch.setattr(db_pool, '_configure_retry_seconds', 3600)
+        monkeypatch.setattr(db_pool, '_max_size', db_pool._max_size)
+        monkeypatch.setattr(statistics, '_flush_task', None)
+        monkeypatch.setattr(Ingest, '_config_cache_path', str(tmpdir.join('config.json')))
+        monkeypatch.setattr(Ingest, '_insert_readings', insert_readings)
+        monkeypatch.setattr(Ingest, '_min_readings_queues', 1)
+        monkeypatch.setattr(Ingest, '_auto_scale_readings_queues', False)
+        monkeypatch.setattr(Ingest, '_spool', None)
+        monkeypatch.setattr(coap.aiocoap.Context, 'create_server_context', create_server_context)
+
+        await server._start()
+
+        configure_task = db_pool._configure_task
+        try:
+            # The pools keep their settings until the configuration can be read
+            assert configure_task is not None
+            assert db_pool._max_size == 10
+
+            assert Ingest._started
+            assert Ingest._num_readings_queues == 1
+            assert statistics._flush_task is not None
+
+            await asyncio.sleep(0)
+            assert binds == [('::', 5683)]
+        finally:
+            configure_task.cancel()
+            await Ingest.stop()
+            await statistics.stop()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""Unit test for foglamp.device.spool"""
+
+import datetime
+import uuid
+
+import pytest
+
+from foglamp.device import ingest
+from foglamp.device.spool import Spool
+
+__author__ = "Terris Linenbach"
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+
+def _make_batch(size=3):
+    timestamp = datetime.datetime(2017, 1, 2, 1, 2, 3, 232320, datetime.timezone.utc)
+    return [('pump{}'.format(i), timestamp, uuid.uuid4() if i % 2 else None,
+             '{"velocity": %s}' % i) for i in range(size)]
+
+
+@pytest.allure.feature("TestSpool")
+class TestSpool(object):
+    """Unit tests for foglamp.device.spool.Spool
+    """
+    def test_append_and_read(self, tmpdir):
+        spool = Spool(str(tmpdir), fsync=False)
+        batches = [_make_batch(), _make_batch(1)]
+        for batch in batches:
+            spool.append(batch)
+
+        # The segment being appended to is not returned
+        assert spool.closed_segments() == []
+
+        spool.roll()
+        segments = spool.closed_segments()
+        assert len(segments) == 1
+        assert list(Spool.read_segment(segments[0], ingest._parse_timestamp)) == batches
+
+        Spool.remove_segment(segments[0])
+        assert spool.closed_segments() == []
+
+    def test_segments(self, tmpdir):
+        spool = Spool(str(tmpdir), max_segment_bytes=1)
+        spool.append(_make_batch())
+        spool.append(_make_batch())
+        spool.close()
+
+        segments = spool.closed_segments()
+        assert len(segments) == 2
+
+        # Numbering continues after the last existing segment
+        spool = Spool(str(tmpdir), max_segment_bytes=1)
+        spool.append(_make_batch())
+        assert spool.closed_segments()[:2] == segments
+        assert len(spool.closed_segments()) == 3
+
+    def test_partial_batch(self, tmpdir):
+        spool = Spool(str(tmpdir), fsync=False)
+        batch = _make_batch()
+        spool.append(batch)
+        spool.close()
+
+        segment = spool.closed_segments()[0]
+        with open(segment, 'ab') as segment_file:
+            segment_file.write(b'[["pump0","2017')
+
+        assert list(Spool.read_segment(segment, ingest._parse_timestamp)) == [batch]
+
+    def test_empty_segment(self, tmpdir):
+        segment = tmpdir.join('readings-{:020d}.spool'.format(1))
+        segment.write('')
+        assert list(Spool.read_segment(str(segment), ingest._parse_timestamp)) == []
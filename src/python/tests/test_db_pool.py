@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""Unit test for foglamp.db_pool"""
+
+import asyncio
+
+import pytest
+
+from foglamp import db_pool
+
+__author__ = "Terris Linenbach"
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+
+class _Connection(object):
+    def __init__(self, healthy=True):
+        self.healthy = healthy
+
+    async def fetchval(self, query):
+        if not self.healthy:
+            raise ConnectionError('Connection lost')
+        return 1
+
+
+class _Pool(object):
+    def __init__(self, connection):
+        self.connection = connection
+        self.acquired = 0
+        self.terminated = False
+
+    async def acquire(self):
+        self.acquired += 1
+        return self.connection
+
+    async def release(self, connection):
+        self.acquired -= 1
+
+    def terminate(self):
+        self.terminated = True
+
+    async def close(self):
+        pass
+
+
+@pytest.fixture
+def pools(monkeypatch):
+    """Replaces asyncpg.create_pool. Returns the pools that were created."""
+    created = []
+    connections = []
+
+    async def create_pool():
+        await asyncio.sleep(0)
+        pool = _Pool(connections.pop(0) if connections else _Connection())
+        created.append(pool)
+        return pool
+
+    monkeypatch.setattr(db_pool, '_create_pool', create_pool)
+    monkeypatch.setattr(db_pool, '_loop', None)
+    monkeypatch.setattr(db_pool, '_pool', None)
+    monkeypatch.setattr(db_pool, '_pool_future', None)
+    monkeypatch.setattr(db_pool, '_engine', None)
+    monkeypatch.setattr(db_pool, '_engine_future', None)
+    monkeypatch.setattr(db_pool, '_last_health_check_time', 0.0)
+
+    return created, connections
+
+
+@pytest.allure.feature("TestDbPool")
+class TestDbPool(object):
+    """Unit tests for foglamp.db_pool
+    """
+    @pytest.mark.asyncio
+    async def test_one_pool(self, pools):
+        created, _ = pools
+
+        results = await asyncio.gather(db_pool.get_pool(), db_pool.get_pool())
+        assert len(created) == 1
+        assert results == [created[0], created[0]]
+
+        async with db_pool.acquire() as connection:
+            assert connection is created[0].connection
+            assert created[0].acquired == 1
+        assert created[0].acquired == 0
+
+    @pytest.mark.asyncio
+    async def test_unhealthy_connection(self, pools):
+        created, connections = pools
+        connections.extend([_Connection(healthy=False), _Connection()])
+
+        async with db_pool.acquire() as connection:
+            assert connection is created[1].connection
+
+        assert created[0].terminated
+        assert len(created) == 2
+
+        # Health checks are not repeated until _health_check_seconds have passed
+        created[1].connection.healthy = False
+        async with db_pool.acquire() as connection:
+            assert connection is created[1].connection
+
+    @pytest.mark.asyncio
+    async def test_close(self, pools):
+        created, _ = pools
+
+        await db_pool.get_pool()
+        await db_pool.close()
+        await db_pool.get_pool()
+        assert len(created) == 2
+
+
+@pytest.allure.feature("TestConfigure")
+class TestConfigure(object):
+    """Unit tests for foglamp.db_pool.configure
+    """
+    @pytest.mark.asyncio
+    async def test_database_down(self, monkeypatch):
+        attempts = []
+
+        async def read_config():
+            attempts.append(None)
+            if len(attempts) < 3:
+                raise ConnectionRefusedError('Connection refused')
+
+        monkeypatch.setattr(db_pool, '_read_config', read_config)
+        monkeypatch.setattr(db_pool, '_loop', None)
+        monkeypatch.setattr(db_pool, '_configure_task', None)
+        monkeypatch.setattr(db_pool, '_configure_retry_seconds', 0)
+
+        await db_pool.configure()
+        assert db_pool._configure_task is not None
+
+        # A second failure does not start another task
+        task = db_pool._configure_task
+        await db_pool.configure()
+        assert db_pool._configure_task is task
+
+        await task
+        assert len(attempts) == 3
+        assert db_pool._configure_task is None
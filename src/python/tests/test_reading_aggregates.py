@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""Unit test for foglamp.reading_aggregates"""
+
+import datetime
+
+import asyncpg
+import pytest
+
+from foglamp import db_pool
+from foglamp import reading_aggregates
+
+__author__ = "Terris Linenbach"
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+
+@pytest.allure.feature("TestReadingAggregates")
+class TestReadingAggregates(object):
+    """Unit tests for foglamp.reading_aggregates
+    """
+    def test_bucket_seconds_for_window(self):
+        assert reading_aggregates.bucket_seconds_for_window(60) == 1
+        assert reading_aggregates.bucket_seconds_for_window(24*3600) == 1
+        assert reading_aggregates.bucket_seconds_for_window(7*24*3600) == 60
+        assert reading_aggregates.bucket_seconds_for_window(90*24*3600) == 3600
+        assert reading_aggregates.bucket_seconds_for_window() == 3600
+
+    def test_bucket_seconds_for_width(self):
+        assert reading_aggregates.bucket_seconds_for_width(30) == 1
+        assert reading_aggregates.bucket_seconds_for_width(300) == 60
+        assert reading_aggregates.bucket_seconds_for_width(7200) == 3600
+        assert reading_aggregates.bucket_seconds_for_width(90) == 1
+
+    def test_roll_up_statement(self):
+        # One upsert per bucket length, and last_id only advances when readings were found
+        for seconds in reading_aggregates.BUCKET_SECONDS:
+            assert 'buckets_{} AS ('.format(seconds) in reading_aggregates._ROLL_UP_STATEMENT
+        assert 'upper_bound.id IS NOT NULL' in reading_aggregates._ROLL_UP_STATEMENT
+
+
+_ASSET = 'test_roll_up'
+
+_INSERT_READING = ("INSERT INTO foglamp.readings (asset_code, reading, user_ts, ts) "
+                   "VALUES ($1, $2::jsonb, $3, now() - interval '1 minute')")
+"""Inserts a reading that the roll-up does not leave for the next call"""
+
+
+async def _delete_asset(conn):
+    for table in ('readings', 'reading_aggregates', 'asset_catalog', 'asset_catalog_hours'):
+        await conn.execute('DELETE FROM foglamp.{} WHERE asset_code = $1'.format(table), _ASSET)
+
+
+async def _buckets(conn, reading_key='x'):
+    return [tuple(row) for row in await conn.fetch(
+        'SELECT bucket_seconds, bucket_ts, count, sum, min, max FROM foglamp.reading_aggregates '
+        'WHERE asset_code = $1 AND reading_key = $2 ORDER BY bucket_seconds, bucket_ts', _ASSET, reading_key)]
+
+
+@pytest.allure.feature("TestRollUp")
+class TestRollUp(object):
+    """Tests for foglamp.reading_aggregates.roll_up against the foglamp database
+    """
+    @pytest.mark.asyncio
+    async def test_roll_up(self):
+        hour = datetime.datetime.now(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0)
+        conn = await asyncpg.connect(database='foglamp')
+
+        try:
+            await _delete_asset(conn)
+            for reading, seconds in (('{"x": 1}', 0.2), ('{"x": 3, "y": "on"}', 0.7), ('{"x": 1e400}', 1),
+                                     ('{"x": 2}', 90)):
+                await conn.execute(_INSERT_READING, _ASSET, reading, hour + datetime.timedelta(seconds=seconds))
+
+            await reading_aggregates.roll_up()
+            # Readings are added once
+            await reading_aggregates.roll_up()
+
+            # 1e400 does not fit a double precision and is left out
+            minute = datetime.timedelta(minutes=1)
+            assert await _buckets(conn) == [
+                (1, hour, 2, 4.0, 1.0, 3.0),
+                (1, hour + datetime.timedelta(seconds=90), 1, 2.0, 2.0, 2.0),
+                (60, hour, 2, 4.0, 1.0, 3.0),
+                (60, hour + minute, 1, 2.0, 2.0, 2.0),
+                (3600, hour, 3, 6.0, 1.0, 3.0)]
+            assert await _buckets(conn, 'y') == []
+
+            catalog = await conn.fetchrow('SELECT reading_count, first_ts, last_ts, reading_keys '
+                                          'FROM foglamp.asset_catalog WHERE asset_code = $1', _ASSET)
+            assert tuple(catalog) == (4, hour + datetime.timedelta(seconds=0.2),
+                                      hour + datetime.timedelta(seconds=90), ['x', 'y'])
+            assert await conn.fetchval('SELECT reading_count FROM foglamp.asset_catalog_hours '
+                                       'WHERE hour_ts = $1 AND asset_code = $2', hour, _ASSET) == 4
+        finally:
+            await _delete_asset(conn)
+            await conn.close()
+            await db_pool.close()
+
+    @pytest.mark.asyncio
+    async def test_late_commit(self):
+        hour = datetime.datetime.now(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0)
+        conn = await asyncpg.connect(database='foglamp')
+        late_conn = await asyncpg.connect(database='foglamp')
+
+        try:
+            await _delete_asset(conn)
+
+            # The first reading takes the smaller id but commits after the roll-up
+            transaction = late_conn.transaction()
+            await transaction.start()
+            await late_conn.execute(_INSERT_READING, _ASSET, '{"x": 5}', hour)
+            await conn.execute(_INSERT_READING, _ASSET, '{"x": 7}', hour)
+
+            await reading_aggregates.roll_up()
+            assert await _buckets(conn) == [(seconds, hour, 1, 7.0, 7.0, 7.0)
+                                            for seconds in reading_aggregates.BUCKET_SECONDS]
+
+            await transaction.commit()
+
+            await reading_aggregates.roll_up()
+            await reading_aggregates.roll_up()
+            assert await _buckets(conn) == [(seconds, hour, 2, 12.0, 5.0, 7.0)
+                                            for seconds in reading_aggregates.BUCKET_SECONDS]
+            assert await conn.fetchval('SELECT reading_count FROM foglamp.asset_catalog WHERE asset_code = $1',
+                                       _ASSET) == 2
+        finally:
+            await _delete_asset(conn)
+            await late_conn.close()
+            await conn.close()
+            await db_pool.close()
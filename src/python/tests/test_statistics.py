@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""Unit test for foglamp.statistics"""
+
+import asyncio
+
+import pytest
+
+from foglamp import statistics
+
+__author__ = "Terris Linenbach"
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+
+@pytest.fixture
+def connection(connection, monkeypatch):
+    """Starts without pending increments"""
+    monkeypatch.setattr(statistics, '_pending', {})
+    return connection
+
+
+@pytest.allure.feature("TestStatistics")
+class TestStatistics(object):
+    """Unit tests for foglamp.statistics
+    """
+    @pytest.mark.asyncio
+    async def test_flush(self, connection):
+        statistics.increment('READINGS', 5)
+        statistics.increment('DISCARDED')
+        statistics.increment('READINGS', 2)
+        statistics.increment('SENT', 0)
+
+        await statistics.flush()
+
+        assert len(connection.queries) == 1
+        keys, values = connection.queries[0][1]
+        assert dict(zip(keys, values)) == {'READINGS': 7, 'DISCARDED': 1}
+
+        # Nothing to write
+        await statistics.flush()
+        assert len(connection.queries) == 1
+
+    @pytest.mark.asyncio
+    async def test_flush_failure(self, connection):
+        statistics.increment('READINGS', 5)
+        connection.fail = True
+
+        with pytest.raises(ConnectionError):
+            await statistics.update_statistics_value('PURGED', 3)
+
+        connection.fail = False
+        statistics.increment('READINGS', 1)
+        await statistics.flush()
+
+        keys, values = connection.queries[0][1]
+        assert dict(zip(keys, values)) == {'READINGS': 6, 'PURGED': 3}
+
+    @pytest.mark.asyncio
+    async def test_flush_cancelled(self, connection):
+        statistics.increment('READINGS', 5)
+        connection.blocked = asyncio.Event()
+
+        task = asyncio.ensure_future(statistics.flush())
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        # The increments are written by the next flush
+        connection.blocked = None
+        await statistics.flush()
+        keys, values = connection.queries[0][1]
+        assert dict(zip(keys, values)) == {'READINGS': 5}
+
+    @pytest.mark.asyncio
+    async def test_start_stop(self, connection, monkeypatch):
+        async def create_category(*args):
+            pass
+
+        async def get_category_all_items(category_name):
+            return {'flushSeconds': {'value': '1'}}
+
+        monkeypatch.setattr(statistics.configuration_manager, 'create_category', create_category)
+        monkeypatch.setattr(statistics.configuration_manager, 'get_category_all_items', get_category_all_items)
+        monkeypatch.setattr(statistics, '_flush_seconds', 5)
+        monkeypatch.setattr(statistics, '_flush_task', None)
+
+        await statistics.start()
+        assert statistics._flush_seconds == 1
+
+        # Written by the periodic flush
+        statistics._flush_seconds = 0.01
+        statistics.increment('READINGS', 5)
+        await asyncio.sleep(0.05)
+        assert dict(zip(*connection.queries[0][1])) == {'READINGS': 5}
+
+        # Written by stop()
+        statistics.increment('SENT', 2)
+        await statistics.stop()
+        assert statistics._flush_task is None
+        assert dict(zip(*connection.queries[-1][1])) == {'SENT': 2}
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""Unit test for foglamp.update_statistics_history and statistics history tier selection"""
+
+import datetime
+
+import pytest
+
+from foglamp import update_statistics_history
+from foglamp.core.api import statistics_db_services
+
+__author__ = "Terris Linenbach"
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+_NOW = datetime.datetime(2017, 9, 30, 12, 0, 0, tzinfo=datetime.timezone.utc)
+
+
+def _table(hours_ago, hours, retention_days=None):
+    if retention_days is None:
+        retention_days = update_statistics_history.get_retention_days()
+
+    start = _NOW - datetime.timedelta(hours=hours_ago)
+    tier = statistics_db_services.choose_history_tier(
+        start, start + datetime.timedelta(hours=hours), retention_days, _NOW)
+    return tier.table
+
+
+@pytest.allure.feature("TestUpdateStatisticsHistory")
+class TestUpdateStatisticsHistory(object):
+    """Unit tests for foglamp.update_statistics_history
+    """
+    def test_retention_days(self):
+        config = {'historyRetentionDays': {'value': '2', 'default': '7'},
+                  'dayRetentionDays': {'value': '-1', 'default': '0'}}
+
+        assert update_statistics_history.get_retention_days(config) == {
+            'statistics_history': 2,
+            'statistics_history_minutes': 31,
+            'statistics_history_hours': 366,
+            'statistics_history_days': 0}
+
+    def test_range_length(self):
+        assert _table(1, 1) == 'statistics_history'
+        assert _table(24, 24) == 'statistics_history_minutes'
+        assert _table(24*7, 24*7) == 'statistics_history_hours'
+        assert _table(24*200, 24*200) == 'statistics_history_days'
+
+    def test_retention(self):
+        # Raw history is kept for 7 days
+        assert _table(24*8, 1) == 'statistics_history_minutes'
+        # Per-minute history is kept for 31 days
+        assert _table(24*40, 1) == 'statistics_history_hours'
+
+        retention_days = dict.fromkeys(update_statistics_history.get_retention_days(), 1)
+        assert _table(48, 1, retention_days) == 'statistics_history_days'
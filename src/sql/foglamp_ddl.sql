@@ -505,14 +505,112 @@ ALTER TABLE foglamp.readings OWNER to foglamp;
 COMMENT ON TABLE foglamp.readings IS
 'Readings from sensors and devices.';
 
-CREATE INDEX fki_readings_fk1
-    ON foglamp.readings USING btree (asset_code)
-    TABLESPACE foglamp;
 
 CREATE INDEX readings_ix1
     ON foglamp.readings USING btree (read_key)
     TABLESPACE foglamp;
 
+-- Index: readings_ix2 - For the purge process, which looks for readings older than a given user_ts.
+-- user_ts mostly grows with id, so a BRIN index is small and cheap to maintain during ingest.
+CREATE INDEX readings_ix2
+    ON foglamp.readings USING brin (user_ts)
+    TABLESPACE foglamp;
+
+-- Index: readings_ix3 - For the asset browser, which pages through the readings of an asset
+-- newest first. Also serves lookups by asset_code alone.
+CREATE INDEX readings_ix3
+    ON foglamp.readings USING btree (asset_code, user_ts DESC, id DESC)
+    TABLESPACE foglamp;
+
+
+-- Reading aggregates table
+-- Count, sum, min and max of the numeric values in readings, per asset, per key
+-- within reading and per bucket of 1, 60 or 3600 seconds of user_ts.
+-- Maintained by the readings aggregator (foglamp.reading_aggregates).
+CREATE TABLE foglamp.reading_aggregates (
+    asset_code     character varying(50)       NOT NULL,         -- readings.asset_code
+    reading_key    character varying(255)      NOT NULL,         -- A top level key in readings.reading
+    bucket_seconds integer                     NOT NULL,         -- Length of the bucket: 1, 60 or 3600 seconds
+    bucket_ts      timestamp(6) with time zone NOT NULL,         -- Start of the bucket
+    count          bigint                      NOT NULL DEFAULT 0,
+    sum            double precision            NOT NULL DEFAULT 0,
+    min            double precision            NOT NULL,
+    max            double precision            NOT NULL,
+    CONSTRAINT reading_aggregates_pkey PRIMARY KEY (asset_code, reading_key, bucket_seconds, bucket_ts)
+         USING INDEX TABLESPACE foglamp )
+  WITH ( OIDS = FALSE )
+  TABLESPACE foglamp;
+
+ALTER TABLE foglamp.reading_aggregates OWNER to foglamp;
+
+-- Index: reading_aggregates_ix1 - For removing old buckets
+CREATE INDEX reading_aggregates_ix1
+    ON foglamp.reading_aggregates USING btree (bucket_seconds, bucket_ts)
+    TABLESPACE foglamp;
+
+
+-- Reading aggregates state
+-- The largest readings.id included in foglamp.reading_aggregates. One row.
+CREATE TABLE foglamp.reading_aggregates_state (
+    id         smallint NOT NULL,
+    last_id    bigint   NOT NULL DEFAULT 0,
+    CONSTRAINT reading_aggregates_state_pkey PRIMARY KEY (id)
+         USING INDEX TABLESPACE foglamp )
+  WITH ( OIDS = FALSE )
+  TABLESPACE foglamp;
+
+ALTER TABLE foglamp.reading_aggregates_state OWNER to foglamp;
+
+
+-- Reading aggregates gaps
+-- Ranges of readings.id, not greater than reading_aggregates_state.last_id, that were missing when
+-- the readings aggregator moved past them, because the transactions that inserted them had not
+-- committed. Readings that appear in a range are aggregated by the next call and the range is
+-- narrowed. Ranges are removed after a while.
+CREATE TABLE foglamp.reading_aggregates_gaps (
+    first_id   bigint                      NOT NULL,
+    last_id    bigint                      NOT NULL,
+    ts         timestamp(6) with time zone NOT NULL DEFAULT now() )  -- When the range was found
+  WITH ( OIDS = FALSE )
+  TABLESPACE foglamp;
+
+ALTER TABLE foglamp.reading_aggregates_gaps OWNER to foglamp;
+
+
+-- Asset catalog
+-- Number of readings, first and last user_ts and the top level keys seen in readings.reading,
+-- per asset. Maintained by the readings aggregator (foglamp.reading_aggregates), which adds the
+-- readings it aggregates, and by the purge process, which subtracts the aggregated readings that
+-- it removes. Keys are not removed when the readings that had them are purged.
+CREATE TABLE foglamp.asset_catalog (
+    asset_code    character varying(50)       NOT NULL,         -- readings.asset_code
+    reading_count bigint                      NOT NULL DEFAULT 0,
+    first_ts      timestamp(6) with time zone,                  -- Oldest user_ts
+    last_ts       timestamp(6) with time zone,                  -- Newest user_ts
+    reading_keys  text[]                      NOT NULL DEFAULT '{}'::text[],
+    CONSTRAINT asset_catalog_pkey PRIMARY KEY (asset_code)
+         USING INDEX TABLESPACE foglamp )
+  WITH ( OIDS = FALSE )
+  TABLESPACE foglamp;
+
+ALTER TABLE foglamp.asset_catalog OWNER to foglamp;
+
+
+-- Asset catalog hours
+-- The readings counted in foglamp.asset_catalog, per hour of user_ts and asset. When the purge
+-- process drops a partition of a partitioned readings table, it subtracts the counts of the
+-- partition's hours from foglamp.asset_catalog instead of counting the partition's readings.
+CREATE TABLE foglamp.asset_catalog_hours (
+    hour_ts       timestamp(6) with time zone NOT NULL,         -- Start of the hour
+    asset_code    character varying(50)       NOT NULL,         -- readings.asset_code
+    reading_count bigint                      NOT NULL DEFAULT 0,
+    CONSTRAINT asset_catalog_hours_pkey PRIMARY KEY (hour_ts, asset_code)
+         USING INDEX TABLESPACE foglamp )
+  WITH ( OIDS = FALSE )
+  TABLESPACE foglamp;
+
+ALTER TABLE foglamp.asset_catalog_hours OWNER to foglamp;
+
 
 -- Destinations table
 CREATE TABLE foglamp.destinations (
@@ -625,6 +723,49 @@ CREATE TABLE foglamp.statistics_history (
 
 ALTER TABLE foglamp.statistics_history OWNER to foglamp;
 
+CREATE INDEX statistics_history_ix1
+    ON foglamp.statistics_history USING btree (history_ts, key)
+    TABLESPACE foglamp;
+
+
+-- Statistics history per minute
+-- Sum of statistics_history.value per minute. Maintained by the stats collector.
+CREATE TABLE foglamp.statistics_history_minutes (
+       key         character(10)               NOT NULL COLLATE pg_catalog."default",                         -- Compound primary key, all uppercase
+       history_ts  timestamp(6) with time zone NOT NULL,                                                      -- Compound primary key, the start of the minute
+       value       bigint                      NOT NULL DEFAULT 0,                                            -- Integer value, the statistics
+       CONSTRAINT statistics_history_minutes_pkey PRIMARY KEY (history_ts, key)
+            USING INDEX TABLESPACE foglamp )
+  WITH ( OIDS = FALSE ) TABLESPACE foglamp;
+
+ALTER TABLE foglamp.statistics_history_minutes OWNER to foglamp;
+
+
+-- Statistics history per hour
+-- Sum of statistics_history.value per hour. Maintained by the stats collector.
+CREATE TABLE foglamp.statistics_history_hours (
+       key         character(10)               NOT NULL COLLATE pg_catalog."default",                         -- Compound primary key, all uppercase
+       history_ts  timestamp(6) with time zone NOT NULL,                                                      -- Compound primary key, the start of the hour
+       value       bigint                      NOT NULL DEFAULT 0,                                            -- Integer value, the statistics
+       CONSTRAINT statistics_history_hours_pkey PRIMARY KEY (history_ts, key)
+            USING INDEX TABLESPACE foglamp )
+  WITH ( OIDS = FALSE ) TABLESPACE foglamp;
+
+ALTER TABLE foglamp.statistics_history_hours OWNER to foglamp;
+
+
+-- Statistics history per day
+-- Sum of statistics_history.value per day. Maintained by the stats collector.
+CREATE TABLE foglamp.statistics_history_days (
+       key         character(10)               NOT NULL COLLATE pg_catalog."default",                         -- Compound primary key, all uppercase
+       history_ts  timestamp(6) with time zone NOT NULL,                                                      -- Compound primary key, the start of the day
+       value       bigint                      NOT NULL DEFAULT 0,                                            -- Integer value, the statistics
+       CONSTRAINT statistics_history_days_pkey PRIMARY KEY (history_ts, key)
+            USING INDEX TABLESPACE foglamp )
+  WITH ( OIDS = FALSE ) TABLESPACE foglamp;
+
+ALTER TABLE foglamp.statistics_history_days OWNER to foglamp;
+
 
 -- Resources table
 CREATE TABLE foglamp.resources (
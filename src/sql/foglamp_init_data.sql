@@ -108,7 +108,8 @@ INSERT INTO foglamp.statistics ( key, description, value, previous_value )
             ( 'UNSENT',     'The number of readings filtered out in the send process', 0, 0 ),
             ( 'PURGED',     'The number of readings removed from the buffer by the purge process', 0, 0 ),
             ( 'UNSNPURGED', 'The number of readings that were purged from the buffer before being sent', 0, 0 ),
-            ( 'DISCARDED',  'The number of readings discarded at the input side by FogLAMP, i.e. discarded before being  placed in the buffer. This may be due to some error in the readings themselves.', 0, 0 );
+            ( 'DISCARDED',  'The number of readings discarded at the input side by FogLAMP, i.e. discarded before being  placed in the buffer. This may be due to some error in the readings themselves.', 0, 0 ),
+            ( 'DEFERRED',   'The number of readings the input side of FogLAMP asked devices to resend later because it was busy', 0, 0 );
 
 -- Schedules
 -- Use this to create guids: https://www.uuidgenerator.net/version1 */
@@ -117,6 +118,7 @@ INSERT INTO foglamp.statistics ( key, description, value, previous_value )
 insert into foglamp.scheduled_processes (name, script) values ('device', '["python3", "-m", "foglamp.device"]');
 insert into foglamp.scheduled_processes (name, script) values ('purge', '["python3", "-m", "foglamp.data_purge"]');
 insert into foglamp.scheduled_processes (name, script) values ('stats collector', '["python3", "-m", "foglamp.update_statistics_history"]');
+insert into foglamp.scheduled_processes (name, script) values ('readings aggregator', '["python3", "-m", "foglamp.reading_aggregates"]');
 insert into foglamp.scheduled_processes (name, script) values ('omf translator', '["python3", "-m", "foglamp.translators.omf_translator"]');
 insert into foglamp.scheduled_processes (name, script) values ('statistics to pi', '["python3", "-m", "foglamp.translators.statistics_to_pi"]');
 
@@ -138,6 +140,12 @@ schedule_time, schedule_interval, exclusive)
 values ('2176eb68-7303-11e7-8cf7-a6006ad3dba0', 'stats collector', 'stats collector', 3,
 NULL, '00:00:15', true);
 
+-- Run the readings aggregator every 5 seconds
+insert into foglamp.schedules(id, schedule_name, process_name, schedule_type,
+schedule_time, schedule_interval, exclusive)
+values ('5d3fd8c4-a1b2-11e7-9c4e-be2e44b06b34', 'readings aggregator', 'readings aggregator', 3,
+NULL, '00:00:05', true);
+
 -- Run FogLAMP statistics into PI  every 30 seconds
 insert into foglamp.schedules(id, schedule_name, process_name, schedule_type,
 schedule_time, schedule_interval, exclusive)
@@ -151,6 +159,9 @@ schedule_time, schedule_interval, exclusive)
 values ('2b614d26-760f-11e7-b5a5-be2e44b06b34', 'omf translator', 'omf translator', 3,
 NULL, '00:00:15', true);
 
+-- Readings aggregator state
+INSERT INTO foglamp.reading_aggregates_state ( id, last_id ) VALUES ( 1, 0 );
+
 -- Temporary  omf translator configuration
 INSERT INTO foglamp.destinations(id,description, ts)                       VALUES (1,'OMF', now());
 INSERT INTO foglamp.streams(id,destination_id,description, last_object,ts) VALUES (1,1,'OMF translator', 0,now());  
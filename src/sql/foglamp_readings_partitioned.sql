@@ -0,0 +1,75 @@
+----------------------------------------------------------------------
+-- Copyright (c) 2017 DB Software, Inc.
+--
+-- Licensed under the Apache License, Version 2.0 (the "License");
+-- you may not use this file except in compliance with the License.
+-- You may obtain a copy of the License at
+--
+--     http://www.apache.org/licenses/LICENSE-2.0
+--
+-- Unless required by applicable law or agreed to in writing, software
+-- distributed under the License is distributed on an "AS IS" BASIS,
+-- WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+-- See the License for the specific language governing permissions and
+-- limitations under the License.
+----------------------------------------------------------------------
+
+--
+-- foglamp_readings_partitioned.sql
+--
+-- Optional PostgreSQL script that replaces foglamp.readings with a table
+-- partitioned by user_ts. Requires PostgreSQL 11 or later.
+--
+-- The purge process creates a partition per day or per hour (PURGE_READ
+-- partitionInterval) and drops whole partitions once they are older than
+-- the configured age, instead of deleting rows.
+--
+
+-- NOTE:
+-- This script drops foglamp.readings. It must be launched after
+-- foglamp_ddl.sql, before readings are stored, with:
+-- PGPASSWORD=foglamp psql -U foglamp -h localhost -f foglamp_readings_partitioned.sql foglamp
+
+
+DROP TABLE foglamp.readings;
+
+-- Readings table
+-- The partition key must be part of every unique constraint, so the
+-- constraint on read_key only rejects readings that also have the same
+-- user_ts. The device server's ingest skips readings whose read_key is
+-- already stored with any user_ts, using readings_ix1. Two batches that are
+-- inserted concurrently can still store the same read_key with different
+-- user_ts values.
+CREATE TABLE foglamp.readings (
+    id         bigint                      NOT NULL DEFAULT nextval('foglamp.readings_id_seq'::regclass),
+    asset_code character varying(50)       NOT NULL,                      -- The provided asset code. Not necessarily located in the
+                                                                          -- assets table.
+    read_key   uuid,                                                      -- An optional unique key used to avoid double-loading.
+    reading    jsonb                       NOT NULL DEFAULT '{}'::jsonb,  -- The json object received
+    user_ts    timestamp(6) with time zone NOT NULL DEFAULT now(),        -- The user timestamp extracted by the received message
+    ts         timestamp(6) with time zone NOT NULL DEFAULT now(),
+    CONSTRAINT readings_pkey PRIMARY KEY (id, user_ts),
+    CONSTRAINT readings_read_key UNIQUE (read_key, user_ts)
+  )
+  PARTITION BY RANGE (user_ts);
+
+ALTER TABLE foglamp.readings OWNER to foglamp;
+COMMENT ON TABLE foglamp.readings IS
+'Readings from sensors and devices. Partitioned by user_ts.';
+
+CREATE INDEX readings_ix1
+    ON foglamp.readings USING btree (read_key);
+
+CREATE INDEX readings_ix2
+    ON foglamp.readings USING brin (user_ts);
+
+CREATE INDEX readings_ix3
+    ON foglamp.readings USING btree (asset_code, user_ts DESC, id DESC);
+
+-- Holds readings outside of the range of every other partition.
+-- The purge process moves them when it creates the partition they belong to.
+CREATE TABLE foglamp.readings_default
+    PARTITION OF foglamp.readings DEFAULT
+    TABLESPACE foglamp;
+
+ALTER TABLE foglamp.readings_default OWNER to foglamp;